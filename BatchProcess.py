@@ -0,0 +1,276 @@
+"""
+Headless batch processing for the Smart Traffic Control System.
+Walks a directory of archived lane captures, runs edge detection across worker processes and streams
+one result row per image to CSV or JSON Lines. Re-running with the same output file resumes where an
+interrupted run stopped.
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Set
+
+from utils import ConfigManager, FileManager, LoggerSetup, ReferenceStatsCache, TrafficDataManager, setup
+
+
+logger = LoggerSetup.get_logger("BatchProcess")
+
+
+FIELDS = ["path", "lane", "status", "white_pixels", "traffic_level", "green_time",
+          "decode_ms", "detect_ms", "total_ms", "message"]
+
+# Rows that count as done on resume: the image itself was processed or rejected.
+# "error" (e.g. a capture still being written) and "no_lane" (fixed with --lane or a new layout) are retried
+COMPLETED_STATUSES = ("ok", "invalid")
+
+# Lane number taken from a directory or file name such as "lane3/" or "Lane_2_0800.png"
+DEFAULT_LANE_PATTERN = r"lane[ _-]?(\d+)"
+
+# Per-process state built once by _init_worker
+_worker_config = None
+_worker_backend = None
+_worker_metrics = False
+
+
+def _init_worker(config_file: str):
+    """Load the configuration, instrument the hot paths and build the edge-detection backend once per worker process"""
+    global _worker_config, _worker_backend, _worker_metrics
+    from EdgeBackends import backend_from_config
+    _worker_config = ConfigManager(config_file)
+    if _worker_config.get("metrics.enabled", False):
+        from Metrics import setup_worker_metrics
+        _worker_metrics = setup_worker_metrics(_worker_config)
+    _worker_backend = backend_from_config(_worker_config)
+
+
+def _process_image(path: str, lane: Optional[int] = None) -> Dict:
+    """Decode, detect and count one image of a lane inside a worker process"""
+    from EdgeBackends import load_grayscale
+    start = time.perf_counter()
+    gray = load_grayscale(path, _worker_config)
+    decoded = time.perf_counter()
+    result = _worker_backend.detect_result(gray, lane=lane, source=path, stream=lane)
+    end = time.perf_counter()
+    processed = {
+        "white_pixels": result.white_pixels,
+        "decode_ms": round((decoded - start) * 1000, 3),
+        "detect_ms": round((end - decoded) * 1000, 3),
+    }
+    if _worker_metrics:
+        from Metrics import registry
+        processed["metrics"] = registry.drain()
+    return processed
+
+
+def find_images(root: str, formats: List[str]) -> Iterator[str]:
+    """Yield image paths under root in a stable (sorted) order"""
+    suffixes = tuple(f".{fmt.lower()}" for fmt in formats)
+    for directory, subdirs, files in os.walk(root):
+        subdirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(suffixes):
+                yield os.path.join(directory, name)
+
+
+def lane_for_path(path: str, pattern: str = DEFAULT_LANE_PATTERN, default: Optional[int] = None) -> Optional[int]:
+    """Lane number encoded in the path, using the last match so the file name wins over directories"""
+    matches = re.findall(pattern, path, flags=re.IGNORECASE)
+    return int(matches[-1]) if matches else default
+
+
+class ResultWriter:
+    """Append result rows to a CSV or JSON Lines file, flushing each row so a crash loses at most one"""
+
+    def __init__(self, output_file: str, output_format: Optional[str] = None):
+        self.output_file = output_file
+        self.format = output_format or ("csv" if output_file.lower().endswith(".csv") else "jsonl")
+        if self.format not in ("csv", "jsonl"):
+            raise ValueError(f"Unsupported output format: {self.format}. Supported: csv, jsonl")
+        self._file = None
+        self._csv = None
+
+    def completed(self) -> Set[str]:
+        """Absolute paths a previous run finished (ok or invalid); a partially written last row is dropped"""
+        if not os.path.exists(self.output_file):
+            return set()
+
+        with open(self.output_file, 'rb+') as f:
+            content = f.read()
+            end = content.rfind(b"\n") + 1
+            if end < len(content):
+                logger.warning("Dropping incomplete last row of %s", self.output_file)
+                f.truncate(end)
+
+        done = set()
+        with open(self.output_file, 'r', newline='') as f:
+            if self.format == "csv":
+                rows = csv.DictReader(f)
+            else:
+                rows = []
+                for line in f:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        continue
+            for row in rows:
+                if row.get("status") in COMPLETED_STATUSES and row.get("path"):
+                    done.add(os.path.abspath(row["path"]))
+        return done
+
+    def open(self) -> "ResultWriter":
+        directory = os.path.dirname(self.output_file)
+        if directory:
+            FileManager.ensure_directory_exists(directory)
+        new_file = not os.path.exists(self.output_file) or os.path.getsize(self.output_file) == 0
+        self._file = open(self.output_file, 'a', newline='')
+        if self.format == "csv":
+            self._csv = csv.DictWriter(self._file, fieldnames=FIELDS)
+            if new_file:
+                self._csv.writeheader()
+        return self
+
+    def write(self, row: Dict):
+        if self._csv is not None:
+            self._csv.writerow(row)
+        else:
+            self._file.write(json.dumps(row) + "\n")
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._csv = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class BatchProcessor:
+    """Process a directory tree of lane images with a pool of worker processes"""
+
+    def __init__(self, config_file: str = "config.json", workers: Optional[int] = None,
+                 lane_pattern: str = DEFAULT_LANE_PATTERN, default_lane: Optional[int] = None):
+        """
+        Args:
+            config_file: Configuration file shared with the worker processes
+            workers: Number of worker processes (None or 0 uses image_processing.parallel.workers, then every core)
+            lane_pattern: Regular expression whose first group is the lane number in a path
+            default_lane: Lane used when the path does not name one (such images are skipped if None)
+        """
+        self.config_file = config_file
+        self.config = ConfigManager(config_file)
+        self.workers = workers or self.config.get("image_processing.parallel.workers", 0) or os.cpu_count() or 1
+        self.lane_pattern = lane_pattern
+        self.default_lane = default_lane
+        self.traffic_manager = TrafficDataManager(self.config)
+        self.reference_stats = ReferenceStatsCache(self.config)
+
+    def _row(self, path: str, lane: Optional[int], status: str, message: str = "", **values) -> Dict:
+        row = {field: "" for field in FIELDS}
+        row.update(path=path, lane=lane if lane is not None else "", status=status, message=message)
+        row.update(values)
+        return row
+
+    def _classify(self, path: str, lane: int, result: Dict) -> Dict:
+        started = time.perf_counter()
+        reference_pixels = self.reference_stats.get_white_pixels(lane) or 0
+        level, green_time = self.traffic_manager.get_traffic_level(lane, result["white_pixels"], reference_pixels)
+        # Worker time plus classification; time spent queued in the pool is not part of the image's cost
+        total_ms = result["decode_ms"] + result["detect_ms"] + (time.perf_counter() - started) * 1000
+        return self._row(path, lane, "ok", traffic_level=level, green_time=green_time,
+                         total_ms=round(total_ms, 3), **result)
+
+    def run(self, root: str, writer: ResultWriter) -> Dict[str, int]:
+        """
+        Process every image under root not recorded as done yet; images that failed before are retried.
+
+        Returns:
+            Number of rows written per status plus the number of skipped (already done) files
+        """
+        done = writer.completed()
+        formats = self.config.get("validation.supported_formats", ["png", "jpg", "jpeg", "bmp", "tiff"])
+        summary = {"ok": 0, "invalid": 0, "no_lane": 0, "error": 0, "skipped": 0}
+        # Rows record absolute paths, so "./images", "images" and "/data/images" resume the same run
+        root = os.path.abspath(root)
+
+        with writer, ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                         initargs=(self.config_file,)) as pool:
+            pending = {}
+            # Keep a bounded number of images in flight so huge archives are never listed into memory at once
+            max_pending = self.workers * 4
+
+            def collect():
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    path, lane = pending.pop(future)
+                    try:
+                        result = future.result()
+                        if "metrics" in result:
+                            from Metrics import merge_worker_metrics
+                            merge_worker_metrics(result.pop("metrics"))
+                        row = self._classify(path, lane, result)
+                    except Exception as e:
+                        logger.error("Error processing %s: %s", path, e)
+                        row = self._row(path, lane, "error", str(e))
+                    writer.write(row)
+                    summary[row["status"]] += 1
+
+            for path in find_images(root, formats):
+                if path in done:
+                    summary["skipped"] += 1
+                    continue
+
+                lane = lane_for_path(os.path.relpath(path, root), self.lane_pattern, self.default_lane)
+                valid, message = FileManager.validate_image_file(path, self.config)
+                if not valid:
+                    writer.write(self._row(path, lane, "invalid", message))
+                    summary["invalid"] += 1
+                    continue
+                if lane is None:
+                    writer.write(self._row(path, lane, "no_lane", "No lane number in path"))
+                    summary["no_lane"] += 1
+                    continue
+
+                pending[pool.submit(_process_image, path, lane)] = (path, lane)
+                if len(pending) >= max_pending:
+                    collect()
+
+            while pending:
+                collect()
+
+        logger.info("Batch run finished: %s", summary)
+        return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Process a directory of lane images without the GUI")
+    parser.add_argument("root", help="Directory tree of lane images")
+    parser.add_argument("-o", "--output", required=True, help="Result file (.csv or .jsonl); existing rows are resumed")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Output format (default: from the file extension)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: image_processing.parallel.workers, then every CPU core)")
+    parser.add_argument("--lane", type=int, default=None, help="Lane for images whose path names no lane")
+    parser.add_argument("--lane-pattern", default=DEFAULT_LANE_PATTERN, help="Regex with the lane number as group 1")
+    parser.add_argument("--config", default="config.json", help="Configuration file")
+    args = parser.parse_args(argv)
+
+    setup(args.config)
+    processor = BatchProcessor(args.config, args.workers, args.lane_pattern, args.lane)
+    summary = processor.run(args.root, ResultWriter(args.output, args.format))
+    print(f"Processed {summary['ok']} images ({summary['invalid']} invalid, {summary['no_lane']} without a lane, "
+          f"{summary['error']} errors, {summary['skipped']} already done) -> {args.output}")
+    return 1 if summary["error"] else 0
+
+
+__all__ = ['BatchProcessor', 'ResultWriter', 'find_images', 'lane_for_path']
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,232 @@
+"""
+Per-stage benchmarks for the Smart Traffic Control System.
+Times each CannyEdgeDetector stage and the end-to-end path (decode to grayscale -> detect -> count ->
+classify) on the bundled images and on synthetic frames from 240p to 4K, records the results as a JSON
+baseline and compares later runs against it.
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from utils import LoggerSetup
+
+
+logger = LoggerSetup.get_logger("Benchmark")
+
+# Frame sizes (height, width) for synthetic frames
+RESOLUTIONS = {
+    "240p": (240, 426),
+    "480p": (480, 854),
+    "720p": (720, 1280),
+    "1080p": (1080, 1920),
+    "4K": (2160, 3840),
+}
+
+STAGES = ("gaussian", "sobel_filters", "non_max_suppression", "threshold", "hysteresis", "detect")
+END_TO_END = ("decode", "detect", "count", "classify", "total")
+
+
+def time_call(fn: Callable, repeats: int = 5, warmup: int = 1) -> Dict[str, float]:
+    """Best and median wall time of fn() in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(max(1, repeats)):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    return {"min_ms": min(times), "median_ms": statistics.median(times)}
+
+
+def synthetic_frame(height: int, width: int, seed: int = 0) -> np.ndarray:
+    """Road-like RGB test frame: a smooth background with scattered rectangular "vehicles" and noise"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    frame = np.empty((height, width, 3), dtype=np.float32)
+    frame[...] = (0.3 + 0.2 * x / width + 0.1 * y / height)[..., np.newaxis]
+    for _ in range(max(4, height * width // 20000)):
+        h, w = rng.integers(height // 30 + 2, height // 8 + 3), rng.integers(width // 30 + 2, width // 8 + 3)
+        top, left = rng.integers(0, height - h), rng.integers(0, width - w)
+        frame[top:top + h, left:left + w] = rng.random(3)
+    frame += rng.normal(0, 0.02, frame.shape).astype(np.float32)
+    return (np.clip(frame, 0, 1) * 255).astype(np.uint8)
+
+
+class BenchmarkSuite:
+    """Collects stage and end-to-end timings into a flat {"group/case/stage": timing} map"""
+
+    def __init__(self, config, repeats: int = 5):
+        from CannyEdgeDetection import CannyEdgeDetector
+        from ImageDecoder import ImageDecoder
+        self.config = config
+        self.repeats = repeats
+        self.detector = CannyEdgeDetector([], **CannyEdgeDetector.settings_from_config(config))
+        self.decoder = ImageDecoder.from_config(config)
+        self.strong_pixel = self.detector.strong_pixel
+        self.results = {}
+
+    def run_stages(self, name: str, gray: np.ndarray):
+        """Time each detector stage on one grayscale frame, feeding every stage the previous output"""
+        detector = self.detector
+        smoothed = detector.smooth(gray)
+        gradient, theta = detector.sobel_filters(smoothed)
+        suppressed = detector.non_max_suppression(gradient, theta)
+        thresholded = detector.threshold(suppressed)
+
+        calls = {
+            "gaussian": lambda: detector.smooth(gray),
+            "sobel_filters": lambda: detector.sobel_filters(smoothed),
+            "non_max_suppression": lambda: detector.non_max_suppression(gradient, theta),
+            "threshold": lambda: detector.threshold(suppressed),
+            "hysteresis": lambda: detector.hysteresis(thresholded.copy()),
+            "detect": lambda: detector.detect_batch(gray[np.newaxis]),
+        }
+        for stage in STAGES:
+            self.results[f"stages/{name}/{stage}"] = time_call(calls[stage], self.repeats)
+            logger.info("%s %s: %.2f ms", name, stage, self.results[f"stages/{name}/{stage}"]["median_ms"])
+
+    def run_end_to_end(self, name: str, path: str, traffic_manager, lane: int = 1):
+        """Time decode to grayscale -> detect -> count -> classify on an image file"""
+        samples = {stage: [] for stage in END_TO_END}
+        for i in range(self.repeats + 1):
+            start = time.perf_counter()
+            gray = self.decoder.decode_gray(path)
+            decoded = time.perf_counter()
+            edges = self.detector.detect_batch(gray[np.newaxis])[0]
+            detected = time.perf_counter()
+            white_pixels = int(np.count_nonzero(edges == self.strong_pixel))
+            counted = time.perf_counter()
+            traffic_manager.get_traffic_level(lane, white_pixels, 0)
+            classified = time.perf_counter()
+            if i == 0:
+                continue  # warm-up
+            for stage, (begin, end) in zip(END_TO_END, [(start, decoded), (decoded, detected), (detected, counted),
+                                                        (counted, classified), (start, classified)]):
+                samples[stage].append((end - begin) * 1000)
+        for stage, times in samples.items():
+            self.results[f"end_to_end/{name}/{stage}"] = {"min_ms": min(times), "median_ms": statistics.median(times)}
+        logger.info("%s end to end: %.2f ms", name, self.results[f"end_to_end/{name}/total"]["median_ms"])
+
+    def run(self, images: List[str], resolutions: List[str]) -> Dict:
+        """Run every benchmark and return the report (meta data plus results)"""
+        import cv2
+        from utils import TrafficDataManager
+        traffic_manager = TrafficDataManager(self.config)
+
+        for path in images:
+            name = os.path.basename(path)
+            self.run_stages(name, self.decoder.decode_gray(path))
+            self.run_end_to_end(name, path, traffic_manager)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for resolution in resolutions:
+                height, width = RESOLUTIONS[resolution]
+                # Through a PNG file so decoding is measured like for real captures
+                path = os.path.join(tmp_dir, f"{resolution}.png")
+                cv2.imwrite(path, synthetic_frame(height, width)[:, :, ::-1])
+                self.run_stages(resolution, self.decoder.decode_gray(path))
+                self.run_end_to_end(resolution, path, traffic_manager)
+
+        return {
+            "meta": {
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "machine": platform.machine(),
+                "processor": platform.processor(),
+                "repeats": self.repeats,
+            },
+            "results": self.results,
+        }
+
+
+def compare(current: Dict, baseline: Dict, threshold_percent: float = 20.0, noise_floor_ms: float = 0.5) -> List[Dict]:
+    """
+    Benchmarks whose median got slower than the baseline by more than threshold_percent.
+
+    Timings where both medians are below noise_floor_ms are ignored, and entries missing from
+    either report are skipped.
+    """
+    regressions = []
+    for key, timing in current["results"].items():
+        reference = baseline.get("results", {}).get(key)
+        if reference is None:
+            continue
+        before, after = reference["median_ms"], timing["median_ms"]
+        if max(before, after) < noise_floor_ms:
+            continue
+        change = (after - before) / max(before, 1e-9) * 100
+        if change > threshold_percent:
+            regressions.append({"benchmark": key, "baseline_ms": before, "current_ms": after, "change_percent": change})
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the Canny pipeline stage by stage")
+    parser.add_argument("--config", default="config.json", help="Configuration file")
+    parser.add_argument("--output", help="Write results to this JSON file (default: benchmark.baseline)")
+    parser.add_argument("--compare", metavar="BASELINE", nargs="?", const="",
+                        help="Compare against a baseline (default: benchmark.baseline) and fail on regressions")
+    parser.add_argument("--threshold", type=float, help="Allowed slowdown in percent (default: from config)")
+    parser.add_argument("--repeats", type=int, help="Timed repetitions per benchmark")
+    parser.add_argument("--resolutions", nargs="*", choices=list(RESOLUTIONS), help="Synthetic frame sizes")
+    parser.add_argument("--images", nargs="*", help="Images for stage and end-to-end timings (default: images/A-D.png)")
+    args = parser.parse_args(argv)
+
+    from utils import setup
+    config = setup(args.config)
+    baseline_file = config.get("benchmark.baseline", "data/benchmark_baseline.json")
+    repeats = args.repeats or config.get("benchmark.repeats", 5)
+    resolutions = args.resolutions if args.resolutions is not None else \
+        config.get("benchmark.resolutions", list(RESOLUTIONS))
+    images_dir = config.get("directories.images", "images")
+    images = args.images if args.images is not None else \
+        [os.path.join(images_dir, f"{name}.png") for name in "ABCD"]
+
+    report = BenchmarkSuite(config, repeats).run(images, resolutions)
+
+    print(f"{'Benchmark':<44}{'Median ms':>12}{'Min ms':>12}")
+    for key, timing in report["results"].items():
+        print(f"{key:<44}{timing['median_ms']:>12.2f}{timing['min_ms']:>12.2f}")
+
+    if args.compare is not None:
+        with open(args.compare or baseline_file) as f:
+            baseline = json.load(f)
+        threshold = args.threshold if args.threshold is not None else \
+            config.get("benchmark.regression_threshold_percent", 20)
+        regressions = compare(report, baseline, threshold, config.get("benchmark.noise_floor_ms", 0.5))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) slower than the baseline by more than {threshold:g}%:")
+            for row in regressions:
+                print(f"  {row['benchmark']:<42}{row['baseline_ms']:>10.2f} -> {row['current_ms']:>10.2f} ms "
+                      f"(+{row['change_percent']:.0f}%)")
+            return 1
+        print(f"\nNo regressions beyond {threshold:g}%")
+        return 0
+
+    output_file = args.output or baseline_file
+    if os.path.dirname(output_file):
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    with open(output_file, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nBaseline written to {output_file}")
+    return 0
+
+
+__all__ = ['BenchmarkSuite', 'RESOLUTIONS', 'compare', 'synthetic_frame', 'time_call']
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
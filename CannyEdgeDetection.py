@@ -1,10 +1,80 @@
+from functools import lru_cache
 from scipy import ndimage
-from scipy.ndimage import convolve
+from scipy.ndimage import convolve, convolve1d
 import numpy as np
 
+# "connected" (the default) keeps every weak+strong component touching a strong pixel,
+# "single_pass" reproduces the counts of the original raster-order loop
+HYSTERESIS_MODES = ("connected", "single_pass")
+
+# 8-connectivity, matching the neighbourhood checked by the single-pass loop
+EIGHT_CONNECTED = np.ones((3, 3), dtype=bool)
+
+# Same neighbourhood for an (N, H, W) stack, without linking pixels across frames
+EIGHT_CONNECTED_STACK = np.zeros((3, 3, 3), dtype=bool)
+EIGHT_CONNECTED_STACK[1] = True
+
+# "separable" runs Gaussian and Sobel as 1-D passes, "full" uses the original 2-D kernels
+FILTER_MODES = ("separable", "full")
+
+# Sobel operators split into (smoothing, derivative) 1-D factors:
+# Kx = outer([1, 2, 1], [-1, 0, 1]) and Ky = outer([1, 0, -1], [1, 2, 1])
+SOBEL_SMOOTH = np.array([1, 2, 1], dtype=np.float64)
+SOBEL_DERIV_X = np.array([-1, 0, 1], dtype=np.float64)
+SOBEL_DERIV_Y = np.array([1, 0, -1], dtype=np.float64)
+
+# Rows per block when mapping component labels back to pixels in detect_workspace
+WORKSPACE_BLOCK_ROWS = 64
+
+
+@lru_cache(maxsize=None)
+def gaussian_kernel_1d(size, sigma):
+    # Row and column factors of the 2-D kernel: outer(col, row) == gaussian_kernel(size, sigma)
+    half = int(size) // 2
+    x = np.arange(-half, half + 1, dtype=np.float64)
+    g = np.exp(-(x**2) / (2.0*sigma**2))
+    normal = 1 / (2.0 * np.pi * sigma**2)
+    row, col = g, g * normal
+    row.flags.writeable = False
+    col.flags.writeable = False
+    return row, col
+
+
+@lru_cache(maxsize=None)
+def gaussian_kernel_2d(size, sigma):
+    row, col = gaussian_kernel_1d(size, sigma)
+    g = np.outer(col, row)
+    g.flags.writeable = False
+    return g
+
+
+class CannyWorkspace:
+    # Preallocated buffers for one (H, W) frame shape, reused by CannyEdgeDetector.detect_workspace.
+    # Float buffers are float32 and change role between stages; masks and maps are uint8/bool.
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.scratch = np.empty(self.shape, dtype=np.float32)  # separable-pass intermediate, then angle
+        self.smoothed = np.empty(self.shape, dtype=np.float32) # smoothed image, then gradient magnitude
+        self.grad_x = np.empty(self.shape, dtype=np.float32)   # reused as int32 component labels
+        self.grad_y = np.empty(self.shape, dtype=np.float32)
+        self.bins = np.empty(self.shape, dtype=np.uint8)
+        self.nms = np.empty(self.shape, dtype=np.uint8)
+        self.edges = np.empty(self.shape, dtype=np.uint8)
+        self.keep = np.empty(self.shape, dtype=bool)
+        self.select = np.empty(self.shape, dtype=bool)
+        self.compare = np.empty(self.shape, dtype=bool)
+
+    @property
+    def labels(self):
+        return self.grad_x.view(np.int32)
+
+    @property
+    def nbytes(self):
+        return sum(buf.nbytes for buf in vars(self).values() if isinstance(buf, np.ndarray))
+
+
 class CannyEdgeDetector:
-    def __init__(self, imgs, sigma=1, kernel_size=5, weak_pixel=75, strong_pixel=255, lowthreshold=0.05, highthreshold=0.15):
-        print(imgs)
+    def __init__(self, imgs, sigma=1, kernel_size=5, weak_pixel=75, strong_pixel=255, lowthreshold=0.05, highthreshold=0.15, hysteresis_mode="connected", filter_mode="separable"):
         self.imgs = imgs
         self.imgs_final = []
         self.img_smoothed = None
@@ -18,8 +88,30 @@ class CannyEdgeDetector:
         self.kernel_size = kernel_size
         self.lowThreshold = lowthreshold
         self.highThreshold = highthreshold
+        if hysteresis_mode not in HYSTERESIS_MODES:
+            raise ValueError(f"Unknown hysteresis mode: {hysteresis_mode}. Supported: {', '.join(HYSTERESIS_MODES)}")
+        self.hysteresis_mode = hysteresis_mode
+        if filter_mode not in FILTER_MODES:
+            raise ValueError(f"Unknown filter mode: {filter_mode}. Supported: {', '.join(FILTER_MODES)}")
+        self.filter_mode = filter_mode
+        self._workspace = None
         return 
     
+    @staticmethod
+    def settings_from_config(config):
+        # Constructor keyword arguments from image_processing.canny_edge_detection in config.json
+        prefix = "image_processing.canny_edge_detection"
+        return {
+            "sigma": config.get(f"{prefix}.sigma", 1.4),
+            "kernel_size": config.get(f"{prefix}.kernel_size", 5),
+            "lowthreshold": config.get(f"{prefix}.low_threshold", 0.09),
+            "highthreshold": config.get(f"{prefix}.high_threshold", 0.20),
+            "weak_pixel": config.get(f"{prefix}.weak_pixel", 100),
+            "strong_pixel": config.get(f"{prefix}.strong_pixel", 255),
+            "hysteresis_mode": config.get(f"{prefix}.hysteresis_mode", "connected"),
+            "filter_mode": config.get(f"{prefix}.filter_mode", "separable"),
+        }
+
     def gaussian_kernel(self, size, sigma=1):
         size = int(size) // 2
         x, y = np.mgrid[-size:size+1, -size:size+1]
@@ -27,20 +119,81 @@ class CannyEdgeDetector:
         g =  np.exp(-((x**2 + y**2) / (2.0*sigma**2))) * normal
         return g
     
-    def sobel_filters(self, img):
-        Kx = np.array([[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]], np.float32)
-        Ky = np.array([[1, 2, 1], [0, 0, 0], [-1, -2, -1]], np.float32)
+    def smooth(self, img):
+        if self.filter_mode == "full":
+            kernel = gaussian_kernel_2d(self.kernel_size, self.sigma)
+            return convolve(img, kernel.reshape((1,) * (img.ndim - 2) + kernel.shape))
+
+        # Row pass then column pass; the intermediate is kept in float64.
+        # Works on a single (H, W) image or an (N, H, W) stack.
+        row, col = gaussian_kernel_1d(self.kernel_size, self.sigma)
+        out_dtype = img.dtype if np.issubdtype(img.dtype, np.floating) else np.float64
+        tmp = convolve1d(img, row, axis=-1, output=np.float64)
+        return convolve1d(tmp, col, axis=-2, output=out_dtype)
+
+    def sobel_gradients(self, img):
+        # Fused separable Sobel: each gradient is a smoothing pass followed by a derivative pass
+        out_dtype = img.dtype if np.issubdtype(img.dtype, np.floating) else np.float64
+        tmp = convolve1d(img, SOBEL_SMOOTH, axis=-2, output=np.float64)
+        Ix = convolve1d(tmp, SOBEL_DERIV_X, axis=-1, output=out_dtype)
+        convolve1d(img, SOBEL_SMOOTH, axis=-1, output=tmp)
+        Iy = convolve1d(tmp, SOBEL_DERIV_Y, axis=-2, output=out_dtype)
+        return Ix, Iy
+
+    def gradient_magnitude(self, img):
+        # Unnormalised gradient magnitude and direction
+        if self.filter_mode == "full":
+            lead = (1,) * (img.ndim - 2)
+            Kx = np.array([[-1, 0, 1], [-2, 0, 2], [-1, 0, 1]], np.float32).reshape(lead + (3, 3))
+            Ky = np.array([[1, 2, 1], [0, 0, 0], [-1, -2, -1]], np.float32).reshape(lead + (3, 3))
 
-        Ix = ndimage.convolve(img, Kx)
-        Iy = ndimage.convolve(img, Ky)
+            Ix = ndimage.convolve(img, Kx)
+            Iy = ndimage.convolve(img, Ky)
+        else:
+            Ix, Iy = self.sobel_gradients(img)
 
         G = np.hypot(Ix, Iy)
-        G = G / G.max() * 255
         theta = np.arctan2(Iy, Ix)
         return (G, theta)
+
+    def sobel_filters(self, img):
+        G, theta = self.gradient_magnitude(img)
+        G = G / G.max(axis=(-2, -1), keepdims=True) * 255
+        return (G, theta)
     
 
+    def direction_bins(self, D):
+        # Quantize gradient angles into the four NMS directions (0, 45, 90, 135 deg -> 0..3)
+        angle = D * 180. / np.pi
+        angle[angle < 0] += 180
+
+        bins = np.full(angle.shape, -1, dtype=np.int8)
+        bins[((0 <= angle) & (angle < 22.5)) | ((157.5 <= angle) & (angle <= 180))] = 0
+        bins[(22.5 <= angle) & (angle < 67.5)] = 1
+        bins[(67.5 <= angle) & (angle < 112.5)] = 2
+        bins[(112.5 <= angle) & (angle < 157.5)] = 3
+        return bins
+
     def non_max_suppression(self, img, D):
+        # Array version of non_max_suppression_loop: same output, one pass over shifted slices
+        M, N = img.shape[-2:]
+        Z = np.zeros(img.shape, dtype=np.int32)
+        if M < 3 or N < 3:
+            return Z
+
+        bins = self.direction_bins(D)[..., 1:-1, 1:-1]
+        center = img[..., 1:-1, 1:-1]
+
+        #angle 0, 45, 90, 135
+        conds = [bins == 0, bins == 1, bins == 2, bins == 3]
+        q = np.select(conds, [img[..., 1:-1, 2:], img[..., 2:, :-2], img[..., 2:, 1:-1], img[..., :-2, :-2]], default=255)
+        r = np.select(conds, [img[..., 1:-1, :-2], img[..., :-2, 2:], img[..., :-2, 1:-1], img[..., 2:, 2:]], default=255)
+
+        keep = (center >= q) & (center >= r)
+        Z[..., 1:-1, 1:-1] = np.where(keep, center, 0)
+        return Z
+
+    def non_max_suppression_loop(self, img, D):
         M, N = img.shape
         Z = np.zeros((M,N), dtype=np.int32)
         angle = D * 180. / np.pi
@@ -81,28 +234,74 @@ class CannyEdgeDetector:
 
         return Z
 
-    def threshold(self, img):
+    def threshold(self, img, img_max=None):
 
-        highThreshold = img.max() * self.highThreshold;
-        lowThreshold = highThreshold * self.lowThreshold;
+        # Thresholds are relative to each frame's own maximum unless img_max is given
+        if img_max is None:
+            img_max = img.max(axis=(-2, -1), keepdims=True)
+        highThreshold = img_max * self.highThreshold
+        lowThreshold = highThreshold * self.lowThreshold
 
-        M, N = img.shape
-        res = np.zeros((M,N), dtype=np.int32)
+        res = np.zeros(img.shape, dtype=np.int32)
 
         weak = np.int32(self.weak_pixel)
         strong = np.int32(self.strong_pixel)
 
-        strong_i, strong_j = np.where(img >= highThreshold)
-        zeros_i, zeros_j = np.where(img < lowThreshold)
-
-        weak_i, weak_j = np.where((img <= highThreshold) & (img >= lowThreshold))
-
-        res[strong_i, strong_j] = strong
-        res[weak_i, weak_j] = weak
+        # Pixels exactly at highThreshold end up weak, as in the original index-based version
+        res[img >= highThreshold] = strong
+        res[(img <= highThreshold) & (img >= lowThreshold)] = weak
 
         return (res)
 
     def hysteresis(self, img):
+        if self.hysteresis_mode == "single_pass":
+            if img.ndim == 3:
+                for frame in img:
+                    self.hysteresis_single_pass(frame)
+                return img
+            return self.hysteresis_single_pass(img)
+        return self.hysteresis_connected(img)
+
+    def hysteresis_connected(self, img):
+        # Label weak+strong regions in bulk and keep each region that contains a strong pixel
+        strong = self.strong_pixel
+        candidates = (img == self.weak_pixel) | (img == strong)
+        structure = EIGHT_CONNECTED_STACK if img.ndim == 3 else EIGHT_CONNECTED
+        labels, num_labels = ndimage.label(candidates, structure=structure)
+
+        keep = np.zeros(num_labels + 1, dtype=bool)
+        keep[labels[img == strong]] = True
+        keep[0] = False
+
+        return np.where(keep[labels], strong, 0).astype(img.dtype)
+
+    def hysteresis_single_pass(self, img):
+        # Same result as hysteresis_single_pass_loop, one row at a time. In raster order a weak pixel
+        # sees final values above it and to its left and original values right of and below it, so it
+        # is kept if an original strong pixel or a final strong pixel in the row above touches it, or
+        # if the weak run it belongs to was kept further left. Border pixels are left as they are.
+        M, N = img.shape
+        weak = self.weak_pixel
+        strong = self.strong_pixel
+        if M < 3 or N < 3:
+            return img
+
+        original = img == strong
+        for i in range(1, M-1):
+            up = img[i-1] == strong
+            touching = original[i+1] | up
+            near = touching[:-2] | touching[1:-1] | touching[2:] | original[i, :-2] | original[i, 2:]
+
+            run = img[i, 1:-1] == weak
+            seeded = np.cumsum(near & run)
+            # Seeds counted before the current weak run started
+            before = np.maximum.accumulate(np.where(run, 0, seeded))
+            img[i, 1:-1][run] = np.where(seeded > before, strong, 0)[run]
+
+        return img
+
+    def hysteresis_single_pass_loop(self, img):
+        # Original raster-order loop, kept as the reference for hysteresis_single_pass
 
         M, N = img.shape
         weak = self.weak_pixel
@@ -126,11 +325,123 @@ class CannyEdgeDetector:
     def detect(self):
         imgs_final = []
         for i, img in enumerate(self.imgs):    
-            self.img_smoothed = convolve(img, self.gaussian_kernel(self.kernel_size, self.sigma))
+            self.img_smoothed = self.smooth(img)
             self.gradientMat, self.thetaMat = self.sobel_filters(self.img_smoothed)
             self.nonMaxImg = self.non_max_suppression(self.gradientMat, self.thetaMat)
             self.thresholdImg = self.threshold(self.nonMaxImg)
             img_final = self.hysteresis(self.thresholdImg)
-            self.imgs_final.append(img_final)
+            imgs_final.append(img_final)
 
+        # Replace rather than extend, so repeated calls return one result per image
+        self.imgs_final = imgs_final
         return self.imgs_final
+
+    def detect_batch(self, imgs=None):
+        # Run every stage over an (N, H, W) stack at once and return an (N, H, W) uint8 edge map.
+        # Intermediates are not kept on self, so repeated calls do not grow memory.
+        stack = np.asarray(self.imgs if imgs is None else imgs)
+        if stack.ndim != 3:
+            raise ValueError(f"detect_batch expects an (N, H, W) array, got shape {stack.shape}")
+
+        smoothed = self.smooth(stack)
+        gradient, theta = self.sobel_filters(smoothed)
+        del smoothed
+        nonMax = self.non_max_suppression(gradient, theta)
+        del gradient, theta
+        edges = self.hysteresis(self.threshold(nonMax))
+        return edges.astype(np.uint8)
+
+    def detect_workspace(self, img, workspace=None):
+        # Single-frame detection that writes every stage into preallocated float32/uint8 buffers.
+        # The returned uint8 edge map is workspace.edges: it is overwritten by the next call,
+        # so copy it if it must outlive the next frame.
+        img = np.asarray(img)
+        if img.ndim != 2:
+            raise ValueError(f"detect_workspace expects an (H, W) image, got shape {img.shape}")
+        if workspace is None:
+            if self._workspace is None or self._workspace.shape != img.shape:
+                self._workspace = CannyWorkspace(img.shape)
+            workspace = self._workspace
+        elif workspace.shape != img.shape:
+            raise ValueError(f"Workspace shape {workspace.shape} does not match image shape {img.shape}")
+        ws = workspace
+
+        # Gaussian smoothing (always separable here)
+        row, col = gaussian_kernel_1d(self.kernel_size, self.sigma)
+        convolve1d(img, row, axis=1, output=ws.scratch)
+        convolve1d(ws.scratch, col, axis=0, output=ws.smoothed)
+
+        # Sobel gradients
+        convolve1d(ws.smoothed, SOBEL_SMOOTH, axis=0, output=ws.scratch)
+        convolve1d(ws.scratch, SOBEL_DERIV_X, axis=1, output=ws.grad_x)
+        convolve1d(ws.smoothed, SOBEL_SMOOTH, axis=1, output=ws.scratch)
+        convolve1d(ws.scratch, SOBEL_DERIV_Y, axis=0, output=ws.grad_y)
+
+        G = np.hypot(ws.grad_x, ws.grad_y, out=ws.smoothed)
+        g_max = G.max()
+        ws.edges.fill(0)
+        if not g_max > 0:
+            return ws.edges
+        G *= 255 / g_max
+
+        # Direction bins: angle in [0, 180] -> floor((angle + 22.5) / 45) mod 4
+        angle = np.arctan2(ws.grad_y, ws.grad_x, out=ws.scratch)
+        angle *= 180. / np.pi
+        np.less(angle, 0, out=ws.compare)
+        np.add(angle, 180, out=angle, where=ws.compare)
+        angle += 22.5
+        angle /= 45
+        np.floor(angle, out=angle)
+        np.copyto(ws.bins, angle, casting='unsafe')
+        ws.bins &= 3
+
+        # Non-maximum suppression over shifted slices
+        M, N = img.shape
+        ws.keep.fill(False)
+        if M >= 3 and N >= 3:
+            center = G[1:-1, 1:-1]
+            bins = ws.bins[1:-1, 1:-1]
+            keep = ws.keep[1:-1, 1:-1]
+            select = ws.select[1:-1, 1:-1]
+            compare = ws.compare[1:-1, 1:-1]
+            #angle 0, 45, 90, 135
+            neighbours = [(G[1:-1, 2:], G[1:-1, :-2]), (G[2:, :-2], G[:-2, 2:]),
+                          (G[2:, 1:-1], G[:-2, 1:-1]), (G[:-2, :-2], G[2:, 2:])]
+            for direction, (q, r) in enumerate(neighbours):
+                np.equal(bins, direction, out=select)
+                np.greater_equal(center, q, out=compare)
+                select &= compare
+                np.greater_equal(center, r, out=compare)
+                select &= compare
+                keep |= select
+        ws.nms.fill(0)
+        np.copyto(ws.nms, G, casting='unsafe', where=ws.keep)
+
+        # Double threshold: strong above highThreshold, weak in [lowThreshold, highThreshold]
+        highThreshold = ws.nms.max() * self.highThreshold
+        lowThreshold = highThreshold * self.lowThreshold
+        np.greater(ws.nms, highThreshold, out=ws.select)
+        np.copyto(ws.edges, self.strong_pixel, casting='unsafe', where=ws.select)
+        np.greater_equal(ws.nms, lowThreshold, out=ws.compare)
+        np.less_equal(ws.nms, highThreshold, out=ws.select)
+        ws.select &= ws.compare
+        np.copyto(ws.edges, self.weak_pixel, casting='unsafe', where=ws.select)
+
+        if self.hysteresis_mode == "single_pass":
+            return self.hysteresis_single_pass(ws.edges)
+
+        # Connected hysteresis into the preallocated label buffer
+        np.not_equal(ws.edges, 0, out=ws.select)
+        labels = ws.labels
+        num_labels = ndimage.label(ws.select, structure=EIGHT_CONNECTED, output=labels)
+        keep = np.zeros(num_labels + 1, dtype=bool)
+        np.equal(ws.edges, self.strong_pixel, out=ws.select)
+        keep[labels[ws.select]] = True
+        keep[0] = False
+        # Row blocks bound the temporary index array np.take builds from the int32 labels
+        for start in range(0, M, WORKSPACE_BLOCK_ROWS):
+            block = slice(start, start + WORKSPACE_BLOCK_ROWS)
+            np.take(keep, labels[block], out=ws.keep[block])
+        ws.edges.fill(0)
+        np.copyto(ws.edges, self.strong_pixel, casting='unsafe', where=ws.keep)
+        return ws.edges
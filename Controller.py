@@ -0,0 +1,398 @@
+"""
+Multi-intersection controller for the Smart Traffic Control System.
+Runs many intersections in one asyncio event loop: every lane source feeds a bounded per-intersection
+queue, edge detection runs in a shared process (or thread) pool, and each intersection keeps its own
+lane data and cycles its own signals from the latest density of each lane.
+"""
+
+import argparse
+import asyncio
+import os
+import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
+
+from utils import ConfigManager, LoggerSetup, TrafficDataManager
+
+
+logger = LoggerSetup.get_logger("Controller")
+
+# Returned by next() when a lane source is exhausted
+_END = object()
+
+# Per-process detection state built once by _init_worker
+_worker_backend = None
+_worker_decoder = None
+_worker_metrics = False
+
+
+def _init_worker(config_file: Union[str, ConfigManager]):
+    """Build the edge-detection backend and decoder once per worker process (or once for a thread pool)"""
+    global _worker_backend, _worker_decoder, _worker_metrics
+    from EdgeBackends import backend_from_config
+    from ImageDecoder import ImageDecoder
+    if isinstance(config_file, str):
+        config = ConfigManager(config_file)
+        # A worker process records into its own registry; a thread pool shares the parent's
+        if config.get("metrics.enabled", False):
+            from Metrics import setup_worker_metrics
+            _worker_metrics = setup_worker_metrics(config)
+    else:
+        config = config_file
+    _worker_backend = backend_from_config(config)
+    _worker_decoder = ImageDecoder.from_config(config)
+
+
+def _count_white_pixels(item, stream=None):
+    """
+    Decode an image path (or convert a BGR frame) and count the edge pixels of one lane sample.
+
+    Returns:
+        (white pixels, metrics recorded by a worker process since its last sample or None)
+    """
+    gray = _worker_decoder.decode_gray(item) if isinstance(item, str) else _worker_decoder.to_gray(item)
+    white_pixels = _worker_backend.detect_result(gray, stream=stream).white_pixels
+    if not _worker_metrics:
+        return white_pixels, None
+    from Metrics import registry
+    return white_pixels, registry.drain()
+
+
+def directory_images(directory: str, formats: List[str], follow: bool = False, poll_interval: float = 1.0,
+                     stop: Optional[threading.Event] = None) -> Iterator[str]:
+    """
+    Yield image paths from a capture directory in sorted order.
+
+    Args:
+        follow: Keep polling for new files instead of stopping after the existing ones
+        poll_interval: Seconds between polls when following
+        stop: Ends a follow loop when set
+    """
+    from BatchProcess import find_images
+    seen = set()
+    while True:
+        for path in find_images(directory, formats):
+            if path not in seen:
+                seen.add(path)
+                yield path
+        if not follow or (stop is not None and stop.wait(poll_interval)):
+            return
+
+
+def lane_source(source, formats: List[str], follow: bool = False, poll_interval: float = 1.0,
+                stop: Optional[threading.Event] = None) -> Iterable:
+    """
+    Frames of one lane: a camera index, video file or stream URL yields BGR frames, a directory yields
+    image paths (decoded in the worker) and any other iterable is used as it is.
+    """
+    from StreamingPipeline import video_frames
+    if isinstance(source, int) or (isinstance(source, str) and source.isdigit()):
+        return video_frames(int(source))
+    if isinstance(source, str):
+        if os.path.isdir(source):
+            return directory_images(source, formats, follow, poll_interval, stop)
+        return video_frames(source)
+    return source
+
+
+class IntersectionConfig:
+    """
+    Configuration view for one intersection: its own keys (lane count, data files, timings) override
+    the shared configuration, and reloads of the shared file are passed on with this view.
+    """
+
+    def __init__(self, base, overrides: Dict):
+        self.base = base
+        self.overrides = overrides
+        self._listeners = []
+        base.add_reload_listener(self._reloaded)
+
+    def get(self, key: str, default=None):
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.base.get(key, default)
+
+    def get_directory(self, dir_key: str) -> str:
+        return self.base.get_directory(dir_key)
+
+    def add_reload_listener(self, callback):
+        """Call callback(view) after every reload of the shared configuration (bound methods held weakly)"""
+        if hasattr(callback, "__self__"):
+            self._listeners.append(weakref.WeakMethod(callback))
+        else:
+            self._listeners.append(lambda: callback)
+
+    def _reloaded(self, base):
+        for listener in list(self._listeners):
+            callback = listener()
+            if callback is None:
+                self._listeners.remove(listener)
+            else:
+                callback(self)
+
+
+class Intersection:
+    """Lane sources, queue, lane data and signal cycle of one intersection"""
+
+    def __init__(self, name: str, config, sources: Dict[int, object], settings: Dict,
+                 on_signal: Optional[Callable] = None):
+        """
+        Args:
+            name: Intersection name (used for its data directory and in logs)
+            config: Shared ConfigManager
+            sources: Lane number -> camera index, video path/URL, capture directory or iterable of frames
+            settings: Intersection entry from controller.intersections (data_directory, time_allocation)
+            on_signal: Called as on_signal(intersection, lane, phase, traffic_level, seconds) on every change
+        """
+        self.name = name
+        self.sources = {int(lane): source for lane, source in sources.items()}
+        if not self.sources:
+            raise ValueError(f"Intersection {name} has no lane sources")
+        self.lanes = sorted(self.sources)
+
+        data_dir = settings.get("data_directory", os.path.join("data", "intersections", name))
+        os.makedirs(data_dir, exist_ok=True)
+        overrides = {
+            "traffic_density.lanes": max(self.lanes),
+            "files.traffic_db": os.path.join(data_dir, "traffic.db"),
+            "files.traffic_data": os.path.join(data_dir, "Previous_data.txt"),
+            "files.traffic_data_backup": os.path.join(data_dir, "Previous_data_backup.txt"),
+            "traffic_density.history.directory": os.path.join(data_dir, "history"),
+        }
+        if "time_allocation" in settings:
+            overrides["traffic_density.time_allocation"] = settings["time_allocation"]
+        self.config = IntersectionConfig(config, overrides)
+        self.traffic_manager = TrafficDataManager(self.config)
+
+        self.queue_size = config.get("controller.queue_size", 4)
+        self.detectors = config.get("controller.detectors_per_intersection", 1)
+        self.sample_interval = config.get("controller.sample_interval_seconds", 1.0)
+        self.yellow_seconds = config.get("controller.yellow_seconds", 3)
+        self.time_scale = config.get("controller.time_scale", 1.0)
+        self.formats = config.get("validation.supported_formats", ["png", "jpg", "jpeg", "bmp", "tiff"])
+        self.follow = config.get("controller.follow_directories", True)
+        self.on_signal = on_signal or self._log_signal
+
+        self.queue = None
+        self.latest = {}
+        # Detections per lane, and how many of them the signal cycle had seen when it last stored a sample
+        self.samples = {}
+        self._stored = {}
+        self.phase = {"lane": None, "phase": "off", "traffic_level": None, "seconds": 0}
+        self.frames = 0
+        self.errors = 0
+        self.stalls = 0
+        self.max_queue_depth = 0
+        self._iterators = []
+
+    @staticmethod
+    def _log_signal(intersection: str, lane: int, phase: str, traffic_level: str, seconds: float):
+        logger.info("%s: lane %s %s for %ss (%s)", intersection, lane, phase, seconds, traffic_level)
+
+    def _set_phase(self, lane: int, phase: str, traffic_level: str, seconds: float):
+        self.phase = {"lane": lane, "phase": phase, "traffic_level": traffic_level, "seconds": seconds}
+        try:
+            self.on_signal(self.name, lane, phase, traffic_level, seconds)
+        except Exception as e:
+            logger.error("%s: signal callback failed: %s", self.name, e)
+
+    async def _capture(self, lane: int, io_executor, stop: threading.Event):
+        """Read one lane's source on an I/O thread and queue samples; waits while the queue is full"""
+        loop = asyncio.get_running_loop()
+        try:
+            frames = iter(lane_source(self.sources[lane], self.formats, self.follow,
+                                      max(self.sample_interval, 0.1), stop))
+            self._iterators.append(frames)
+            while True:
+                started = loop.time()
+                item = await loop.run_in_executor(io_executor, next, frames, _END)
+                if item is _END:
+                    logger.info("%s: lane %s source ended", self.name, lane)
+                    return
+                if self.queue.full():
+                    self.stalls += 1
+                # Backpressure: a lane whose samples are not consumed stops reading instead of piling up
+                await self.queue.put((lane, item))
+                self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+                delay = self.sample_interval - (loop.time() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error("%s: lane %s source failed: %s", self.name, lane, e)
+
+    async def _detect(self, executor):
+        """Send queued samples to the shared pool; at most `detectors` per intersection are in flight"""
+        loop = asyncio.get_running_loop()
+        while True:
+            lane, item = await self.queue.get()
+            try:
+                self.latest[lane], metrics = await loop.run_in_executor(executor, _count_white_pixels, item,
+                                                                        (self.name, lane))
+                if metrics:
+                    from Metrics import merge_worker_metrics
+                    merge_worker_metrics(metrics)
+                self.samples[lane] = self.samples.get(lane, 0) + 1
+                self.frames += 1
+            except Exception as e:
+                self.errors += 1
+                logger.error("%s: detection failed for lane %s: %s", self.name, lane, e)
+            finally:
+                self.queue.task_done()
+
+    async def _signal_cycle(self):
+        """Give each lane in turn a green phase sized by its latest traffic density, then yellow"""
+        while True:
+            for lane in self.lanes:
+                sample = self.latest.get(lane)
+                if sample is None:
+                    # No detection yet: fall back to the stored count of the lane
+                    sample = self.traffic_manager.get_lane_data()[lane - 1]
+                traffic_level, green_time = self.traffic_manager.get_traffic_level(lane, sample, 0)
+                # Store each detection once: repeating a stale sample would skew the lane history
+                seen = self.samples.get(lane, 0)
+                if seen > self._stored.get(lane, 0):
+                    self.traffic_manager.update_lane_data(lane, sample)
+                    self._stored[lane] = seen
+
+                self._set_phase(lane, "green", traffic_level, green_time)
+                await asyncio.sleep(green_time * self.time_scale)
+                if self.yellow_seconds:
+                    self._set_phase(lane, "yellow", traffic_level, self.yellow_seconds)
+                    await asyncio.sleep(self.yellow_seconds * self.time_scale)
+
+    def tasks(self, executor, io_executor, stop: threading.Event) -> List[asyncio.Task]:
+        """Start the capture, detection and signal tasks (inside the running loop)"""
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        tasks = [asyncio.create_task(self._capture(lane, io_executor, stop)) for lane in self.lanes]
+        tasks += [asyncio.create_task(self._detect(executor)) for _ in range(self.detectors)]
+        tasks.append(asyncio.create_task(self._signal_cycle()))
+        return tasks
+
+    def status(self) -> Dict:
+        return {
+            "name": self.name,
+            **self.phase,
+            "latest": dict(self.latest),
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "frames": self.frames,
+            "errors": self.errors,
+            "stalls": self.stalls,
+        }
+
+    def close(self):
+        """Release lane sources and write out lane data"""
+        for frames in self._iterators:
+            if hasattr(frames, "close"):
+                try:
+                    frames.close()
+                except Exception as e:
+                    logger.error("%s: error closing lane source: %s", self.name, e)
+        self._iterators.clear()
+        self.traffic_manager.close()
+
+
+class IntersectionController:
+    """Run every intersection from controller.intersections in one event loop with a shared detection pool"""
+
+    def __init__(self, config, intersections: Optional[Dict[str, Dict]] = None, config_file: str = "config.json",
+                 on_signal: Optional[Callable] = None):
+        """
+        Args:
+            config: ConfigManager instance
+            intersections: Name -> {"lanes": {lane: source}, ...} (default: controller.intersections)
+            config_file: Configuration file loaded by the detection worker processes
+            on_signal: Signal change callback passed to every intersection (default: log the change)
+        """
+        self.config = config
+        self.config_file = config_file
+        intersections = intersections if intersections is not None else config.get("controller.intersections", {})
+        if not intersections:
+            raise ValueError("No intersections configured (controller.intersections)")
+        self.intersections = {name: Intersection(name, config, settings["lanes"], settings, on_signal)
+                              for name, settings in intersections.items()}
+        self.executor_kind = config.get("controller.executor", "process")
+        if self.executor_kind not in ("process", "thread"):
+            raise ValueError(f"Unknown controller executor: {self.executor_kind}. Supported: process, thread")
+        self.workers = (config.get("controller.workers", 0) or config.get("image_processing.parallel.workers", 0)
+                        or os.cpu_count() or 1)
+        self._loop = None
+        self._stopped = None
+        self._stop_sources = threading.Event()
+
+    def _create_executor(self):
+        if self.executor_kind == "process":
+            return ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                       initargs=(self.config_file,))
+        _init_worker(self.config)
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="detect")
+
+    async def run(self, duration: Optional[float] = None):
+        """Run until stop() is called, duration seconds have passed or the task is cancelled"""
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        self._stop_sources.clear()
+        executor = self._create_executor()
+        # One reader thread per lane, so a blocking camera read never holds up another lane
+        lane_count = sum(len(intersection.lanes) for intersection in self.intersections.values())
+        io_executor = ThreadPoolExecutor(max_workers=lane_count, thread_name_prefix="lane")
+
+        tasks = []
+        for intersection in self.intersections.values():
+            tasks += intersection.tasks(executor, io_executor, self._stop_sources)
+        logger.info("Controller started: %d intersections, %d lanes, %d %s workers",
+                    len(self.intersections), lane_count, self.workers, self.executor_kind)
+        try:
+            await asyncio.wait_for(self._stopped.wait(), duration)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self._stop_sources.set()
+            io_executor.shutdown(wait=True)
+            executor.shutdown(wait=True, cancel_futures=True)
+            for intersection in self.intersections.values():
+                intersection.close()
+            logger.info("Controller stopped")
+
+    def stop(self):
+        """Stop a running controller; safe to call from any thread"""
+        if self._loop is not None and self._stopped is not None:
+            self._loop.call_soon_threadsafe(self._stopped.set)
+
+    def status(self) -> List[Dict]:
+        return [intersection.status() for intersection in self.intersections.values()]
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the signal controller for every configured intersection")
+    parser.add_argument("--config", default="config.json", help="Configuration file")
+    parser.add_argument("--duration", type=float, default=None, help="Stop after this many seconds")
+    args = parser.parse_args(argv)
+
+    from utils import setup
+    config = setup(args.config)
+    if config.get("config_reload.enabled", False):
+        config.start_watching()
+
+    controller = IntersectionController(config, config_file=args.config)
+    try:
+        asyncio.run(controller.run(args.duration))
+    except KeyboardInterrupt:
+        pass
+    for status in controller.status():
+        print(f"{status['name']}: {status['frames']} samples, {status['errors']} errors, "
+              f"{status['stalls']} stalls, latest {status['latest']}")
+    return 0
+
+
+__all__ = ['Intersection', 'IntersectionConfig', 'IntersectionController', 'directory_images', 'lane_source']
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
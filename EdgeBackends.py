@@ -0,0 +1,326 @@
+"""
+Pluggable edge-detection backends for the Smart Traffic Control System.
+Maps the Canny settings in config.json onto the reference CannyEdgeDetector, OpenCV and scikit-image,
+and reports how far each backend's white-pixel counts drift from the reference engine.
+"""
+
+import argparse
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Hashable, List, Optional
+
+import numpy as np
+
+from CannyEdgeDetection import CannyEdgeDetector
+from ImageDecoder import ImageDecoder
+
+
+class DetectionResult:
+    """Edge map and white-pixel count of one image, passed in memory from detection to classification"""
+
+    def __init__(self, edges: np.ndarray, strong_pixel: int = 255, lane: Optional[int] = None,
+                 source: Optional[str] = None, backend: Optional[str] = None):
+        self.edges = edges
+        self.white_pixels = int(np.count_nonzero(edges == strong_pixel))
+        self.lane = lane
+        self.source = source
+        self.backend = backend
+
+    def __repr__(self):
+        return (f"DetectionResult(lane={self.lane}, white_pixels={self.white_pixels}, "
+                f"shape={self.edges.shape}, backend={self.backend!r})")
+
+
+class EdgeDetectionBackend(ABC):
+    """Base class: turn a grayscale image into a uint8 edge map (edges = strong_pixel, else 0)"""
+
+    name = None
+
+    def __init__(self, settings: Dict):
+        """
+        Args:
+            settings: CannyEdgeDetector keyword arguments (see CannyEdgeDetector.settings_from_config)
+        """
+        self.settings = dict(settings)
+        self.sigma = self.settings.get("sigma", 1.4)
+        self.kernel_size = int(self.settings.get("kernel_size", 5))
+        self.low_threshold = self.settings.get("lowthreshold", 0.09)
+        self.high_threshold = self.settings.get("highthreshold", 0.20)
+        self.strong_pixel = self.settings.get("strong_pixel", 255)
+
+    @abstractmethod
+    def detect(self, img: np.ndarray) -> np.ndarray:
+        """Edge map of a grayscale image"""
+
+    def detect_stream(self, img: np.ndarray, stream: Optional[Hashable]) -> np.ndarray:
+        """Edge map of the next frame of one camera or lane (stream is its key); stateless backends ignore it"""
+        return self.detect(img)
+
+    def detect_result(self, img: np.ndarray, lane: Optional[int] = None, source: Optional[str] = None,
+                      stream: Optional[Hashable] = None) -> DetectionResult:
+        """Detect edges and count white pixels without touching the disk (stream: see detect_stream)"""
+        edges = self.detect(img) if stream is None else self.detect_stream(img, stream)
+        return DetectionResult(edges, self.strong_pixel, lane=lane, source=source, backend=self.name)
+
+    def absolute_thresholds(self, gradient_max: float):
+        """Convert the reference engine's relative thresholds into gradient-magnitude thresholds"""
+        high = gradient_max * self.high_threshold
+        return high * self.low_threshold, high
+
+
+# How the reference backend runs CannyEdgeDetector (image_processing.canny_edge_detection.detection_mode)
+DETECTION_MODES = ("batch", "workspace", "tiled", "incremental")
+
+
+class ReferenceBackend(EdgeDetectionBackend):
+    """The project's own CannyEdgeDetector, run in one of DETECTION_MODES"""
+
+    name = "reference"
+
+    def __init__(self, settings: Dict, mode: str = "batch", tiling: Optional[Dict] = None,
+                 incremental: Optional[Dict] = None):
+        """
+        Args:
+            settings: CannyEdgeDetector keyword arguments (see CannyEdgeDetector.settings_from_config)
+            mode: "batch" runs detect_batch on each frame; "workspace" reuses preallocated
+                  per-thread buffers across frames of the same shape (detect_workspace);
+                  "tiled" bounds working memory on frames larger than one tile (TiledCannyDetector);
+                  "incremental" recomputes only the tiles that changed since the previous frame of
+                  the same stream (IncrementalCannyDetector), for fixed cameras
+            tiling: TiledCannyDetector keyword arguments for "tiled" mode
+                    (see TiledCannyDetector.settings_from_config)
+            incremental: IncrementalCannyDetector keyword arguments for "incremental" mode
+                         (see IncrementalCannyDetector.settings_from_config)
+        """
+        super().__init__(settings)
+        if mode not in DETECTION_MODES:
+            raise ValueError(f"Unknown detection mode: {mode}. Supported: {', '.join(DETECTION_MODES)}")
+        self.mode = mode
+        self.detector = CannyEdgeDetector([], **self.settings)
+        self.tiled = None
+        if mode == "tiled":
+            from TiledCanny import TiledCannyDetector
+            self.tiled = TiledCannyDetector(self.detector, **(tiling or {}))
+        self.incremental = dict(incremental or {})
+        # Workspace buffers and previous incremental frames are not shareable,
+        # so every calling thread gets its own detectors
+        self._local = threading.local()
+
+    def _thread_detector(self) -> CannyEdgeDetector:
+        detector = getattr(self._local, "detector", None)
+        if detector is None:
+            detector = self._local.detector = CannyEdgeDetector([], **self.settings)
+        return detector
+
+    def _stream_detector(self, stream: Optional[Hashable]):
+        # One IncrementalCannyDetector per (thread, stream): a pooled worker sees frames of many cameras
+        streams = getattr(self._local, "streams", None)
+        if streams is None:
+            streams = self._local.streams = {}
+        if stream not in streams:
+            from TiledCanny import IncrementalCannyDetector
+            streams[stream] = IncrementalCannyDetector(CannyEdgeDetector([], **self.settings), **self.incremental)
+        return streams[stream]
+
+    def detect(self, img: np.ndarray) -> np.ndarray:
+        return self.detect_stream(img, None)
+
+    def detect_stream(self, img: np.ndarray, stream: Optional[Hashable]) -> np.ndarray:
+        """
+        Edge map of the next frame of one camera or lane. In "incremental" mode the frame is diffed
+        against the previous frame of the same stream; frames without a key (stream None) form one stream.
+        """
+        img = np.asarray(img)
+        if self.mode == "workspace":
+            # The workspace edge map is overwritten by the thread's next frame
+            return self._thread_detector().detect_workspace(img).copy()
+        if self.mode == "incremental":
+            # The cached edge map is patched in place by the stream's next frame
+            return self._stream_detector(stream).detect(img).copy()
+        if self.tiled is not None and not self.tiled.fits(img.shape):
+            return self.tiled.detect(img)
+        return self.detector.detect_batch(img[np.newaxis])[0]
+
+
+class OpenCVBackend(EdgeDetectionBackend):
+    """cv2.GaussianBlur followed by cv2.Canny with L2 gradient magnitude"""
+
+    name = "opencv"
+
+    def __init__(self, settings: Dict):
+        super().__init__(settings)
+        import cv2
+        self.cv2 = cv2
+        # OpenCV needs an odd Gaussian aperture
+        self.ksize = self.kernel_size | 1
+
+    def detect(self, img: np.ndarray) -> np.ndarray:
+        cv2 = self.cv2
+        img8 = to_uint8(img)
+        blurred = cv2.GaussianBlur(img8, (self.ksize, self.ksize), self.sigma)
+
+        gx = cv2.Sobel(blurred, cv2.CV_32F, 1, 0, ksize=3)
+        gy = cv2.Sobel(blurred, cv2.CV_32F, 0, 1, ksize=3)
+        low, high = self.absolute_thresholds(float(cv2.magnitude(gx, gy).max()))
+
+        edges = cv2.Canny(blurred, low, high, L2gradient=True)
+        return np.where(edges > 0, self.strong_pixel, 0).astype(np.uint8)
+
+
+class SkimageBackend(EdgeDetectionBackend):
+    """skimage.feature.canny with absolute thresholds derived from the smoothed gradient maximum"""
+
+    name = "skimage"
+
+    def __init__(self, settings: Dict):
+        super().__init__(settings)
+        from skimage import feature
+        self.feature = feature
+        self._gradient = CannyEdgeDetector([], sigma=self.sigma, kernel_size=self.kernel_size)
+
+    def detect(self, img: np.ndarray) -> np.ndarray:
+        img = np.asarray(img, dtype=np.float64)
+        G, _ = self._gradient.gradient_magnitude(self._gradient.smooth(img))
+        low, high = self.absolute_thresholds(float(G.max()))
+
+        edges = self.feature.canny(img, sigma=self.sigma, low_threshold=low, high_threshold=high)
+        return np.where(edges, self.strong_pixel, 0).astype(np.uint8)
+
+
+BACKENDS = {
+    ReferenceBackend.name: ReferenceBackend,
+    OpenCVBackend.name: OpenCVBackend,
+    SkimageBackend.name: SkimageBackend,
+}
+
+
+def to_uint8(img: np.ndarray) -> np.ndarray:
+    """Scale a grayscale image to uint8; float images in [0, 1] are treated as normalised"""
+    img = np.asarray(img)
+    if img.dtype == np.uint8:
+        return img
+    img = img.astype(np.float64)
+    if img.size and img.max() <= 1.0:
+        img = img * 255
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def create_backend(name: str, settings: Dict, **options) -> EdgeDetectionBackend:
+    """Instantiate a backend by name; options are passed to the reference backend only"""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown edge detection backend: {name}. Supported: {', '.join(BACKENDS)}")
+    if name != ReferenceBackend.name:
+        return BACKENDS[name](settings)
+    return ReferenceBackend(settings, **options)
+
+
+def backend_from_config(config) -> EdgeDetectionBackend:
+    """
+    Create the backend selected by image_processing.canny_edge_detection.backend.
+    The reference backend runs in image_processing.canny_edge_detection.detection_mode;
+    OpenCV and scikit-image ignore it.
+    """
+    prefix = "image_processing.canny_edge_detection"
+    name = config.get(f"{prefix}.backend", "reference")
+    mode = config.get(f"{prefix}.detection_mode", "batch")
+    options = {"mode": mode}
+    if mode == "tiled":
+        from TiledCanny import TiledCannyDetector
+        options["tiling"] = TiledCannyDetector.settings_from_config(config)
+    elif mode == "incremental":
+        from TiledCanny import IncrementalCannyDetector
+        options["incremental"] = IncrementalCannyDetector.settings_from_config(config)
+    return create_backend(name, CannyEdgeDetector.settings_from_config(config), **options)
+
+
+def load_grayscale(path: str, config) -> np.ndarray:
+    """Decode an image straight to grayscale with the configured weights (as the GUI does)"""
+    return ImageDecoder.from_config(config).decode_gray(path)
+
+
+def parity_report(image_paths: List[str], config, backends: Optional[List[str]] = None,
+                  tolerance: float = 0.05, repeats: int = 3) -> List[Dict]:
+    """
+    Compare white-pixel counts of each backend against the reference engine.
+
+    Args:
+        image_paths: Images to run
+        config: ConfigManager providing Canny and grayscale settings
+        backends: Backend names to compare (default: all)
+        tolerance: Maximum allowed relative white-pixel difference
+        repeats: Timing repetitions per image (best time is reported)
+
+    Returns:
+        One row per (image, backend) with counts, relative difference, time and tolerance flag
+    """
+    settings = CannyEdgeDetector.settings_from_config(config)
+    strong = settings.get("strong_pixel", 255)
+    instances = [create_backend(name, settings) for name in (backends or list(BACKENDS))]
+    reference = ReferenceBackend(settings)
+
+    rows = []
+    for path in image_paths:
+        img = load_grayscale(path, config)
+        reference_pixels = int(np.sum(reference.detect(img) == strong))
+        for backend in instances:
+            best = float("inf")
+            for _ in range(max(1, repeats)):
+                start = time.perf_counter()
+                edges = backend.detect(img)
+                best = min(best, time.perf_counter() - start)
+            pixels = int(np.sum(edges == strong))
+            rel_diff = abs(pixels - reference_pixels) / max(reference_pixels, 1)
+            rows.append({
+                "image": os.path.basename(path),
+                "backend": backend.name,
+                "white_pixels": pixels,
+                "reference_pixels": reference_pixels,
+                "difference": pixels - reference_pixels,
+                "relative_difference": rel_diff,
+                "time_ms": best * 1000,
+                "within_tolerance": rel_diff <= tolerance,
+            })
+    return rows
+
+
+def fastest_within_tolerance(rows: List[Dict]) -> Optional[str]:
+    """Backend with the lowest total time among those within tolerance on every image"""
+    totals = {}
+    for row in rows:
+        total, ok = totals.get(row["backend"], (0.0, True))
+        totals[row["backend"]] = (total + row["time_ms"], ok and row["within_tolerance"])
+    candidates = [(total, name) for name, (total, ok) in totals.items() if ok]
+    return min(candidates)[1] if candidates else None
+
+
+__all__ = ['DETECTION_MODES', 'DetectionResult', 'EdgeDetectionBackend', 'ReferenceBackend', 'OpenCVBackend', 'SkimageBackend',
+           'create_backend', 'backend_from_config', 'parity_report', 'fastest_within_tolerance']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Edge-detection backend parity report")
+    parser.add_argument("images", nargs="*", help="Images to compare (default: images/*.png)")
+    parser.add_argument("--backends", nargs="+", choices=list(BACKENDS), help="Backends to compare")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Allowed relative white-pixel difference")
+    parser.add_argument("--config", default="config.json", help="Configuration file")
+    args = parser.parse_args()
+
+    from utils import setup
+    config = setup(args.config)
+    paths = args.images
+    if not paths:
+        images_dir = config.get("directories.images", "images")
+        paths = sorted(os.path.join(images_dir, f) for f in os.listdir(images_dir) if f.lower().endswith(".png"))
+
+    rows = parity_report(paths, config, args.backends, args.tolerance)
+    print(f"{'Image':<14}{'Backend':<11}{'White px':>10}{'Reference':>11}{'Diff %':>9}{'Time ms':>10}  OK")
+    for row in rows:
+        print(f"{row['image']:<14}{row['backend']:<11}{row['white_pixels']:>10}{row['reference_pixels']:>11}"
+              f"{row['relative_difference'] * 100:>8.1f}%{row['time_ms']:>10.2f}  {'yes' if row['within_tolerance'] else 'no'}")
+    print(f"Fastest backend within {args.tolerance:.0%}: {fastest_within_tolerance(rows) or 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Image decoding for the Smart Traffic Control System.
+Decodes each capture once, straight to a float32 grayscale image in [0, 1] with the configured weights
+(one fused weighted sum over the decoded channels), plus an optional small RGB preview for the GUI.
+Camera frames larger than density estimation needs can be downscaled while decoding.
+"""
+
+import struct
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+REDUCTION_FACTORS = (1, 2, 4, 8)
+
+
+def image_size(path: str) -> Optional[Tuple[int, int]]:
+    """(height, width) from a PNG or JPEG header without decoding the image; None for other formats"""
+    with open(path, 'rb') as f:
+        header = f.read(26)
+        if header[:8] == b"\x89PNG\r\n\x1a\n" and header[12:16] == b"IHDR":
+            width, height = struct.unpack(">II", header[16:24])
+            return height, width
+        if header[:2] != b"\xff\xd8":
+            return None
+
+        # JPEG: walk the marker segments up to the start-of-frame marker holding the size
+        f.seek(2)
+        while True:
+            marker = f.read(2)
+            if len(marker) < 2 or marker[0] != 0xFF:
+                return None
+            if 0xC0 <= marker[1] <= 0xCF and marker[1] not in (0xC4, 0xC8, 0xCC):
+                height, width = struct.unpack(">HH", f.read(7)[3:7])
+                return height, width
+            length = f.read(2)
+            if len(length) < 2:
+                return None
+            f.seek(struct.unpack(">H", length)[0] - 2, 1)
+
+
+class DecodedImage:
+    """One decoded capture: grayscale for processing and an optional RGB preview"""
+
+    def __init__(self, gray: np.ndarray, preview: Optional[np.ndarray] = None, source: Optional[str] = None,
+                 reduction: int = 1):
+        self.gray = gray
+        self.preview = preview
+        self.source = source
+        self.reduction = reduction
+
+    def __repr__(self):
+        return f"DecodedImage(shape={self.gray.shape}, reduction={self.reduction}, source={self.source!r})"
+
+
+class ImageDecoder:
+    """
+    Decode image files to grayscale in [0, 1] for every bit depth.
+
+    8- and 16-bit images are scaled by their full range, alpha channels are ignored (as rgb2gray does)
+    and single-channel images are used as they are.
+    """
+
+    def __init__(self, weights: Tuple[float, float, float] = (0.2989, 0.5870, 0.1140), reduce_factor: int = 1,
+                 max_dimension: int = 0, preview_size: int = 200):
+        """
+        Args:
+            weights: Red, green and blue grayscale weights
+            reduce_factor: Always downscale by this factor while decoding (1, 2, 4 or 8)
+            max_dimension: If > 0, pick the smallest factor that brings the longer side down to this
+                (read from the file header; only ever larger than reduce_factor)
+            preview_size: Longer side of the preview in pixels
+        """
+        if reduce_factor not in REDUCTION_FACTORS:
+            raise ValueError(f"reduce_factor must be one of {REDUCTION_FACTORS}, got {reduce_factor}")
+        self.weights = tuple(weights)
+        self.reduce_factor = reduce_factor
+        self.max_dimension = max_dimension
+        self.preview_size = preview_size
+
+    @classmethod
+    def from_config(cls, config) -> "ImageDecoder":
+        """Create the decoder from the grayscale weights and image_processing.decode in config.json"""
+        return cls((config.get("image_processing.grayscale_conversion.r_weight", 0.2989),
+                    config.get("image_processing.grayscale_conversion.g_weight", 0.5870),
+                    config.get("image_processing.grayscale_conversion.b_weight", 0.1140)),
+                   reduce_factor=config.get("image_processing.decode.reduce_factor", 1),
+                   max_dimension=config.get("image_processing.decode.max_dimension", 0),
+                   preview_size=config.get("image_processing.decode.preview_size", 200))
+
+    def reduction_for(self, path: str) -> int:
+        """Downscale factor for a file"""
+        if self.max_dimension <= 0:
+            return self.reduce_factor
+        try:
+            size = image_size(path)
+        except OSError:
+            size = None
+        if size is None:
+            return self.reduce_factor
+        for factor in REDUCTION_FACTORS:
+            if factor >= self.reduce_factor and max(size) <= self.max_dimension * factor:
+                return factor
+        return REDUCTION_FACTORS[-1]
+
+    def to_gray(self, img: np.ndarray) -> np.ndarray:
+        """Fused scale + weighted sum of a BGR(A) or single-channel image into float32 [0, 1]"""
+        import cv2
+        scale = 1.0 / np.iinfo(img.dtype).max if img.dtype.kind in "ui" else 1.0
+        if img.ndim == 2:
+            return np.multiply(img, scale, dtype=np.float32)
+        r_weight, g_weight, b_weight = self.weights
+        # OpenCV channel order is BGR(A); a zero weight drops alpha
+        matrix = np.zeros((1, img.shape[2]), dtype=np.float32)
+        matrix[0, :3] = (b_weight * scale, g_weight * scale, r_weight * scale)
+        return cv2.transform(img.astype(np.float32, copy=False), matrix)
+
+    def make_preview(self, img: np.ndarray) -> np.ndarray:
+        """RGB uint8 thumbnail whose longer side is at most preview_size"""
+        import cv2
+        if img.dtype == np.uint16:
+            img = (img >> 8).astype(np.uint8)
+        elif img.dtype != np.uint8:
+            img = (np.clip(img, 0, 1) * 255).astype(np.uint8)
+        height, width = img.shape[:2]
+        if max(height, width) > self.preview_size:
+            scale = self.preview_size / max(height, width)
+            img = cv2.resize(img, (max(int(width * scale), 1), max(int(height * scale), 1)),
+                             interpolation=cv2.INTER_AREA)
+        if img.ndim == 2:
+            return cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+        return cv2.cvtColor(img, cv2.COLOR_BGRA2RGB if img.shape[2] == 4 else cv2.COLOR_BGR2RGB)
+
+    def decode(self, path: str, preview: bool = False) -> DecodedImage:
+        """
+        Decode a file once.
+
+        Args:
+            path: Image file
+            preview: Also build the RGB preview from the same decoded pixels
+
+        Raises:
+            ValueError: If the file cannot be decoded
+        """
+        import cv2
+        reduction = self.reduction_for(path)
+        if reduction == 1:
+            img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+        else:
+            # JPEGs are downscaled inside the decoder; other formats are resized right after decoding
+            img = cv2.imread(path, getattr(cv2, f"IMREAD_REDUCED_COLOR_{reduction}"))
+        if img is None:
+            raise ValueError(f"Could not decode image: {path}")
+        return DecodedImage(self.to_gray(img), self.make_preview(img) if preview else None, path, reduction)
+
+    def decode_gray(self, path: str) -> np.ndarray:
+        return self.decode(path).gray
+
+
+__all__ = ['DecodedImage', 'ImageDecoder', 'image_size']
@@ -0,0 +1,258 @@
+"""
+Rolling history of lane white-pixel counts for the Smart Traffic Control System.
+Keeps the last N samples per lane in memory-mapped NumPy ring buffers so history survives restarts,
+with O(1) updates of a per-lane histogram (for rolling percentiles) and an EWMA. The GUI, CLI tools
+and worker processes can share one history directory: updates are serialized by a lock file.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from utils import LoggerSetup
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+logger = LoggerSetup.get_logger("LaneHistory")
+
+
+# Columns of the per-lane state array
+_HEAD, _SIZE, _EWMA = 0, 1, 2
+
+
+class FileLock:
+    """Exclusive lock on a file, held by one process at a time (flock, or msvcrt.locking on Windows)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+        self._pid = None
+
+    def _open(self) -> int:
+        # A forked child reopens the file: flock locks belong to the open file, which fork shares
+        if self._fd is None or self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            self._pid = os.getpid()
+        return self._fd
+
+    def __enter__(self):
+        fd = self._open()
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        else:
+            os.lseek(fd, 0, os.SEEK_SET)
+            while True:
+                try:
+                    msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue  # LK_LOCK gives up after 10 attempts; keep waiting
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        else:
+            os.lseek(self._fd, 0, os.SEEK_SET)
+            msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+
+    def close(self):
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+        self._fd = None
+
+
+class LaneHistory:
+    """
+    Fixed-capacity ring buffers of (timestamp, white pixels) per lane.
+
+    Percentiles come from a histogram with bins of bin_width pixels that is updated in O(1) as
+    samples enter and leave the window, so they are accurate to within one bin width.
+
+    Every process keeps its own histograms over the shared buffers. A per-lane sequence number counts
+    the appends in the files, and a lane's histogram is rebuilt when another process has appended to it.
+    """
+
+    def __init__(self, directory: str, num_lanes: int = 4, capacity: int = 10080, bin_width: int = 16,
+                 max_pixels: int = 65536, ewma_alpha: float = 0.1,
+                 percentiles: Sequence[float] = (10, 40, 70, 90)):
+        """
+        Args:
+            directory: Where the ring buffer files live (created if missing)
+            num_lanes: Number of lanes
+            capacity: Samples kept per lane
+            bin_width: Histogram bin width in pixels (percentile resolution)
+            max_pixels: Counts above this share the last histogram bin
+            ewma_alpha: Weight of the newest sample in the EWMA
+            percentiles: Percentiles used as ascending classification thresholds
+        """
+        self.directory = directory
+        self.num_lanes = num_lanes
+        self.capacity = capacity
+        self.bin_width = bin_width
+        self.num_bins = max_pixels // bin_width + 1
+        self.ewma_alpha = ewma_alpha
+        self.percentile_levels = list(percentiles)
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+        self._file_lock = FileLock(os.path.join(directory, "history.lock"))
+        with self._file_lock:
+            self._created = False
+            self.counts = self._open("counts.npy", np.int64)
+            self.timestamps = self._open("timestamps.npy", np.float64)
+            # head (next write slot), size and EWMA per lane
+            self.state = self._open("state.npy", np.float64, (num_lanes, 3))
+            reset = self._created
+            if reset:
+                # Any buffer started over, so the others no longer describe a valid window
+                self.state[:] = 0
+            # Appends per lane, shared by every process; a reset also counts so others rebuild
+            self.sequence = self._open("sequence.npy", np.int64, (num_lanes,))
+            if reset:
+                self.sequence += 1
+            self.histograms = self._rebuild_histograms()
+            self._synced = self.sequence.copy()
+
+    @classmethod
+    def from_config(cls, config) -> "LaneHistory":
+        """Create the history from traffic_density.history in config.json"""
+        return cls(config.get("traffic_density.history.directory", "data/history"),
+                   num_lanes=config.get("traffic_density.lanes", 4),
+                   capacity=config.get("traffic_density.history.capacity", 10080),
+                   bin_width=config.get("traffic_density.history.bin_width", 16),
+                   max_pixels=config.get("traffic_density.history.max_pixels", 65536),
+                   ewma_alpha=config.get("traffic_density.history.ewma_alpha", 0.1),
+                   percentiles=config.get("traffic_density.history.percentiles", [10, 40, 70, 90]))
+
+    def _open(self, name: str, dtype, shape: Optional[Tuple[int, ...]] = None) -> np.memmap:
+        """Map an existing buffer file, or create a zeroed one if it is missing or has another layout"""
+        shape = shape or (self.num_lanes, self.capacity)
+        path = os.path.join(self.directory, name)
+        if os.path.exists(path):
+            try:
+                buffer = np.lib.format.open_memmap(path, mode='r+')
+                if buffer.shape == shape and buffer.dtype == dtype:
+                    return buffer
+                logger.warning("History file %s has shape %s, expected %s. Starting a new history.", path, buffer.shape, shape)
+                del buffer
+            except ValueError as e:
+                logger.warning("Unreadable history file %s: %s. Starting a new history.", path, e)
+        self._created = True
+        return np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+
+    def _bin(self, pixels) -> np.ndarray:
+        return np.minimum(np.asarray(pixels) // self.bin_width, self.num_bins - 1)
+
+    def _lane_histogram(self, i: int) -> np.ndarray:
+        """Histogram of the samples currently in a lane's window"""
+        head, size = int(self.state[i, _HEAD]), int(self.state[i, _SIZE])
+        if not size:
+            return np.zeros(self.num_bins, dtype=np.int64)
+        order = np.arange(head - size, head) % self.capacity
+        return np.bincount(self._bin(self.counts[i, order].clip(0)), minlength=self.num_bins)
+
+    def _rebuild_histograms(self) -> np.ndarray:
+        """Histograms of every lane's window (one bincount per lane on load)"""
+        return np.stack([self._lane_histogram(i) for i in range(self.num_lanes)])
+
+    def _sync(self, i: int):
+        """Rebuild a lane's histogram if another process appended to it (file lock held)"""
+        if self.sequence[i] != self._synced[i]:
+            self.histograms[i] = self._lane_histogram(i)
+            self._synced[i] = self.sequence[i]
+
+    def _index(self, lane: int) -> int:
+        if lane < 1 or lane > self.num_lanes:
+            raise ValueError(f"Invalid lane number: {lane}")
+        return lane - 1
+
+    def append(self, lane: int, pixels: int, timestamp: Optional[float] = None):
+        """Record one sample, evicting the oldest once the lane's window is full"""
+        i = self._index(lane)
+        pixels = max(int(pixels), 0)
+        with self._lock, self._file_lock:
+            self._sync(i)
+            head, size = int(self.state[i, _HEAD]), int(self.state[i, _SIZE])
+            if size == self.capacity:
+                self.histograms[i, self._bin(self.counts[i, head])] -= 1
+            else:
+                size += 1
+
+            self.counts[i, head] = pixels
+            self.timestamps[i, head] = time.time() if timestamp is None else timestamp
+            self.histograms[i, self._bin(pixels)] += 1
+
+            ewma = self.state[i, _EWMA]
+            self.state[i, _EWMA] = pixels if size == 1 else ewma + self.ewma_alpha * (pixels - ewma)
+            self.state[i, _HEAD] = (head + 1) % self.capacity
+            self.state[i, _SIZE] = size
+            self.sequence[i] += 1
+            self._synced[i] = self.sequence[i]
+
+    def append_many(self, lane_pixels: Dict[int, int], timestamp: Optional[float] = None):
+        """Record one sample for several lanes with a shared timestamp"""
+        timestamp = time.time() if timestamp is None else timestamp
+        for lane, pixels in lane_pixels.items():
+            self.append(lane, pixels, timestamp)
+
+    def size(self, lane: int) -> int:
+        return int(self.state[self._index(lane), _SIZE])
+
+    def window(self, lane: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(timestamps, counts) of the lane's window, oldest first"""
+        i = self._index(lane)
+        with self._lock, self._file_lock:
+            head, size = int(self.state[i, _HEAD]), int(self.state[i, _SIZE])
+            order = np.arange(head - size, head) % self.capacity
+            return self.timestamps[i, order].copy(), self.counts[i, order].copy()
+
+    def ewma(self, lane: int) -> Optional[float]:
+        """Exponentially weighted moving average of the lane's counts (None without samples)"""
+        i = self._index(lane)
+        return float(self.state[i, _EWMA]) if self.state[i, _SIZE] else None
+
+    def percentiles(self, lane: int, qs: Sequence[float]) -> List[float]:
+        """
+        Rolling percentiles of the lane's window, interpolated inside histogram bins.
+
+        Returns:
+            One value per q (0-100); empty list if the lane has no samples
+        """
+        i = self._index(lane)
+        with self._lock, self._file_lock:
+            self._sync(i)
+            size = int(self.state[i, _SIZE])
+            if not size:
+                return []
+            cumulative = np.cumsum(self.histograms[i])
+        ranks = np.clip(np.asarray(qs, dtype=np.float64), 0, 100) / 100 * size
+        bins = np.minimum(np.searchsorted(cumulative, ranks), self.num_bins - 1)
+        below = np.where(bins > 0, cumulative[bins - 1], 0)
+        inside = np.maximum(cumulative[bins] - below, 1)
+        return [float(v) for v in (bins + (ranks - below) / inside) * self.bin_width]
+
+    def percentile(self, lane: int, q: float) -> Optional[float]:
+        values = self.percentiles(lane, [q])
+        return values[0] if values else None
+
+    def thresholds(self, lane: int) -> List[float]:
+        """Classification thresholds for a lane: the configured percentiles of its history"""
+        return self.percentiles(lane, self.percentile_levels)
+
+    def flush(self):
+        """Write the mapped buffers back to disk"""
+        with self._lock:
+            for buffer in (self.counts, self.timestamps, self.state, self.sequence):
+                buffer.flush()
+
+
+__all__ = ['LaneHistory']
@@ -6,15 +6,12 @@ Implements a production-ready traffic control interface with threading and error
 import tkinter as tk
 from tkinter import messagebox, filedialog, ttk
 import threading
-import matplotlib.image as mpimg
-import cv2
-import numpy as np
 from pathlib import Path
 from datetime import datetime
 
-from CannyEdgeDetection import CannyEdgeDetector
+# cv2, numpy, PIL, the image decoder and the edge-detection backends are imported where they are first used
 from utils import (ConfigManager, LoggerSetup, FileManager, TrafficDataManager, 
-                   logger, config_mgr)
+                   AsyncImageWriter, ReferenceStatsCache, logger, get_config, setup)
 
 
 class TrafficControlGUI:
@@ -23,19 +20,26 @@ class TrafficControlGUI:
     def __init__(self, root):
         """Initialize the GUI"""
         self.root = root
-        self.config = config_mgr
+        self.config = get_config()
+        if self.config.get("config_reload.enabled", False):
+            # Thresholds and timings can be retuned in config.json while the GUI runs
+            self.config.start_watching()
         self.setup_logger()
         self.setup_directories()
         
         # Initialize managers
         self.file_manager = FileManager()
         self.traffic_manager = TrafficDataManager(self.config)
+        self.image_writer = AsyncImageWriter()
+        self.reference_stats = ReferenceStatsCache(self.config)
         
         # GUI variables
         self.selected_lane = tk.StringVar(self.root, value="Select Lane")
         self.filename = None
+        self.decoded = None
         self.reference_pixels = 0
         self.sample_pixels = 0
+        self.detection_result = None
         self.processing = False
         
         logger.info("Initializing GUI application")
@@ -52,7 +56,7 @@ class TrafficControlGUI:
                 self.config.get_directory(dir_key)
             self.logger.info("All required directories created/verified")
         except Exception as e:
-            self.logger.error(f"Error setting up directories: {e}")
+            self.logger.error("Error setting up directories: %s", e)
             messagebox.showerror("Directory Error", f"Failed to create directories: {e}")
     
     def setup_gui(self):
@@ -177,13 +181,13 @@ class TrafficControlGUI:
             self.logger.info("GUI setup completed successfully")
         
         except Exception as e:
-            self.logger.error(f"Error setting up GUI: {e}")
+            self.logger.error("Error setting up GUI: %s", e)
             messagebox.showerror("GUI Setup Error", f"Failed to setup GUI: {e}")
     
     def on_lane_selected(self, value):
         """Handle lane selection"""
         if value != "Select Lane":
-            self.logger.info(f"Lane selected: {value}")
+            self.logger.info("Lane selected: %s", value)
             self.status_var.set(f"Selected: {value}")
             self.process_btn.config(state=tk.NORMAL)
         else:
@@ -225,12 +229,16 @@ class TrafficControlGUI:
             is_valid, error_msg = self.file_manager.validate_image_file(self.filename, self.config)
             if not is_valid:
                 messagebox.showerror("Invalid Image", error_msg)
-                self.logger.error(f"Invalid image: {error_msg}")
+                self.logger.error("Invalid image: %s", error_msg)
                 self.update_status("Invalid image selected")
                 return
             
+            self.detection_result = None
+            # Decoded once: the preview and edge detection both use this result
+            from ImageDecoder import ImageDecoder
+            self.decoded = ImageDecoder.from_config(self.config).decode(self.filename, preview=True)
             self.path_label.config(text=f"Selected: {self.filename}")
-            self.logger.info(f"Image uploaded: {self.filename}")
+            self.logger.info("Image uploaded: %s", self.filename)
             self.update_status("Image loaded successfully")
             self.count_btn.config(state=tk.NORMAL)
             
@@ -238,34 +246,19 @@ class TrafficControlGUI:
             self.show_preview()
         
         except Exception as e:
-            self.logger.error(f"Error uploading image: {e}")
+            self.logger.error("Error uploading image: %s", e)
             messagebox.showerror("Upload Error", f"Failed to upload image: {e}")
             self.update_status("Error uploading image")
     
     def show_preview(self):
         """Show image preview"""
         try:
-            if not self.filename:
-                return
-            
-            # Load and resize image for preview
-            img = cv2.imread(self.filename)
-            if img is None:
+            if self.decoded is None or self.decoded.preview is None:
                 return
             
-            # Resize for preview (max 200x200)
-            h, w = img.shape[:2]
-            max_size = 200
-            if h > max_size or w > max_size:
-                scale = max_size / max(h, w)
-                img = cv2.resize(img, (int(w * scale), int(h * scale)))
-            
-            # Convert BGR to RGB
-            img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            
-            # Convert to PhotoImage format
+            # Convert the RGB thumbnail made while decoding to PhotoImage format
             from PIL import Image, ImageTk
-            pil_img = Image.fromarray(img)
+            pil_img = Image.fromarray(self.decoded.preview)
             photo = ImageTk.PhotoImage(pil_img)
             
             self.preview_label.config(image=photo, text="")
@@ -274,17 +267,7 @@ class TrafficControlGUI:
         except ImportError:
             self.preview_label.config(text="Install Pillow for image preview: pip install Pillow")
         except Exception as e:
-            self.logger.error(f"Error showing preview: {e}")
-    
-    def rgb2gray(self, rgb):
-        """Convert RGB to grayscale"""
-        r, g, b = rgb[:,:,0], rgb[:,:,1], rgb[:,:,2]
-        r_weight = self.config.get("image_processing.grayscale_conversion.r_weight", 0.2989)
-        g_weight = self.config.get("image_processing.grayscale_conversion.g_weight", 0.5870)
-        b_weight = self.config.get("image_processing.grayscale_conversion.b_weight", 0.1140)
-        
-        gray = r_weight * r + g_weight * g + b_weight * b
-        return gray
+            self.logger.error("Error showing preview: %s", e)
     
     def apply_canny_thread(self):
         """Apply Canny edge detection in a separate thread"""
@@ -296,42 +279,32 @@ class TrafficControlGUI:
             self.update_status("Processing image with Canny edge detection...")
             self.progress.start()
             
-            # Load image
-            img = mpimg.imread(self.filename)
-            img_gray = self.rgb2gray(img)
-            
-            # Apply Canny edge detection
-            sigma = self.config.get("image_processing.canny_edge_detection.sigma", 1.4)
-            kernel_size = self.config.get("image_processing.canny_edge_detection.kernel_size", 5)
-            low_threshold = self.config.get("image_processing.canny_edge_detection.low_threshold", 0.09)
-            high_threshold = self.config.get("image_processing.canny_edge_detection.high_threshold", 0.20)
-            weak_pixel = self.config.get("image_processing.canny_edge_detection.weak_pixel", 100)
-            strong_pixel = self.config.get("image_processing.canny_edge_detection.strong_pixel", 255)
-            
-            detector = CannyEdgeDetector(
-                [img_gray],
-                sigma=sigma,
-                kernel_size=kernel_size,
-                lowthreshold=low_threshold,
-                highthreshold=high_threshold,
-                weak_pixel=weak_pixel,
-                strong_pixel=strong_pixel
-            )
-            
-            detected_imgs = detector.detect()
-            
-            # Save processed image
-            output_dir = self.config.get("directories.output", "gray")
-            output_file = f"{output_dir}/test.png"
-            cv2.imwrite(output_file, detected_imgs[0])
-            
-            self.logger.info(f"Image processed and saved: {output_file}")
-            self.append_results(f"Image processed successfully - Saved to {output_file}")
+            # Grayscale image decoded at upload
+            if self.decoded is None or self.decoded.source != self.filename:
+                from ImageDecoder import ImageDecoder
+                self.decoded = ImageDecoder.from_config(self.config).decode(self.filename)
+            img_gray = self.decoded.gray
+            
+            # Apply Canny edge detection with the configured backend; the result stays in memory
+            from EdgeBackends import backend_from_config
+            backend = backend_from_config(self.config)
+            self.detection_result = backend.detect_result(img_gray, source=self.filename)
+            
+            # Optionally save the processed image in the background
+            if self.config.get("files.save_processed_image", True):
+                output_dir = self.config.get("directories.output", "gray")
+                output_file = f"{output_dir}/test.png"
+                self.image_writer.submit(output_file, self.detection_result.edges)
+                self.logger.info("Image processed, saving in background: %s", output_file)
+                self.append_results(f"Image processed successfully - Saving to {output_file}")
+            else:
+                self.logger.info("Image processed")
+                self.append_results("Image processed successfully")
             self.update_status("Image processing completed")
             self.count_btn.config(state=tk.NORMAL)
         
         except Exception as e:
-            self.logger.error(f"Error in Canny edge detection: {e}")
+            self.logger.error("Error in Canny edge detection: %s", e)
             self.append_results(f"ERROR: {e}")
             messagebox.showerror("Processing Error", f"Failed to process image: {e}")
             self.update_status("Error processing image")
@@ -359,35 +332,27 @@ class TrafficControlGUI:
         try:
             self.update_status("Counting pixels...")
             
-            output_dir = self.config.get("directories.output", "gray")
-            test_file = f"{output_dir}/test.png"
-            ref_file = self.config.get("files.reference_image", f"{output_dir}/refrence.png")
-            
-            if not Path(test_file).exists():
+            if self.detection_result is None:
                 messagebox.showerror("Error", "Processed image not found. Process an image first.")
                 return
             
-            if not Path(ref_file).exists():
-                messagebox.showwarning("Warning", f"Reference image not found: {ref_file}\nUsing test image as reference.")
-                ref_file = test_file
+            # Sample count comes straight from the in-memory detection result
+            self.sample_pixels = self.detection_result.white_pixels
             
-            # Read images in grayscale
-            img_test = cv2.imread(test_file, cv2.IMREAD_GRAYSCALE)
-            img_ref = cv2.imread(ref_file, cv2.IMREAD_GRAYSCALE)
-            
-            if img_test is None:
-                messagebox.showerror("Error", "Failed to read processed image")
-                return
-            
-            if img_ref is None:
+            # Reference count is memoized per lane and only recomputed when the file changes
+            lane = self.selected_lane.get().split()[-1] if self.selected_lane.get() != "Select Lane" else None
+            ref_file = self.reference_stats.reference_path(lane)
+            reference_pixels = self.reference_stats.get_white_pixels(lane)
+            if reference_pixels is not None:
+                self.reference_pixels = reference_pixels
+            elif Path(ref_file).exists():
                 messagebox.showerror("Error", "Failed to read reference image")
                 return
+            else:
+                messagebox.showwarning("Warning", f"Reference image not found: {ref_file}\nUsing test image as reference.")
+                self.reference_pixels = self.sample_pixels
             
-            # Count white pixels
-            self.sample_pixels = np.sum(img_test == 255)
-            self.reference_pixels = np.sum(img_ref == 255)
-            
-            self.logger.info(f"Pixel count - Sample: {self.sample_pixels}, Reference: {self.reference_pixels}")
+            self.logger.info("Pixel count - Sample: %s, Reference: %s", self.sample_pixels, self.reference_pixels)
             
             message = f"Sample White Pixels: {self.sample_pixels}\nReference White Pixels: {self.reference_pixels}"
             messagebox.showinfo("Pixel Count", message)
@@ -396,7 +361,7 @@ class TrafficControlGUI:
             self.time_btn.config(state=tk.NORMAL)
         
         except Exception as e:
-            self.logger.error(f"Error counting pixels: {e}")
+            self.logger.error("Error counting pixels: %s", e)
             messagebox.showerror("Pixel Count Error", f"Failed to count pixels: {e}")
             self.update_status("Error counting pixels")
     
@@ -427,11 +392,11 @@ class TrafficControlGUI:
             messagebox.showinfo("Time Allocation", message)
             
             self.append_results(f"Lane {lane_num} - {traffic_level} - {green_time}s")
-            self.logger.info(f"Time allocation: Lane {lane_num} - {traffic_level} - {green_time}s")
+            self.logger.info("Time allocation: Lane %s - %s - %ss", lane_num, traffic_level, green_time)
             self.update_status("Time allocation calculated")
         
         except Exception as e:
-            self.logger.error(f"Error in time allocation: {e}")
+            self.logger.error("Error in time allocation: %s", e)
             messagebox.showerror("Calculation Error", f"Failed to calculate time: {e}")
             self.update_status("Error calculating time allocation")
     
@@ -467,44 +432,45 @@ class TrafficControlGUI:
             scrollbar.config(command=text_widget.yview)
         
         except Exception as e:
-            self.logger.error(f"Error viewing logs: {e}")
+            self.logger.error("Error viewing logs: %s", e)
             messagebox.showerror("Error", f"Failed to view logs: {e}")
     
     def reset_data(self):
         """Reset all traffic data"""
         try:
             if messagebox.askyesno("Confirm", "Reset all lane data? This cannot be undone."):
-                data_file = self.config.get("files.traffic_data", "Previous_data.txt")
-                num_lanes = self.config.get("traffic_density.lanes", 4)
-                
-                with open(data_file, 'w') as f:
-                    for _ in range(num_lanes):
-                        f.write("0\n")
+                if not self.traffic_manager.reset_lane_data():
+                    raise IOError("Lane data could not be written")
                 
-                self.logger.info("Traffic data reset")
                 messagebox.showinfo("Success", "All lane data has been reset")
                 self.append_results("All lane data reset")
                 self.update_status("Data reset completed")
         
         except Exception as e:
-            self.logger.error(f"Error resetting data: {e}")
+            self.logger.error("Error resetting data: %s", e)
             messagebox.showerror("Error", f"Failed to reset data: {e}")
     
     def exit_app(self):
         """Exit application safely"""
         if messagebox.askyesno("Exit", "Are you sure you want to exit?"):
             self.logger.info("Application closed by user")
+            self.image_writer.close()
+            self.traffic_manager.close()
             self.root.destroy()
 
 
 def main():
     """Main entry point"""
     try:
+        config = setup()
+        if config is not None and config.get("metrics.enabled", False):
+            from Metrics import wrap
+            wrap(TrafficControlGUI, "pixel_count", "pixel_count_seconds")
         root = tk.Tk()
         app = TrafficControlGUI(root)
         root.mainloop()
     except Exception as e:
-        logger.error(f"Fatal error: {e}")
+        logger.error("Fatal error: %s", e)
         messagebox.showerror("Fatal Error", f"Application encountered a fatal error: {e}")
 
 
@@ -0,0 +1,420 @@
+"""
+Hot-path instrumentation for the Smart Traffic Control System.
+Wraps edge detection and its stages, image decoding, lane store I/O and classification with latency
+histograms and counters, and exports them as a Prometheus text file and a JSON snapshot.
+Nothing is wrapped unless metrics.enabled is set in config.json, so disabled metrics cost nothing.
+Worker processes (BatchProcess, Controller) record into their own registry and send it back with
+every result; the parent merges it and exports one view of the whole pool.
+"""
+
+import atexit
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Sequence
+
+from utils import LoggerSetup
+
+
+logger = LoggerSetup.get_logger("Metrics")
+
+# Upper bounds of the latency histogram buckets in milliseconds
+DEFAULT_BUCKETS_MS = (0.1, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+HELP = {
+    "canny_detect_seconds": "CannyEdgeDetector detection call latency",
+    "canny_stage_seconds": "CannyEdgeDetector stage latency",
+    "decode_seconds": "Image decode latency",
+    "pixel_count_seconds": "GUI pixel count latency",
+    "lane_data_seconds": "TrafficDataManager lane data read/write latency",
+    "lane_store_seconds": "Lane store (text file or SQLite) operation latency",
+    "classify_seconds": "Traffic level classification latency",
+    "frames_processed_total": "Frames run through edge detection",
+    "frames_decoded_total": "Images decoded",
+    "bytes_decoded_total": "Encoded image bytes read by the decoder",
+    "file_io_ops_total": "Lane store file/database operations",
+    "decoded_frame_peak_bytes": "Largest decoded grayscale frame in memory",
+    "canny_input_peak_bytes": "Largest image stack passed to edge detection",
+    "process_peak_rss_bytes": "Peak resident set size of the process or its largest worker process",
+}
+
+
+class Histogram:
+    """Fixed-bucket latency histogram; bounds are upper bucket limits in seconds"""
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[int]:
+        """Observations at or below each bound, followed by the total (the +Inf bucket)"""
+        total, result = 0, []
+        for count in self.counts:
+            total += count
+            result.append(total)
+        return result
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate of the q-quantile (0-1), interpolated inside the bucket like Prometheus does"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        cumulative = self.cumulative()
+        i = bisect.bisect_left(cumulative, rank)
+        if i >= len(self.bounds):
+            return self.bounds[-1]
+        lower = self.bounds[i - 1] if i > 0 else 0.0
+        below = cumulative[i - 1] if i > 0 else 0
+        inside = self.counts[i] or 1
+        return lower + (self.bounds[i] - lower) * (rank - below) / inside
+
+
+class MetricsRegistry:
+    """Thread-safe counters, high-water gauges and latency histograms keyed by name and labels"""
+
+    def __init__(self, buckets_ms: Sequence[float] = DEFAULT_BUCKETS_MS):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.set_buckets(buckets_ms)
+
+    def set_buckets(self, buckets_ms: Sequence[float]):
+        """Change the latency bucket bounds (milliseconds); existing histograms are dropped"""
+        with self._lock:
+            self.bounds = [bound / 1000 for bound in sorted(buckets_ms)]
+            self.histograms.clear()
+
+    @staticmethod
+    def _key(name: str, labels: Dict) -> tuple:
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_max(self, name: str, value: float, **labels):
+        """Raise a high-water mark gauge"""
+        key = self._key(name, labels)
+        with self._lock:
+            if value > self.gauges.get(key, float("-inf")):
+                self.gauges[key] = value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.bounds)
+            histogram.observe(seconds)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+    def drain(self) -> Dict:
+        """Take everything recorded so far as a picklable delta for merge() and start again from zero"""
+        self._update_process_gauges()
+        with self._lock:
+            delta = {
+                "counters": self.counters,
+                "gauges": self.gauges,
+                "histograms": {key: (histogram.counts, histogram.sum, histogram.count)
+                               for key, histogram in self.histograms.items()},
+            }
+            self.counters, self.gauges, self.histograms = {}, {}, {}
+        return delta
+
+    def merge(self, delta: Dict):
+        """Add a drain() delta from another registry (counters and histograms add up, gauges keep the maximum)"""
+        with self._lock:
+            for key, value in delta["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            for key, value in delta["gauges"].items():
+                if value > self.gauges.get(key, float("-inf")):
+                    self.gauges[key] = value
+            for key, (counts, total, count) in delta["histograms"].items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(self.bounds)
+                if len(counts) != len(histogram.counts):
+                    continue
+                histogram.counts = [a + b for a, b in zip(histogram.counts, counts)]
+                histogram.sum += total
+                histogram.count += count
+
+    def _update_process_gauges(self):
+        try:
+            import resource
+            # ru_maxrss is in kilobytes on Linux
+            self.set_max("process_peak_rss_bytes", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+        except (ImportError, OSError):
+            pass
+
+    @staticmethod
+    def _series(name: str, labels: tuple, extra: tuple = ()) -> str:
+        labels = labels + extra
+        if not labels:
+            return name
+        return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+    def snapshot(self) -> Dict:
+        """JSON-friendly view: counters, gauges and per-series latency summaries in milliseconds"""
+        self._update_process_gauges()
+        with self._lock:
+            histograms = {}
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                histograms[self._series(name, labels)] = {
+                    "count": histogram.count,
+                    "sum_ms": histogram.sum * 1000,
+                    "mean_ms": histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+                    "p50_ms": histogram.quantile(0.5) * 1000,
+                    "p95_ms": histogram.quantile(0.95) * 1000,
+                    "p99_ms": histogram.quantile(0.99) * 1000,
+                    "buckets_ms": {f"{bound * 1000:g}": count
+                                   for bound, count in zip(self.bounds + [float("inf")], histogram.cumulative())},
+                }
+            return {
+                "timestamp": time.time(),
+                "counters": {self._series(name, labels): value for (name, labels), value in sorted(self.counters.items())},
+                "gauges": {self._series(name, labels): value for (name, labels), value in sorted(self.gauges.items())},
+                "histograms": histograms,
+            }
+
+    def to_prometheus(self) -> str:
+        """Prometheus text exposition format (suitable for the node_exporter textfile collector)"""
+        self._update_process_gauges()
+        lines = []
+        seen = set()
+
+        def header(name: str, kind: str):
+            if name not in seen:
+                seen.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                header(name, "counter")
+                lines.append(f"{self._series(name, labels)} {value!r}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                header(name, "gauge")
+                lines.append(f"{self._series(name, labels)} {value!r}")
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                header(name, "histogram")
+                for bound, count in zip(self.bounds + [float("inf")], histogram.cumulative()):
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f"{self._series(name + '_bucket', labels, (('le', le),))} {count}")
+                lines.append(f"{self._series(name + '_sum', labels)} {histogram.sum!r}")
+                lines.append(f"{self._series(name + '_count', labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, prometheus_file: Optional[str] = None, json_file: Optional[str] = None):
+        """Write the Prometheus file and/or JSON snapshot, replacing each file atomically"""
+        for path, content in ((prometheus_file, self.to_prometheus), (json_file, self._json)):
+            if not path:
+                continue
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(content())
+            os.replace(tmp_path, path)
+
+    def _json(self) -> str:
+        return json.dumps(self.snapshot(), indent=2)
+
+
+# Process-wide registry used by the instrumentation
+registry = MetricsRegistry()
+
+# (owner, attribute, original) of everything instrument() replaced
+_wrapped = []
+_exporter = None
+
+
+def wrap(owner, attr: str, metric: str, labels: Optional[Dict] = None, counter: Optional[str] = None,
+         on_result: Optional[Callable] = None):
+    """
+    Replace owner.attr (a method or module function) with a version that records its latency.
+
+    Args:
+        owner: Class or module holding the callable
+        attr: Attribute name
+        metric: Histogram name
+        labels: Labels of the histogram series (also used for counter)
+        counter: Counter incremented once per call
+        on_result: Called as on_result(args, result) after a successful call to record extra metrics
+    """
+    original = owner.__dict__[attr] if isinstance(owner, type) else getattr(owner, attr)
+    labels = labels or {}
+
+    @functools.wraps(original)
+    def timed(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = original(*args, **kwargs)
+        finally:
+            registry.observe(metric, time.perf_counter() - start, **labels)
+        if counter:
+            registry.inc(counter, **labels)
+        if on_result is not None:
+            on_result(args, result)
+        return result
+
+    setattr(owner, attr, timed)
+    _wrapped.append((owner, attr, original))
+    return timed
+
+
+def _count_frames(args, result):
+    registry.inc("frames_processed_total", len(result))
+    stack = args[1] if len(args) > 1 else None
+    if stack is not None and hasattr(stack, "nbytes"):
+        registry.set_max("canny_input_peak_bytes", stack.nbytes)
+
+
+def _count_frame(args, result):
+    registry.inc("frames_processed_total")
+    registry.set_max("canny_input_peak_bytes", args[1].nbytes)
+
+
+def _count_decode(args, result):
+    registry.inc("frames_decoded_total")
+    registry.set_max("decoded_frame_peak_bytes", result.gray.nbytes)
+    try:
+        registry.inc("bytes_decoded_total", os.path.getsize(args[1]))
+    except (OSError, TypeError):
+        pass
+
+
+def instrument():
+    """Wrap the hot paths; the GUI adds pixel_count itself with wrap()"""
+    if _wrapped:
+        return
+    from CannyEdgeDetection import CannyEdgeDetector
+    from ImageDecoder import ImageDecoder
+    from utils import SQLiteLaneStore, TextLaneStore, TrafficDataManager
+
+    wrap(CannyEdgeDetector, "detect", "canny_detect_seconds", {"method": "detect"},
+         on_result=lambda args, result: registry.inc("frames_processed_total", len(result)))
+    wrap(CannyEdgeDetector, "detect_batch", "canny_detect_seconds", {"method": "detect_batch"}, on_result=_count_frames)
+    wrap(CannyEdgeDetector, "detect_workspace", "canny_detect_seconds", {"method": "detect_workspace"},
+         on_result=_count_frame)
+    for attr, stage in (("smooth", "gaussian"), ("sobel_filters", "sobel_filters"),
+                        ("non_max_suppression", "non_max_suppression"), ("threshold", "threshold"),
+                        ("hysteresis", "hysteresis")):
+        wrap(CannyEdgeDetector, attr, "canny_stage_seconds", {"stage": stage})
+
+    wrap(ImageDecoder, "decode", "decode_seconds", on_result=_count_decode)
+
+    for store, name in ((TextLaneStore, "text"), (SQLiteLaneStore, "sqlite")):
+        for attr, op in (("get_lanes", "read"), ("set_lanes", "write"), ("reset", "reset")):
+            wrap(store, attr, "lane_store_seconds", {"store": name, "op": op}, counter="file_io_ops_total")
+    for attr, op in (("get_lane_data", "read"), ("update_lane_data", "write"),
+                     ("update_lanes_data", "write"), ("reset_lane_data", "reset")):
+        wrap(TrafficDataManager, attr, "lane_data_seconds", {"op": op})
+    wrap(TrafficDataManager, "get_traffic_level", "classify_seconds", {"method": "get_traffic_level"})
+    wrap(TrafficDataManager, "get_traffic_levels", "classify_seconds", {"method": "get_traffic_levels"})
+
+    logger.info("Metrics instrumentation enabled (%d call sites)", len(_wrapped))
+
+
+def uninstrument():
+    """Put every original callable back"""
+    while _wrapped:
+        owner, attr, original = _wrapped.pop()
+        setattr(owner, attr, original)
+
+
+class MetricsExporter:
+    """Export the registry every interval seconds on a background thread, and once more at exit"""
+
+    def __init__(self, prometheus_file: Optional[str], json_file: Optional[str], interval: float = 15.0):
+        self.prometheus_file = prometheus_file
+        self.json_file = json_file
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        atexit.register(self.close)
+
+    def start(self) -> "MetricsExporter":
+        self._thread.start()
+        return self
+
+    def export(self):
+        try:
+            registry.export(self.prometheus_file, self.json_file)
+        except Exception as e:
+            logger.error("Error exporting metrics: %s", e)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.export()
+
+    def close(self):
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        self.export()
+
+
+def setup_metrics(config) -> bool:
+    """
+    Instrument the hot paths and start the exporter if metrics.enabled is set.
+
+    Returns:
+        Whether metrics are enabled
+    """
+    global _exporter
+    if not config.get("metrics.enabled", False):
+        return False
+    if _exporter is None:
+        registry.set_buckets(config.get("metrics.latency_buckets_ms", DEFAULT_BUCKETS_MS))
+        instrument()
+        _exporter = MetricsExporter(config.get("metrics.prometheus_file", "data/metrics.prom"),
+                                    config.get("metrics.json_file", "data/metrics.json"),
+                                    config.get("metrics.export_interval_seconds", 15.0)).start()
+    return True
+
+
+def setup_worker_metrics(config) -> bool:
+    """
+    Instrument a pool worker process if metrics.enabled is set. Nothing is exported from the worker:
+    it returns registry.drain() with each result and the parent merges it (merge_worker_metrics).
+
+    Returns:
+        Whether metrics are enabled
+    """
+    if not config.get("metrics.enabled", False):
+        return False
+    # A forked worker inherits the parent's instrumentation and records; only its own are sent back
+    registry.reset()
+    registry.set_buckets(config.get("metrics.latency_buckets_ms", DEFAULT_BUCKETS_MS))
+    instrument()
+    return True
+
+
+def merge_worker_metrics(delta: Optional[Dict]):
+    """Merge a worker's drain() delta into this process's registry (None from uninstrumented workers is ignored)"""
+    if delta:
+        registry.merge(delta)
+
+
+__all__ = ['Histogram', 'MetricsExporter', 'MetricsRegistry', 'instrument', 'merge_worker_metrics', 'registry',
+           'setup_metrics', 'setup_worker_metrics', 'uninstrument', 'wrap']
@@ -0,0 +1,107 @@
+"""
+Multi-lane counting from a single intersection frame for the Smart Traffic Control System.
+Lane regions of interest from config.json are rasterized once into a label mask, so one Canny pass
+per frame yields white-pixel counts for every lane.
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from EdgeBackends import DetectionResult, backend_from_config
+from utils import LoggerSetup, TrafficDataManager
+
+
+logger = LoggerSetup.get_logger("MultiLane")
+
+
+class LaneMask:
+    """Rasterized lane polygons: a uint8 label image with 0 as background and lane numbers inside ROIs"""
+
+    def __init__(self, polygons: Dict[int, List[List[float]]], normalized: bool = True):
+        """
+        Args:
+            polygons: Lane number -> list of [x, y] vertices
+            normalized: Vertices are fractions of the frame width/height rather than pixels
+        """
+        if not polygons:
+            raise ValueError("At least one lane polygon is required")
+        self.polygons = {int(lane): np.asarray(points, dtype=np.float64) for lane, points in polygons.items()}
+        if max(self.polygons) > 255 or min(self.polygons) < 1:
+            raise ValueError("Lane numbers must be between 1 and 255")
+        self.normalized = normalized
+        self.lanes = sorted(self.polygons)
+        self._masks = {}
+
+    @classmethod
+    def from_config(cls, config) -> "LaneMask":
+        """Build the mask description from the lane_roi section of config.json"""
+        return cls(config.get("lane_roi.polygons", {}), config.get("lane_roi.normalized", True))
+
+    def mask(self, shape: Tuple[int, int]) -> np.ndarray:
+        """Label mask for a frame shape; rasterized on first use and cached per shape"""
+        shape = tuple(shape[:2])
+        if shape not in self._masks:
+            import cv2
+            height, width = shape
+            labels = np.zeros(shape, dtype=np.uint8)
+            # Later lanes win where polygons overlap, including shared borders
+            for lane in self.lanes:
+                points = self.polygons[lane]
+                if self.normalized:
+                    points = points * [width, height]
+                cv2.fillPoly(labels, [np.round(points).astype(np.int32)], int(lane))
+            self._masks[shape] = labels
+            logger.info("Lane mask rasterized for %dx%d: %d lanes", width, height, len(self.lanes))
+        return self._masks[shape]
+
+    def count(self, edges: np.ndarray, strong_pixel: int = 255) -> Dict[int, int]:
+        """White-pixel count per lane in one pass over the edge map"""
+        labels = self.mask(edges.shape)
+        counts = np.bincount(labels[edges == strong_pixel], minlength=max(self.lanes) + 1)
+        return {lane: int(counts[lane]) for lane in self.lanes}
+
+
+class MultiLaneCounter:
+    """Run edge detection once per intersection frame and classify every lane from the result"""
+
+    def __init__(self, config, traffic_manager: Optional[TrafficDataManager] = None,
+                 lane_mask: Optional[LaneMask] = None):
+        self.config = config
+        self.traffic_manager = traffic_manager or TrafficDataManager(config)
+        self.lane_mask = lane_mask or LaneMask.from_config(config)
+        self.backend = backend_from_config(config)
+
+    def process(self, gray: np.ndarray, update: bool = False) -> Dict[int, Dict]:
+        """
+        Detect edges in one frame and classify all lanes.
+
+        Args:
+            gray: Grayscale intersection frame
+            update: Also store the new counts with TrafficDataManager (one write for all lanes)
+
+        Returns:
+            Lane number -> dict with white_pixels, traffic_level and green_time
+        """
+        result = self.backend.detect_result(gray)
+        return self.process_result(result, update)
+
+    def process_result(self, result: DetectionResult, update: bool = False) -> Dict[int, Dict]:
+        """Classify all lanes from an existing detection result"""
+        return self.classify(self.count(result.edges), update)
+
+    def count(self, edges: np.ndarray) -> Dict[int, int]:
+        """White-pixel count per lane of one edge map"""
+        return self.lane_mask.count(edges, self.backend.strong_pixel)
+
+    def classify(self, lane_pixels: Dict[int, int], update: bool = False) -> Dict[int, Dict]:
+        """Classify per-lane counts with a single lane data read (and a single write with update)"""
+        levels = self.traffic_manager.get_traffic_levels(lane_pixels)
+        if update:
+            self.traffic_manager.update_lanes_data(lane_pixels)
+        return {
+            lane: {"white_pixels": lane_pixels[lane], "traffic_level": level, "green_time": green_time}
+            for lane, (level, green_time) in levels.items()
+        }
+
+__all__ = ['LaneMask', 'MultiLaneCounter']
@@ -0,0 +1,133 @@
+"""
+Process-pool execution of CannyEdgeDetector for the Smart Traffic Control System.
+Keeps a persistent pool of warm worker processes so lane frames can be processed on every core.
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from CannyEdgeDetection import CannyEdgeDetector, gaussian_kernel_1d, gaussian_kernel_2d
+
+
+# Seconds start() waits for every worker process to come up
+START_TIMEOUT = 60
+
+# Detector owned by each worker process, built once by _init_worker
+_worker_detector = None
+_start_barrier = None
+
+
+def _init_worker(detector_kwargs: Dict, barrier=None):
+    """Build the worker's detector, its cached kernels and warm it up before the first frame arrives"""
+    global _worker_detector, _start_barrier
+    _worker_detector = CannyEdgeDetector([], **detector_kwargs)
+    gaussian_kernel_1d(_worker_detector.kernel_size, _worker_detector.sigma)
+    gaussian_kernel_2d(_worker_detector.kernel_size, _worker_detector.sigma)
+    _warm_up((8, 8))
+    _start_barrier = barrier
+
+
+def _detect_stack(stack: np.ndarray) -> np.ndarray:
+    """Run the worker's detector over an (N, H, W) stack"""
+    return _worker_detector.detect_batch(stack)
+
+
+def _detect_one(img: np.ndarray) -> np.ndarray:
+    """Run the worker's detector over a single (H, W) image"""
+    return _worker_detector.detect_batch(img[np.newaxis])[0]
+
+
+def _warm_up(shape) -> int:
+    """Run one small frame through every stage so imports and caches are hot"""
+    _worker_detector.detect_batch(np.zeros((1,) + tuple(shape)))
+    return os.getpid()
+
+
+def _started() -> int:
+    """Block until every worker has run its initializer, so each start() task lands on its own process"""
+    _start_barrier.wait(START_TIMEOUT)
+    return os.getpid()
+
+
+class ParallelCannyExecutor:
+    """Run Canny edge detection across a persistent pool of worker processes"""
+
+    def __init__(self, workers: Optional[int] = None, **detector_kwargs):
+        """
+        Args:
+            workers: Number of worker processes (None or 0 uses every CPU core)
+            **detector_kwargs: CannyEdgeDetector keyword arguments shared by all workers
+        """
+        self.workers = workers or os.cpu_count() or 1
+        self.detector_kwargs = detector_kwargs
+        self.pids = []
+        self._pool = None
+
+    @classmethod
+    def from_config(cls, config) -> "ParallelCannyExecutor":
+        """Create an executor from image_processing settings in config.json"""
+        workers = config.get("image_processing.parallel.workers", 0)
+        return cls(workers, **CannyEdgeDetector.settings_from_config(config))
+
+    def start(self) -> "ParallelCannyExecutor":
+        """Start every worker process and return once all are warm; calling it again is a no-op"""
+        if self._pool is None:
+            context = multiprocessing.get_context()
+            barrier = context.Barrier(self.workers)
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                             initializer=_init_worker,
+                                             initargs=(self.detector_kwargs, barrier))
+            # Each task holds its worker at the barrier, so the pool has to start a process per task
+            started = [self._pool.submit(_started) for _ in range(self.workers)]
+            self.pids = [future.result() for future in started]
+        return self
+
+    def shutdown(self, wait: bool = True):
+        """Stop the worker processes"""
+        if self._pool is not None:
+            self._pool.shutdown(wait=wait)
+            self._pool = None
+            self.pids = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.shutdown()
+
+    def submit(self, img: np.ndarray):
+        """Queue a single (H, W) image and return a Future for its uint8 edge map"""
+        self.start()
+        return self._pool.submit(_detect_one, np.asarray(img))
+
+    def detect(self, imgs) -> List[np.ndarray]:
+        """
+        Detect edges in many images at once.
+
+        Same-shaped images are split into one (N, H, W) chunk per worker; mixed
+        shapes are processed one image per task.
+
+        Returns:
+            List of uint8 edge maps in input order
+        """
+        self.start()
+        imgs = [np.asarray(img) for img in imgs]
+        if not imgs:
+            return []
+
+        if all(img.shape == imgs[0].shape for img in imgs):
+            chunks = np.array_split(np.stack(imgs), min(self.workers, len(imgs)))
+        else:
+            chunks = [img[np.newaxis] for img in imgs]
+
+        results = []
+        for edges in self._pool.map(_detect_stack, chunks):
+            results.extend(edges)
+        return results
+
+
+__all__ = ['ParallelCannyExecutor']
@@ -0,0 +1,288 @@
+"""
+Streaming video pipeline for the Smart Traffic Control System.
+Reads lane frames from a video file or capture device and runs grayscale conversion, edge detection,
+white-pixel counting and traffic classification in overlapping stages linked by bounded queues.
+An overhead camera that sees every approach can be counted per lane with the lane_roi polygons.
+"""
+
+import argparse
+import queue
+import threading
+import time
+from typing import Dict, Iterable, Iterator, Optional, Union
+
+import numpy as np
+
+from EdgeBackends import backend_from_config
+from MultiLane import MultiLaneCounter
+from utils import LoggerSetup, ReferenceStatsCache, TrafficDataManager
+
+
+logger = LoggerSetup.get_logger("StreamingPipeline")
+
+
+# Marks the end of the stream between stages
+_END = object()
+
+
+def video_frames(source: Union[str, int], max_frames: Optional[int] = None) -> Iterator[np.ndarray]:
+    """
+    Yield BGR frames from a video file path or capture device index.
+
+    Args:
+        source: Video file path, stream URL or integer camera index
+        max_frames: Stop after this many frames (None reads to the end)
+    """
+    import cv2
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise IOError(f"Cannot open video source: {source}")
+    try:
+        count = 0
+        while max_frames is None or count < max_frames:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            count += 1
+            yield frame
+    finally:
+        capture.release()
+
+
+class PipelineStats:
+    """Per-stage latency and throughput counters"""
+
+    def __init__(self, stages):
+        self.stages = list(stages)
+        self._lock = threading.Lock()
+        self.totals = {stage: 0.0 for stage in self.stages}
+        self.maxima = {stage: 0.0 for stage in self.stages}
+        self.counts = {stage: 0 for stage in self.stages}
+        self.frames = 0
+        self.started = None
+        self.finished = None
+
+    def record(self, stage: str, seconds: float):
+        with self._lock:
+            self.totals[stage] += seconds
+            self.counts[stage] += 1
+            self.maxima[stage] = max(self.maxima[stage], seconds)
+
+    def report(self) -> Dict:
+        """Frames per second and mean/max latency per stage in milliseconds"""
+        elapsed = ((self.finished or time.perf_counter()) - self.started) if self.started else 0.0
+        return {
+            "frames": self.frames,
+            "elapsed_seconds": elapsed,
+            "fps": self.frames / elapsed if elapsed > 0 else 0.0,
+            "stages": {
+                stage: {
+                    "mean_ms": self.totals[stage] / self.counts[stage] * 1000 if self.counts[stage] else 0.0,
+                    "max_ms": self.maxima[stage] * 1000,
+                }
+                for stage in self.stages
+            },
+        }
+
+
+class StreamingPipeline:
+    """Decode -> detect -> classify pipeline for one lane or a whole intersection, with each stage on its own thread"""
+
+    STAGES = ("decode", "grayscale", "detect", "count", "classify")
+
+    def __init__(self, config, lane: Optional[int], traffic_manager: Optional[TrafficDataManager] = None,
+                 queue_size: Optional[int] = None):
+        """
+        Args:
+            config: ConfigManager instance
+            lane: Lane number the frames belong to; None counts every lane_roi lane of each frame
+            traffic_manager: Shared TrafficDataManager (created from config if omitted)
+            queue_size: Bound of each inter-stage queue (default: streaming.queue_size)
+        """
+        self.config = config
+        self.lane = lane
+        self.traffic_manager = traffic_manager or TrafficDataManager(config)
+        self.queue_size = queue_size or config.get("streaming.queue_size", 8)
+        self._apply_config(config)
+        config.add_reload_listener(self._apply_config)
+        # One detection pass per frame covers all lanes of an overhead camera
+        self.counter = MultiLaneCounter(config, self.traffic_manager) if lane is None else None
+        self.reference_pixels = self._reference_pixels() if lane is not None else 0
+        self.stats = PipelineStats(self.STAGES)
+
+    def _apply_config(self, config):
+        """Build the detector settings; called again when config.json is reloaded mid-stream"""
+        self.backend = backend_from_config(config)
+        self.strong_pixel = config.get("image_processing.canny_edge_detection.strong_pixel", 255)
+        # BGR order, matching OpenCV frames
+        self.weights = np.array([
+            config.get("image_processing.grayscale_conversion.b_weight", 0.1140),
+            config.get("image_processing.grayscale_conversion.g_weight", 0.5870),
+            config.get("image_processing.grayscale_conversion.r_weight", 0.2989),
+        ], dtype=np.float32) / 255
+
+    def _reference_pixels(self) -> int:
+        reference_pixels = ReferenceStatsCache(self.config).get_white_pixels(self.lane)
+        if reference_pixels is None:
+            logger.warning("No reference statistics for lane %s. Using 0 reference pixels.", self.lane)
+            return 0
+        return reference_pixels
+
+    def to_gray(self, frame: np.ndarray) -> np.ndarray:
+        """Weighted grayscale in [0, 1], like rgb2gray on a matplotlib-decoded image"""
+        if frame.ndim == 2:
+            return frame.astype(np.float32) / 255
+        return frame[:, :, :3].astype(np.float32) @ self.weights
+
+    def _producer(self, frames: Iterable[np.ndarray], out_q: queue.Queue, stop: threading.Event):
+        iterator = None
+        try:
+            iterator = iter(frames)
+            while not stop.is_set():
+                start = time.perf_counter()
+                frame = next(iterator, _END)
+                if frame is _END:
+                    break
+                self.stats.record("decode", time.perf_counter() - start)
+                out_q.put(frame)
+        except Exception as e:
+            out_q.put(e)
+        finally:
+            if hasattr(iterator, "close"):
+                iterator.close()
+            out_q.put(_END)
+
+    def _detector(self, in_q: queue.Queue, out_q: queue.Queue, stop: threading.Event):
+        try:
+            while True:
+                try:
+                    item = in_q.get(timeout=0.05)
+                except queue.Empty:
+                    # The consumer may have drained our end marker while stopping
+                    if stop.is_set():
+                        return
+                    continue
+                if item is _END or isinstance(item, Exception):
+                    out_q.put(item)
+                    if isinstance(item, Exception):
+                        out_q.put(_END)
+                    return
+                if stop.is_set():
+                    continue
+                start = time.perf_counter()
+                gray = self.to_gray(item)
+                mid = time.perf_counter()
+                edges = self.backend.detect_stream(gray, self.lane)
+                end = time.perf_counter()
+                self.stats.record("grayscale", mid - start)
+                self.stats.record("detect", end - mid)
+                out_q.put(edges)
+        except Exception as e:
+            out_q.put(e)
+            out_q.put(_END)
+
+    def run(self, frames: Iterable[np.ndarray]) -> Iterator[Dict]:
+        """
+        Process frames and yield one result per frame.
+
+        Args:
+            frames: Iterable of BGR or grayscale uint8 frames (e.g. video_frames(path))
+
+        Yields:
+            Dict with frame index, white pixel count, traffic level and green time; without a lane,
+            the frame index and "lanes", a dict of lane number -> white pixels, traffic level and green time
+        """
+        decoded_q = queue.Queue(maxsize=self.queue_size)
+        edges_q = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        self.stats = PipelineStats(self.STAGES)
+        threads = [
+            threading.Thread(target=self._producer, args=(frames, decoded_q, stop), daemon=True),
+            threading.Thread(target=self._detector, args=(decoded_q, edges_q, stop), daemon=True),
+        ]
+        self.stats.started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        index = 0
+        try:
+            while True:
+                item = edges_q.get()
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+
+                start = time.perf_counter()
+                if self.counter is not None:
+                    lane_pixels = self.counter.lane_mask.count(item, self.strong_pixel)
+                    mid = time.perf_counter()
+                    result = {"frame": index, "lanes": self.counter.classify(lane_pixels)}
+                else:
+                    white_pixels = int(np.count_nonzero(item == self.strong_pixel))
+                    mid = time.perf_counter()
+                    level, green_time = self.traffic_manager.get_traffic_level(
+                        self.lane, white_pixels, self.reference_pixels)
+                    result = {
+                        "frame": index,
+                        "lane": self.lane,
+                        "white_pixels": white_pixels,
+                        "traffic_level": level,
+                        "green_time": green_time,
+                    }
+                end = time.perf_counter()
+                self.stats.record("count", mid - start)
+                self.stats.record("classify", end - mid)
+                self.stats.frames += 1
+
+                yield result
+                index += 1
+        finally:
+            # Unblock upstream stages if the consumer stops early, then let them finish
+            stop.set()
+            while any(thread.is_alive() for thread in threads):
+                for q in (decoded_q, edges_q):
+                    try:
+                        q.get(timeout=0.01)
+                    except queue.Empty:
+                        pass
+            self.stats.finished = time.perf_counter()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a lane video through the traffic density pipeline")
+    parser.add_argument("source", help="Video file path or camera index")
+    parser.add_argument("--lane", type=int, default=1, help="Lane number (1-4)")
+    parser.add_argument("--all-lanes", action="store_true",
+                        help="Overhead camera: count every lane_roi polygon of each frame instead of one lane")
+    parser.add_argument("--max-frames", type=int, default=None, help="Stop after this many frames")
+    parser.add_argument("--config", default="config.json", help="Configuration file")
+    args = parser.parse_args()
+
+    from utils import setup
+    config = setup(args.config)
+    if config.get("config_reload.enabled", False):
+        config.start_watching()
+    source = int(args.source) if args.source.isdigit() else args.source
+
+    pipeline = StreamingPipeline(config, None if args.all_lanes else args.lane)
+    for result in pipeline.run(video_frames(source, args.max_frames)):
+        if "lanes" in result:
+            print(f"Frame {result['frame']}: " + ", ".join(
+                f"lane {lane} {lane_result['white_pixels']} px - {lane_result['traffic_level']} ({lane_result['green_time']}s)"
+                for lane, lane_result in result["lanes"].items()))
+        else:
+            print(f"Frame {result['frame']}: {result['white_pixels']} px - "
+                  f"{result['traffic_level']} ({result['green_time']}s)")
+
+    report = pipeline.stats.report()
+    print(f"\n{report['frames']} frames in {report['elapsed_seconds']:.2f}s ({report['fps']:.1f} fps)")
+    for stage, timing in report["stages"].items():
+        print(f"  {stage:<10} mean {timing['mean_ms']:8.2f} ms   max {timing['max_ms']:8.2f} ms")
+
+
+__all__ = ['video_frames', 'PipelineStats', 'StreamingPipeline']
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+"""
+Tiled Canny edge detection for the Smart Traffic Control System.
+Processes large frames in fixed-size tiles with halo overlap so peak memory stays within a budget,
+while producing exactly the same edge map as a full-frame CannyEdgeDetector run, and recomputes
+only the changed tiles of consecutive frames from a fixed camera.
+"""
+
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+import numpy as np
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from CannyEdgeDetection import CannyEdgeDetector, EIGHT_CONNECTED
+
+
+# Rough peak working set per tile pixel: float64 smoothing/gradient/theta buffers plus NMS temporaries
+BYTES_PER_TILE_PIXEL = 96
+MIN_TILE_SIZE = 32
+
+
+class TiledCannyDetector:
+    """Run CannyEdgeDetector stage by stage over halo-padded tiles of one frame"""
+
+    def __init__(self, detector: CannyEdgeDetector, tile_size: Optional[int] = None,
+                 memory_budget_mb: float = 256, workers: int = 1):
+        """
+        Args:
+            detector: Detector providing the stage implementations and settings
+            tile_size: Tile edge length in pixels (None derives it from memory_budget_mb)
+            memory_budget_mb: Working-memory budget shared by all concurrently running tiles
+            workers: Number of tiles processed in parallel
+        """
+        if detector.strong_pixel > 255 or detector.weak_pixel > 255:
+            raise ValueError("Tiled detection stores pixel classes as uint8; weak/strong pixels must be <= 255")
+        self.detector = detector
+        self.workers = max(1, int(workers))
+        # Smoothing radius + Sobel (1) + NMS neighbour (1)
+        self.halo = int(detector.kernel_size) // 2 + 2
+        self.tile_size = tile_size or self.tile_size_for_budget(memory_budget_mb)
+
+    @staticmethod
+    def settings_from_config(config):
+        # Constructor keyword arguments (besides the detector) from image_processing.tiling in config.json
+        return {
+            "tile_size": config.get("image_processing.tiling.tile_size", 0) or None,
+            "memory_budget_mb": config.get("image_processing.tiling.memory_budget_mb", 256),
+            "workers": config.get("image_processing.tiling.workers", 1),
+        }
+
+    @classmethod
+    def from_config(cls, config) -> "TiledCannyDetector":
+        """Create a tiled detector from image_processing settings in config.json"""
+        detector = CannyEdgeDetector([], **CannyEdgeDetector.settings_from_config(config))
+        return cls(detector, **cls.settings_from_config(config))
+
+    def fits(self, shape: Tuple[int, int]) -> bool:
+        """True if a frame of this shape is a single tile (and needs no tiling)"""
+        return shape[0] <= self.tile_size and shape[1] <= self.tile_size
+
+    def tile_size_for_budget(self, memory_budget_mb: float) -> int:
+        """Largest square tile whose padded working set fits in the per-worker share of the budget"""
+        pixels = memory_budget_mb * 1024 * 1024 / (BYTES_PER_TILE_PIXEL * self.workers)
+        return max(MIN_TILE_SIZE, int(math.sqrt(pixels)) - 2 * self.halo)
+
+    def tiles(self, shape: Tuple[int, int]) -> List[Tuple[slice, slice]]:
+        """Non-overlapping core regions covering the frame, in row-major order"""
+        M, N = shape
+        return [(slice(i, min(i + self.tile_size, M)), slice(j, min(j + self.tile_size, N)))
+                for i in range(0, M, self.tile_size)
+                for j in range(0, N, self.tile_size)]
+
+    def padded(self, core: Tuple[slice, slice], shape: Tuple[int, int]):
+        """Core region grown by the halo (clipped to the frame) and the core's offset inside it"""
+        return padded_region(core, shape, self.halo)
+
+    def _map(self, fn, items):
+        if self.workers == 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return list(pool.map(fn, items))
+
+    def detect(self, img: np.ndarray) -> np.ndarray:
+        """
+        Detect edges in one (H, W) frame tile by tile.
+
+        Returns:
+            uint8 edge map identical to the full-frame detect() result
+        """
+        img = np.asarray(img)
+        shape = img.shape
+        tiles = self.tiles(shape)
+        detector = self.detector
+
+        # Pass 1: global gradient maximum for normalisation
+        def gradient_max(core):
+            outer, inner = self.padded(core, shape)
+            G, _ = detector.gradient_magnitude(detector.smooth(img[outer]))
+            return G[inner].max()
+        g_max = max(self._map(gradient_max, tiles))
+
+        # Pass 2: normalised NMS per tile; values are 0..255 so they are stored as uint8
+        classes = np.zeros(shape, dtype=np.uint8)
+        def suppress(core):
+            outer, inner = self.padded(core, shape)
+            G, theta = detector.gradient_magnitude(detector.smooth(img[outer]))
+            G = G / g_max * 255
+            classes[core] = detector.non_max_suppression(G, theta)[inner]
+            return classes[core].max()
+        nms_max = max(self._map(suppress, tiles))
+
+        # Pass 3: double threshold against the global NMS maximum, in place
+        def threshold(core):
+            classes[core] = detector.threshold(classes[core], img_max=nms_max)
+        self._map(threshold, tiles)
+
+        if detector.hysteresis_mode == "single_pass":
+            return detector.hysteresis_single_pass(classes)
+        return self._hysteresis_connected(classes, tiles)
+
+    def _hysteresis_connected(self, classes: np.ndarray, tiles) -> np.ndarray:
+        """Label each tile, join labels across seams, then keep components with a strong pixel"""
+        weak, strong = self.detector.weak_pixel, self.detector.strong_pixel
+
+        def label(core):
+            tile = classes[core]
+            labels, n = ndimage.label((tile == weak) | (tile == strong), structure=EIGHT_CONNECTED)
+            return labels, n
+
+        def summarize(core):
+            labels, n = label(core)
+            strong_labels = np.unique(labels[classes[core] == strong])
+            borders = (labels[0].copy(), labels[-1].copy(), labels[:, 0].copy(), labels[:, -1].copy())
+            return n, strong_labels, borders
+
+        summaries = self._map(summarize, tiles)
+
+        # Give every tile a disjoint range of global label ids
+        offsets = np.cumsum([0] + [n for n, _, _ in summaries])
+        total = int(offsets[-1]) + 1
+
+        def to_global(local, offset):
+            return np.where(local > 0, local + offset, 0)
+
+        borders = {}
+        for (core, (n, _, (top, bottom, left, right)), offset) in zip(tiles, summaries, offsets):
+            borders[(core[0].start, core[1].start)] = tuple(to_global(b, offset) for b in (top, bottom, left, right))
+
+        # 8-connected links across tile seams
+        pairs = []
+        step = self.tile_size
+        for (r, c), (top, bottom, left, right) in borders.items():
+            if (r, c + step) in borders:
+                pairs.extend(_seam_pairs(right, borders[(r, c + step)][2]))
+            if (r + step, c) in borders:
+                below = borders[(r + step, c)]
+                pairs.extend(_seam_pairs(bottom, below[0]))
+            if (r + step, c + step) in borders:
+                pairs.append((bottom[-1:], borders[(r + step, c + step)][0][:1]))
+            if (r + step, c - step) in borders:
+                pairs.append((bottom[:1], borders[(r + step, c - step)][0][-1:]))
+
+        u = np.concatenate([p[0] for p in pairs] + [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+        v = np.concatenate([p[1] for p in pairs] + [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+        linked = (u > 0) & (v > 0)
+        graph = coo_matrix((np.ones(linked.sum(), dtype=np.int8), (u[linked], v[linked])), shape=(total, total))
+        _, component = connected_components(graph, directed=False)
+
+        has_strong = np.zeros(component.max() + 1, dtype=bool)
+        for (_, strong_labels, _), offset in zip(summaries, offsets):
+            has_strong[component[strong_labels[strong_labels > 0] + offset]] = True
+        keep = has_strong[component]
+        keep[0] = False
+
+        def finalize(item):
+            core, offset = item
+            labels, _ = label(core)
+            classes[core] = np.where(keep[to_global(labels, offset)], strong, 0)
+        self._map(finalize, list(zip(tiles, offsets)))
+        return classes
+
+
+class IncrementalCannyDetector:
+    """
+    Canny for a fixed camera that only recomputes tiles whose content changed since the last frame.
+
+    Keeps the last processed frame and its edge map. A cheap per-tile mean absolute difference finds
+    dirty tiles; each is recomputed over its halo using the gradient and NMS maxima of the last full
+    frame, and patched into the cached edge map and white-pixel count. A full frame is recomputed on
+    the first frame, every keyframe_interval frames, or when too many tiles are dirty, which also
+    resynchronises the normalisation.
+    """
+
+    def __init__(self, detector: CannyEdgeDetector, tile_size: int = 64, change_threshold: float = 0.01,
+                 max_dirty_fraction: float = 0.5, keyframe_interval: int = 150):
+        """
+        Args:
+            detector: Detector providing the stage implementations and settings
+            tile_size: Edge length of the change-detection tiles in pixels
+            change_threshold: Mean absolute intensity difference above which a tile is dirty
+            max_dirty_fraction: Recompute the whole frame when more tiles than this are dirty
+            keyframe_interval: Force a full recompute after this many frames
+        """
+        self.detector = detector
+        self.tile_size = int(tile_size)
+        self.change_threshold = change_threshold
+        self.max_dirty_fraction = max_dirty_fraction
+        self.keyframe_interval = keyframe_interval
+        # Stage halo, plus the same again of hysteresis context around each dirty tile
+        self.halo = int(detector.kernel_size) // 2 + 2
+        self.reset()
+
+    @staticmethod
+    def settings_from_config(config):
+        # Constructor keyword arguments (besides the detector) from image_processing.incremental in config.json
+        prefix = "image_processing.incremental"
+        return {
+            "tile_size": config.get(f"{prefix}.tile_size", 64),
+            "change_threshold": config.get(f"{prefix}.change_threshold", 0.01),
+            "max_dirty_fraction": config.get(f"{prefix}.max_dirty_fraction", 0.5),
+            "keyframe_interval": config.get(f"{prefix}.keyframe_interval", 150),
+        }
+
+    @classmethod
+    def from_config(cls, config) -> "IncrementalCannyDetector":
+        """Create an incremental detector from image_processing settings in config.json"""
+        detector = CannyEdgeDetector([], **CannyEdgeDetector.settings_from_config(config))
+        return cls(detector, **cls.settings_from_config(config))
+
+    def reset(self):
+        """Drop the cached frame so the next call recomputes everything"""
+        self.previous = None
+        self.edges = None
+        self.white_pixels = 0
+        self.g_max = None
+        self.nms_max = None
+        self.frames_since_keyframe = 0
+        self.last_dirty_tiles = 0
+        self.last_full = False
+
+    def dirty_tiles(self, img: np.ndarray) -> np.ndarray:
+        """Boolean (tiles_y, tiles_x) mask of tiles whose mean absolute difference exceeds the threshold"""
+        M, N = img.shape
+        ts = self.tile_size
+        ty, tx = -(-M // ts), -(-N // ts)
+        diff = np.zeros((ty * ts, tx * ts), dtype=np.float32)
+        np.subtract(img, self.previous, out=diff[:M, :N], casting='unsafe')
+        np.abs(diff, out=diff)
+        # Edge tiles are partly padding; scale their mean back up to the real pixel count
+        sums = diff.reshape(ty, ts, tx, ts).sum(axis=(1, 3))
+        rows = np.minimum(ts, M - np.arange(ty) * ts)
+        cols = np.minimum(ts, N - np.arange(tx) * ts)
+        return sums / np.outer(rows, cols) > self.change_threshold
+
+    def detect(self, img: np.ndarray) -> np.ndarray:
+        """
+        Detect edges in the next frame.
+
+        Returns:
+            Cached uint8 edge map, patched in place on later calls (copy it to keep a snapshot);
+            self.white_pixels holds its strong-pixel count
+        """
+        img = np.asarray(img)
+        full = (self.previous is None or self.previous.shape != img.shape
+                or self.frames_since_keyframe >= self.keyframe_interval)
+        if not full:
+            dirty = self.dirty_tiles(img)
+            full = bool(dirty.mean() > self.max_dirty_fraction)
+
+        if full:
+            self._full(img)
+        else:
+            ts = self.tile_size
+            for ty, tx in zip(*np.nonzero(dirty)):
+                self._patch((slice(ty * ts, min((ty + 1) * ts, img.shape[0])),
+                             slice(tx * ts, min((tx + 1) * ts, img.shape[1]))), img)
+            self.last_dirty_tiles = int(dirty.sum())
+            self.frames_since_keyframe += 1
+        self.last_full = full
+        return self.edges
+
+    def _full(self, img: np.ndarray):
+        detector = self.detector
+        G, theta = detector.gradient_magnitude(detector.smooth(img))
+        self.g_max = G.max()
+        nms = detector.non_max_suppression(G / self.g_max * 255, theta)
+        self.nms_max = nms.max()
+        self.edges = detector.hysteresis(detector.threshold(nms)).astype(np.uint8)
+        self.white_pixels = int(np.count_nonzero(self.edges == detector.strong_pixel))
+        self.previous = np.array(img, dtype=np.float32)
+        self.frames_since_keyframe = 0
+        self.last_dirty_tiles = -(-img.shape[0] // self.tile_size) * -(-img.shape[1] // self.tile_size)
+
+    def _patch(self, core: Tuple[slice, slice], img: np.ndarray):
+        detector = self.detector
+        strong = detector.strong_pixel
+        shape = img.shape
+
+        # A change inside the tile alters smoothing, gradients and NMS up to a halo beyond it,
+        # so `write` (core + halo) is recomputed; `region` adds context around it, and computing
+        # the stages on `region` needs another halo
+        write = padded_region(core, shape, self.halo)[0]
+        region, write_in_region = padded_region(write, shape, self.halo)
+        outer, region_in_outer = padded_region(region, shape, self.halo)
+
+        G, theta = detector.gradient_magnitude(detector.smooth(img[outer]))
+        G = G / self.g_max * 255
+        nms = np.minimum(detector.non_max_suppression(G, theta), 255)
+        classes = detector.threshold(nms, img_max=self.nms_max)[region_in_outer]
+
+        # Cached edges around the recomputed area act as strong seeds so chains crossing its border survive
+        context = self.edges[region] == strong
+        context[write_in_region] = False
+        classes[context] = strong
+        patched = detector.hysteresis(classes)[write_in_region]
+
+        old_count = int(np.count_nonzero(self.edges[write] == strong))
+        self.edges[write] = patched
+        self.white_pixels += int(np.count_nonzero(patched == strong)) - old_count
+        self.previous[core] = img[core]
+
+
+def padded_region(core: Tuple[slice, slice], shape: Tuple[int, int], halo: int):
+    """Core region grown by halo pixels (clipped to the frame) and the core's offset inside it"""
+    rows, cols = core
+    r0, c0 = max(rows.start - halo, 0), max(cols.start - halo, 0)
+    r1, c1 = min(rows.stop + halo, shape[0]), min(cols.stop + halo, shape[1])
+    inner = (slice(rows.start - r0, rows.stop - r0), slice(cols.start - c0, cols.stop - c0))
+    return (slice(r0, r1), slice(c0, c1)), inner
+
+
+def _seam_pairs(a: np.ndarray, b: np.ndarray):
+    """Label pairs linked 8-connectedly across a seam between two parallel border strips"""
+    return [(a, b), (a[1:], b[:-1]), (a[:-1], b[1:])]
+
+
+__all__ = ['TiledCannyDetector', 'IncrementalCannyDetector']
@@ -0,0 +1,99 @@
+"""
+Vectorized traffic density classification for the Smart Traffic Control System.
+Builds a sorted level table once from traffic_density.time_allocation and classifies arrays of
+white-pixel counts for any number of lanes, frames or intersections with np.searchsorted.
+"""
+
+from bisect import bisect_right
+from typing import Dict, Sequence, Tuple
+
+import numpy as np
+
+
+class LevelTable:
+    """
+    Traffic levels ordered by their "threshold" from time_allocation.
+
+    A sample's score is the number of reference values (stored lane counts or history percentiles)
+    it reaches; it gets the highest level whose threshold does not exceed that score, and the lowest
+    level if it reaches none.
+    """
+
+    def __init__(self, time_config: Dict):
+        """
+        Args:
+            time_config: traffic_density.time_allocation, name -> {threshold, green_time_seconds, label}
+        """
+        if not time_config:
+            raise ValueError("time_allocation must define at least one level")
+        levels = sorted(time_config.items(), key=lambda item: item[1].get("threshold", 0))
+        self.names = [name for name, _ in levels]
+        self.thresholds = [level.get("threshold", 0) for _, level in levels]
+        self.labels = np.array([level["label"] for _, level in levels], dtype=object)
+        self.green_times = np.array([level["green_time_seconds"] for _, level in levels])
+        self._thresholds = np.asarray(self.thresholds)
+
+    @classmethod
+    def from_config(cls, config) -> "LevelTable":
+        return cls(config.get("traffic_density.time_allocation"))
+
+    def level_for_score(self, score):
+        """Level index for one score or an array of scores"""
+        if np.ndim(score) == 0:
+            return max(bisect_right(self.thresholds, score) - 1, 0)
+        return np.maximum(np.searchsorted(self._thresholds, score, side='right') - 1, 0)
+
+    def classify_one(self, sample_pixels: float, reference: Sequence[float]) -> Tuple[str, int]:
+        """(label, green time) for a single sample; pure Python, for the per-image GUI path"""
+        index = self.level_for_score(bisect_right(sorted(reference), sample_pixels))
+        return self.labels[index], int(self.green_times[index])
+
+    def classify(self, samples, reference, lanes=None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Classify many samples at once.
+
+        Args:
+            samples: Array of white-pixel counts (any shape)
+            reference: One sequence of reference values shared by all samples, or one sequence per
+                lane (rows may differ in length)
+            lanes: 1-based lane of each sample (same shape as samples), required with per-lane reference
+
+        Returns:
+            (level indices, green times) arrays shaped like samples; use labels[indices] for labels
+        """
+        samples = np.asarray(samples, dtype=np.float64)
+        if lanes is None:
+            scores = np.searchsorted(np.sort(np.asarray(reference, dtype=np.float64)), samples, side='right')
+        else:
+            scores = self._per_lane_scores(samples, reference, np.asarray(lanes) - 1)
+        indices = self.level_for_score(scores)
+        return indices, self.green_times[indices]
+
+    @staticmethod
+    def _per_lane_scores(samples: np.ndarray, reference, rows: np.ndarray) -> np.ndarray:
+        """
+        Scores against each sample's own lane row with a single searchsorted: every row is shifted
+        into a disjoint value range and the rows are concatenated into one sorted array.
+        """
+        rows_values = [np.sort(np.asarray(row, dtype=np.float64)) for row in reference]
+        width = max(len(row) for row in rows_values)
+        finite = [row for row in rows_values if row.size]
+        low = min([samples.min(initial=0)] + [row[0] for row in finite])
+        high = max([samples.max(initial=0)] + [row[-1] for row in finite])
+
+        # Short rows are padded with a value no sample can reach
+        table = np.full((len(rows_values), width), high + 0.5)
+        for i, row in enumerate(rows_values):
+            table[i, :row.size] = row
+        span = high - low + 1
+        offsets = np.arange(len(rows_values)) * span
+        flat = (table - low + offsets[:, np.newaxis]).ravel()
+
+        positions = np.searchsorted(flat, samples - low + offsets[rows], side='right')
+        return positions - rows * width
+
+    def labels_for(self, indices) -> np.ndarray:
+        return self.labels[indices]
+
+
+__all__ = ['LevelTable']
@@ -9,6 +9,34 @@ import json
 from pathlib import Path
 
 
+def temp_config(tmp_dir, overrides=None):
+    """
+    ConfigManager for a copy of config.json whose lane data, history and caches live in tmp_dir,
+    so tests never touch the production files. overrides maps dotted keys to values.
+    """
+    from utils import ConfigManager, config_mgr
+    with open(config_mgr.config_path) as f:
+        config = json.load(f)
+    settings = {
+        "files.traffic_data": os.path.join(tmp_dir, "Previous_data.txt"),
+        "files.traffic_data_backup": os.path.join(tmp_dir, "Previous_data_backup.txt"),
+        "files.traffic_db": os.path.join(tmp_dir, "traffic.db"),
+        "files.reference_stats_cache": os.path.join(tmp_dir, "reference_stats.json"),
+        "traffic_density.history.directory": os.path.join(tmp_dir, "history"),
+        **(overrides or {}),
+    }
+    for key, value in settings.items():
+        *parents, name = key.split(".")
+        section = config
+        for parent in parents:
+            section = section.setdefault(parent, {})
+        section[name] = value
+    config_file = os.path.join(tmp_dir, "config.json")
+    with open(config_file, 'w') as f:
+        json.dump(config, f)
+    return ConfigManager(config_file)
+
+
 def test_imports():
     """Test if all required modules can be imported"""
     print("Testing imports...")
@@ -108,27 +136,30 @@ def test_traffic_data_manager():
     """Test traffic data manager"""
     print("\nTesting traffic data manager...")
     try:
-        from utils import config_mgr, TrafficDataManager
-        
-        tdm = TrafficDataManager(config_mgr)
-        
-        # Test getting lane data
-        data = tdm.get_lane_data()
-        assert len(data) == 4
+        import tempfile
+        from utils import TrafficDataManager
         
-        # Test updating lane data
-        result = tdm.update_lane_data(1, 100)
-        assert result == True
-        
-        # Verify update
-        data = tdm.get_lane_data()
-        assert data[0] == 100
-        
-        # Test traffic level calculation
-        level, time = tdm.get_traffic_level(1, 100, 50)
-        assert isinstance(level, str)
-        assert isinstance(time, int)
-        assert time in [30, 40, 50, 60]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tdm = TrafficDataManager(temp_config(tmp_dir))
+            
+            # Test getting lane data
+            data = tdm.get_lane_data()
+            assert len(data) == 4
+            
+            # Test updating lane data
+            result = tdm.update_lane_data(1, 100)
+            assert result == True
+            
+            # Verify update
+            data = tdm.get_lane_data()
+            assert data[0] == 100
+            
+            # Test traffic level calculation
+            level, time = tdm.get_traffic_level(1, 100, 50)
+            assert isinstance(level, str)
+            assert isinstance(time, int)
+            assert time in [30, 40, 50, 60]
+            tdm.close()
         
         print("✓ Traffic data manager test successful")
         return True
@@ -160,6 +191,1279 @@ def test_canny_edge_detector():
         return False
 
 
+def test_vectorized_nms():
+    """Test vectorized non-maximum suppression matches the reference loop"""
+    print("\nTesting vectorized non-maximum suppression...")
+    try:
+        import numpy as np
+        from scipy.ndimage import convolve
+        from CannyEdgeDetection import CannyEdgeDetector
+        
+        rng = np.random.default_rng(0)
+        detector = CannyEdgeDetector([], sigma=1.4, kernel_size=5)
+        
+        for test_img in [rng.integers(0, 256, (60, 80), dtype=np.uint8), rng.random((50, 40)) * 255]:
+            smoothed = convolve(test_img, detector.gaussian_kernel(5, 1.4))
+            gradient, theta = detector.sobel_filters(smoothed)
+            expected = detector.non_max_suppression_loop(gradient, theta)
+            result = detector.non_max_suppression(gradient, theta)
+            assert result.dtype == expected.dtype
+            assert np.array_equal(result, expected)
+        
+        print("✓ Vectorized non-maximum suppression test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Vectorized non-maximum suppression error: {e}")
+        return False
+
+
+def test_connected_hysteresis():
+    """Test connected-component hysteresis keeps whole weak chains"""
+    print("\nTesting connected-component hysteresis...")
+    try:
+        import numpy as np
+        from CannyEdgeDetection import CannyEdgeDetector
+        
+        # Weak chain running left from a strong pixel, plus an isolated weak blob
+        img = np.zeros((6, 10), dtype=np.int32)
+        img[2, 1:5] = 75
+        img[2, 5] = 255
+        img[4, 8] = 75
+        
+        connected = CannyEdgeDetector([], hysteresis_mode="connected").hysteresis(img.copy())
+        assert np.array_equal(np.nonzero(connected[2])[0], np.arange(1, 6))
+        assert connected[4, 8] == 0
+        assert set(np.unique(connected)) <= {0, 255}
+        
+        # Single pass drops the chain except the pixel next to the strong one
+        single = CannyEdgeDetector([], hysteresis_mode="single_pass").hysteresis(img.copy())
+        assert np.array_equal(np.nonzero(single[2])[0], np.array([4, 5]))
+        
+        # The vectorized single pass matches the original raster loop
+        rng = np.random.default_rng(2)
+        detector = CannyEdgeDetector([], hysteresis_mode="single_pass", weak_pixel=75)
+        for shape in [(40, 50), (3, 9), (2, 5)]:
+            classes = rng.choice(np.array([0, 75, 255]), size=shape, p=[0.4, 0.45, 0.15])
+            assert np.array_equal(detector.hysteresis_single_pass(classes.copy()),
+                                  detector.hysteresis_single_pass_loop(classes.copy()))
+        
+        assert CannyEdgeDetector([]).hysteresis_mode == "connected"
+        
+        print("✓ Connected-component hysteresis test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Connected-component hysteresis error: {e}")
+        return False
+
+
+def test_separable_filters():
+    """Test separable Gaussian/Sobel passes match the full 2-D kernels"""
+    print("\nTesting separable filtering stage...")
+    try:
+        import numpy as np
+        from CannyEdgeDetection import CannyEdgeDetector, gaussian_kernel_1d, gaussian_kernel_2d
+        
+        test_img = np.random.default_rng(1).random((64, 48))
+        full = CannyEdgeDetector([], sigma=1.4, kernel_size=5, filter_mode="full")
+        separable = CannyEdgeDetector([], sigma=1.4, kernel_size=5, filter_mode="separable")
+        
+        # Kernels are cached per (kernel_size, sigma)
+        assert gaussian_kernel_1d(5, 1.4) is gaussian_kernel_1d(5, 1.4)
+        assert np.allclose(gaussian_kernel_2d(5, 1.4), full.gaussian_kernel(5, 1.4))
+        
+        smoothed = full.smooth(test_img)
+        assert np.allclose(separable.smooth(test_img), smoothed)
+        
+        G_full, theta_full = full.sobel_filters(smoothed)
+        G_sep, theta_sep = separable.sobel_filters(smoothed)
+        assert np.allclose(G_sep, G_full)
+        assert np.allclose(theta_sep, theta_full)
+        
+        print("✓ Separable filtering test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Separable filtering error: {e}")
+        return False
+
+
+def test_batch_detect():
+    """Test batched detection over an (N, H, W) stack"""
+    print("\nTesting batched Canny detection...")
+    try:
+        import numpy as np
+        from CannyEdgeDetection import CannyEdgeDetector
+        
+        stack = np.random.default_rng(2).random((4, 60, 80))
+        detector = CannyEdgeDetector(list(stack), sigma=1.4, kernel_size=5)
+        
+        # Repeated detect() calls must not accumulate results
+        detector.detect()
+        per_image = detector.detect()
+        assert len(per_image) == 4
+        
+        batch = detector.detect_batch(stack)
+        assert batch.shape == stack.shape
+        assert batch.dtype == np.uint8
+        for single, batched in zip(per_image, batch):
+            assert np.array_equal(single.astype(np.uint8), batched)
+        
+        print("✓ Batched Canny detection test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Batched Canny detection error: {e}")
+        return False
+
+
+def test_parallel_executor():
+    """Test process-pool Canny execution matches in-process detection"""
+    print("\nTesting parallel Canny executor...")
+    try:
+        import numpy as np
+        from CannyEdgeDetection import CannyEdgeDetector
+        from ParallelCanny import ParallelCannyExecutor
+        
+        stack = np.random.default_rng(3).random((3, 40, 50))
+        expected = CannyEdgeDetector([], sigma=1.4).detect_batch(stack)
+        
+        with ParallelCannyExecutor(workers=2, sigma=1.4) as executor:
+            # Every worker process was started and warmed up before the first frame
+            assert len(set(executor.pids)) == 2
+            results = executor.detect(list(stack))
+            single = executor.submit(stack[0]).result()
+        
+        assert len(results) == 3
+        assert all(np.array_equal(r, e) for r, e in zip(results, expected))
+        assert single.shape == (40, 50) and np.array_equal(single, expected[0])
+        
+        print("✓ Parallel Canny executor test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Parallel Canny executor error: {e}")
+        return False
+
+
+def test_tiled_detect():
+    """Test tiled detection matches the full-frame result across seams"""
+    print("\nTesting tiled Canny detection...")
+    try:
+        import numpy as np
+        from CannyEdgeDetection import CannyEdgeDetector
+        from TiledCanny import TiledCannyDetector
+        
+        test_img = np.random.default_rng(4).random((97, 131))
+        for mode in ["connected", "single_pass"]:
+            detector = CannyEdgeDetector([test_img], sigma=1.4, hysteresis_mode=mode)
+            expected = detector.detect()[0].astype(np.uint8)
+            
+            for tile_size, workers in [(37, 1), (50, 2)]:
+                result = TiledCannyDetector(detector, tile_size=tile_size, workers=workers).detect(test_img)
+                assert np.array_equal(result, expected)
+        
+        # Tile size shrinks as the memory budget does
+        small = TiledCannyDetector(detector, memory_budget_mb=8).tile_size
+        large = TiledCannyDetector(detector, memory_budget_mb=256).tile_size
+        assert small < large
+        
+        # Selected through the reference backend's detection_mode; frames within one tile are not split
+        import tempfile
+        from EdgeBackends import backend_from_config
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = temp_config(tmp_dir, {"image_processing.canny_edge_detection.detection_mode": "tiled",
+                                           "image_processing.tiling.tile_size": 40})
+            backend = backend_from_config(config)
+        assert backend.tiled.tile_size == 40
+        assert np.array_equal(backend.detect(test_img), backend.detector.detect_batch(test_img[np.newaxis])[0])
+        assert backend.tiled.fits((40, 40)) and not backend.tiled.fits(test_img.shape)
+        
+        print("✓ Tiled Canny detection test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Tiled Canny detection error: {e}")
+        return False
+
+
+def test_workspace_detect():
+    """Test preallocated workspace detection"""
+    print("\nTesting workspace Canny detection...")
+    try:
+        import numpy as np
+        from CannyEdgeDetection import CannyEdgeDetector
+        
+        rng = np.random.default_rng(5)
+        test_img = np.zeros((80, 100))
+        test_img[20:60, 30:70] = 1.0
+        test_img += rng.random(test_img.shape) * 0.05
+        
+        detector = CannyEdgeDetector([test_img], sigma=1.4)
+        expected = detector.detect()[0].astype(np.uint8)
+        
+        result = detector.detect_workspace(test_img)
+        assert result.dtype == np.uint8
+        assert result.shape == test_img.shape
+        # float32 buffers may flip a few near-tie pixels relative to the float64 path
+        assert np.mean(result != expected) < 0.01
+        
+        # Buffers are reused for frames of the same shape
+        workspace = detector._workspace
+        assert detector.detect_workspace(test_img) is result
+        assert detector._workspace is workspace
+        
+        # Selected through the reference backend's detection_mode; results must outlive the next frame
+        import tempfile
+        import threading
+        from EdgeBackends import backend_from_config, create_backend
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = temp_config(tmp_dir, {"image_processing.canny_edge_detection.detection_mode": "workspace"})
+            backend = backend_from_config(config)
+        assert backend.mode == "workspace"
+        batch = backend.detector.detect_batch(test_img[np.newaxis])[0]
+        first = backend.detect(test_img)
+        second = backend.detect(np.flipud(test_img))
+        assert first is not second
+        assert np.mean(first != batch) < 0.01
+        
+        # Each thread gets its own buffers
+        detectors = []
+        thread = threading.Thread(target=lambda: (backend.detect(test_img), detectors.append(backend._thread_detector())))
+        thread.start()
+        thread.join()
+        assert detectors and detectors[0] is not backend._thread_detector()
+        
+        try:
+            create_backend("reference", {}, mode="unknown")
+            assert False, "Unknown detection mode accepted"
+        except ValueError:
+            pass
+        
+        print("✓ Workspace Canny detection test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Workspace Canny detection error: {e}")
+        return False
+
+
+def test_edge_backends():
+    """Test pluggable edge-detection backends and the parity report"""
+    print("\nTesting edge detection backends...")
+    try:
+        import numpy as np
+        from utils import config_mgr
+        from CannyEdgeDetection import CannyEdgeDetector
+        from EdgeBackends import BACKENDS, EdgeDetectionBackend, create_backend, backend_from_config, parity_report
+        
+        settings = CannyEdgeDetector.settings_from_config(config_mgr)
+        test_img = np.zeros((60, 80))
+        test_img[15:45, 20:60] = 1.0
+        
+        for name in BACKENDS:
+            edges = create_backend(name, settings).detect(test_img)
+            assert edges.shape == test_img.shape
+            assert edges.dtype == np.uint8
+            assert np.sum(edges == 255) > 0
+        
+        assert backend_from_config(config_mgr).name == config_mgr.get("image_processing.canny_edge_detection.backend")
+        
+        # A backend without detect() fails when it is created
+        class Incomplete(EdgeDetectionBackend):
+            name = "incomplete"
+        try:
+            Incomplete(settings)
+            assert False, "Backend without detect() accepted"
+        except TypeError:
+            pass
+        
+        rows = parity_report(["images/A.png"], config_mgr, repeats=1)
+        assert len(rows) == len(BACKENDS)
+        reference = [r for r in rows if r["backend"] == "reference"][0]
+        assert reference["difference"] == 0 and reference["within_tolerance"]
+        
+        print("✓ Edge detection backends test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Edge detection backends error: {e}")
+        return False
+
+
+def test_streaming_pipeline():
+    """Test streaming frames through the bounded-queue pipeline"""
+    print("\nTesting streaming pipeline...")
+    try:
+        import tempfile
+        import numpy as np
+        from StreamingPipeline import StreamingPipeline
+        
+        rng = np.random.default_rng(6)
+        frames = [rng.integers(0, 256, (48, 64, 3), dtype=np.uint8) for _ in range(5)]
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            pipeline = StreamingPipeline(temp_config(tmp_dir), lane=2, queue_size=2)
+            results = list(pipeline.run(frames))
+            assert [r["frame"] for r in results] == list(range(5))
+            assert all(r["lane"] == 2 and r["green_time"] in [30, 40, 50, 60] for r in results)
+            
+            report = pipeline.stats.report()
+            assert report["frames"] == 5
+            assert set(report["stages"]) == set(StreamingPipeline.STAGES)
+            
+            # Stopping early must not hang the upstream stages
+            for result in pipeline.run(iter(frames * 4)):
+                break
+            assert pipeline.stats.frames == 1
+            pipeline.traffic_manager.close()
+            
+            # Without a lane, every lane_roi lane is counted from one detection pass per frame
+            overhead = StreamingPipeline(temp_config(tmp_dir), lane=None, queue_size=2)
+            results = list(overhead.run(frames))
+            assert [r["frame"] for r in results] == list(range(5))
+            edges = overhead.backend.detect(overhead.to_gray(frames[0]))
+            assert results[0]["lanes"] == overhead.counter.classify(overhead.counter.lane_mask.count(edges))
+            assert sum(lane["white_pixels"] for lane in results[0]["lanes"].values()) == int(np.sum(edges == 255))
+            overhead.traffic_manager.close()
+        
+        print("✓ Streaming pipeline test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Streaming pipeline error: {e}")
+        return False
+
+
+def test_incremental_detect():
+    """Test incremental recomputation of changed tiles"""
+    print("\nTesting incremental Canny detection...")
+    try:
+        import numpy as np
+        from CannyEdgeDetection import CannyEdgeDetector
+        from TiledCanny import IncrementalCannyDetector
+        
+        rng = np.random.default_rng(7)
+        frame = np.zeros((128, 192), dtype=np.float32)
+        frame[20:100, 30:90] = 0.8
+        frame += rng.random(frame.shape, dtype=np.float32) * 0.002
+        
+        detector = CannyEdgeDetector([], sigma=1.4)
+        incremental = IncrementalCannyDetector(detector, tile_size=32)
+        
+        # First frame is a full recompute, identical to detect_batch
+        edges = incremental.detect(frame).copy()
+        assert incremental.last_full
+        assert np.array_equal(edges, detector.detect_batch(frame[np.newaxis])[0])
+        
+        # An unchanged frame touches no tiles
+        assert np.array_equal(incremental.detect(frame), edges)
+        assert not incremental.last_full and incremental.last_dirty_tiles == 0
+        
+        # A new object dirties only the tiles it covers; the count follows the patched map
+        moved = frame.copy()
+        moved[70:90, 130:150] = 0.8
+        patched = incremental.detect(moved)
+        assert not incremental.last_full and 0 < incremental.last_dirty_tiles <= 4
+        assert incremental.white_pixels == np.count_nonzero(patched == 255)
+        assert incremental.white_pixels > np.count_nonzero(edges == 255)
+        
+        # A change ending on a tile border alters the clean tile next to it up to the halo
+        bordered = frame.copy()
+        bordered[40:60, 100:128] = 0.8
+        border = IncrementalCannyDetector(detector, tile_size=32)
+        border.detect(frame)
+        result = border.detect(bordered)
+        assert not border.last_full
+        assert np.array_equal(result, detector.detect_batch(bordered[np.newaxis])[0])
+        assert border.white_pixels == np.count_nonzero(result == 255)
+        
+        # Selected through the reference backend's detection_mode; returned maps are snapshots
+        import tempfile
+        from EdgeBackends import backend_from_config
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config = temp_config(tmp_dir, {"image_processing.canny_edge_detection.detection_mode": "incremental",
+                                           "image_processing.incremental.tile_size": 32})
+            backend = backend_from_config(config)
+        first = backend.detect(frame)
+        assert np.array_equal(first, edges)
+        second = backend.detect(moved)
+        stream = backend._stream_detector(None)
+        assert stream.tile_size == 32 and not stream.last_full
+        assert np.array_equal(second, patched) and np.array_equal(first, edges)
+        
+        # Interleaved cameras are each diffed against their own previous frame
+        backend.detect_stream(frame, ("north", 1))
+        backend.detect_stream(moved, ("north", 2))
+        backend.detect_stream(frame, ("north", 1))
+        assert backend._stream_detector(("north", 1)).last_dirty_tiles == 0
+        assert backend.detect_result(moved, stream=("north", 2)).white_pixels == np.count_nonzero(patched == 255)
+        
+        print("✓ Incremental Canny detection test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Incremental Canny detection error: {e}")
+        return False
+
+
+def test_in_memory_result():
+    """Test detection results flow to classification without disk round trips"""
+    print("\nTesting in-memory detection results...")
+    try:
+        import tempfile
+        import cv2
+        import numpy as np
+        from utils import config_mgr, TrafficDataManager, AsyncImageWriter
+        from EdgeBackends import backend_from_config
+        
+        test_img = np.zeros((60, 80))
+        test_img[15:45, 20:60] = 1.0
+        
+        result = backend_from_config(config_mgr).detect_result(test_img, lane=3)
+        assert result.white_pixels == np.sum(result.edges == 255)
+        assert result.white_pixels > 0 and result.lane == 3
+        
+        level, green_time = TrafficDataManager(config_mgr).classify_result(result)
+        assert isinstance(level, str) and green_time in [30, 40, 50, 60]
+        
+        # Saving is an optional background side output
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            writer = AsyncImageWriter()
+            output_file = os.path.join(tmp_dir, "edges", "test.png")
+            assert writer.submit(output_file, result.edges)
+            writer.close()
+            saved = cv2.imread(output_file, cv2.IMREAD_GRAYSCALE)
+            assert np.array_equal(saved, result.edges)
+        
+        print("✓ In-memory detection result test successful")
+        return True
+    except Exception as e:
+        print(f"✗ In-memory detection result error: {e}")
+        return False
+
+
+def test_reference_stats_cache():
+    """Test memoized reference-image statistics"""
+    print("\nTesting reference statistics cache...")
+    try:
+        import shutil
+        import tempfile
+        import cv2
+        import numpy as np
+        from utils import ConfigManager, ReferenceStatsCache
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            lane_ref = os.path.join(tmp_dir, "lane2.png")
+            shutil.copy("gray/refrence.png", lane_ref)
+            config_file = os.path.join(tmp_dir, "config.json")
+            with open(config_file, 'w') as f:
+                json.dump({"files": {"reference_image": "gray/refrence.png",
+                                     "reference_images": {"2": lane_ref}}}, f)
+            cache_file = os.path.join(tmp_dir, "reference_stats.json")
+            
+            cache = ReferenceStatsCache(ConfigManager(config_file), cache_file)
+            expected = int(np.sum(cv2.imread("gray/refrence.png", cv2.IMREAD_GRAYSCALE) == 255))
+            assert cache.get_white_pixels() == expected
+            assert cache.get_white_pixels(lane=2) == expected
+            assert cache.reference_path(lane=2) == lane_ref
+            
+            # A fresh instance answers from the persisted cache
+            restarted = ReferenceStatsCache(ConfigManager(config_file), cache_file)
+            assert os.path.abspath(lane_ref) in restarted._entries
+            
+            # Changing the file invalidates its entry
+            cv2.imwrite(lane_ref, np.full((10, 10), 255, dtype=np.uint8))
+            os.utime(lane_ref, ns=(0, 1))
+            assert restarted.get_white_pixels(lane=2) == 100
+        
+        print("✓ Reference statistics cache test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Reference statistics cache error: {e}")
+        return False
+
+
+def test_multi_lane():
+    """Test single-pass multi-lane counting with lane ROI masks"""
+    print("\nTesting multi-lane counting...")
+    try:
+        import tempfile
+        import numpy as np
+        from EdgeBackends import DetectionResult
+        from MultiLane import LaneMask, MultiLaneCounter
+        from utils import config_mgr
+        
+        edges = np.zeros((40, 60), dtype=np.uint8)
+        edges[0:20, 0:30:2] = 255     # lane 1: top-left quadrant
+        edges[5, 30:60] = 255         # lane 2: top-right
+        edges[20:40:4, 31:60] = 255   # lane 3: bottom-right (clear of the shared border)
+        
+        mask = LaneMask.from_config(config_mgr)
+        counts = mask.count(edges)
+        assert counts == {1: 300, 2: 30, 3: 145, 4: 0}, counts
+        assert mask.mask(edges.shape) is mask.mask(edges.shape)
+        
+        # Pixel coordinates are inclusive vertex positions
+        pixel_mask = LaneMask({1: [[0, 0], [29, 0], [29, 19], [0, 19]]}, normalized=False)
+        assert pixel_mask.count(edges) == {1: 300}
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            counter = MultiLaneCounter(temp_config(tmp_dir), lane_mask=mask)
+            results = counter.process_result(DetectionResult(edges), update=True)
+            assert sorted(results) == [1, 2, 3, 4]
+            assert results[1]["white_pixels"] == 300
+            assert counter.traffic_manager.get_lane_data() == [300, 30, 145, 0]
+            
+            expected = counter.traffic_manager.get_traffic_level(1, 300, 0)
+            assert (results[1]["traffic_level"], results[1]["green_time"]) == expected
+            counter.traffic_manager.close()
+        
+        print("✓ Multi-lane counting test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Multi-lane counting error: {e}")
+        return False
+
+
+def test_batch_cli():
+    """Test headless batch processing with resume"""
+    print("\nTesting headless batch processing...")
+    try:
+        import csv
+        import shutil
+        import tempfile
+        from BatchProcess import BatchProcessor, ResultWriter, lane_for_path
+        
+        assert lane_for_path("lane3/Lane_2_0800.png") == 2
+        assert lane_for_path("archive/cam.png") is None
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = os.path.join(tmp_dir, "captures")
+            os.makedirs(os.path.join(root, "lane1"))
+            os.makedirs(os.path.join(root, "lane2"))
+            shutil.copy("images/A.png", os.path.join(root, "lane1", "A.png"))
+            shutil.copy("images/B.png", os.path.join(root, "lane2", "B.png"))
+            output_file = os.path.join(tmp_dir, "results.csv")
+            
+            # A partly written capture fails to decode
+            broken_file = os.path.join(root, "lane1", "D.png")
+            with open("images/D.png", 'rb') as src, open(broken_file, 'wb') as dst:
+                dst.write(src.read(2000))
+            
+            processor = BatchProcessor(temp_config(tmp_dir).config_path, workers=1)
+            summary = processor.run(root, ResultWriter(output_file))
+            assert summary["ok"] == 2 and summary["error"] == 1 and summary["skipped"] == 0
+            with open(output_file, newline='') as f:
+                rows = [row for row in csv.DictReader(f) if row["status"] == "ok"]
+            assert sorted(row["lane"] for row in rows) == ["1", "2"]
+            assert all(int(row["white_pixels"]) > 0 and row["traffic_level"] for row in rows)
+            assert all(float(row["total_ms"]) >= float(row["decode_ms"]) + float(row["detect_ms"]) for row in rows)
+            
+            # An interrupted run leaves a partial row; resuming drops it, only redoes missing files
+            # and retries the one that failed
+            with open(output_file, 'a') as f:
+                f.write(os.path.join(root, "lane3", "C.png") + ",3,o")
+            shutil.copy("images/C.png", os.path.join(root, "lane2", "C.png"))
+            shutil.copy("images/D.png", broken_file)
+            summary = processor.run(root, ResultWriter(output_file))
+            assert summary["ok"] == 2 and summary["error"] == 0 and summary["skipped"] == 2
+            expected = [os.path.join(root, lane, f"{name}.png") for lane, name in
+                        [("lane1", "A"), ("lane1", "D"), ("lane2", "B"), ("lane2", "C")]]
+            assert ResultWriter(output_file).completed() == set(expected)
+            
+            # The same root spelled relative to the working directory resumes instead of starting over
+            summary = processor.run(os.path.relpath(root), ResultWriter(output_file))
+            assert summary["skipped"] == 4 and summary["ok"] == 0
+            
+            # An image without a lane in its path is not done: a re-run with a default lane picks it up
+            os.makedirs(os.path.join(root, "misc"))
+            shutil.copy("images/A.png", os.path.join(root, "misc", "E.png"))
+            summary = processor.run(root, ResultWriter(output_file))
+            assert summary["no_lane"] == 1 and summary["skipped"] == 4
+            with_lane = BatchProcessor(processor.config_file, workers=1, default_lane=3)
+            summary = with_lane.run(root, ResultWriter(output_file))
+            assert summary["ok"] == 1 and summary["skipped"] == 4
+        
+        print("✓ Headless batch processing test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Headless batch processing error: {e}")
+        return False
+
+
+def test_sqlite_lane_store():
+    """Test the SQLite lane store and its import from Previous_data.txt"""
+    print("\nTesting SQLite lane store...")
+    try:
+        import tempfile
+        from concurrent.futures import ThreadPoolExecutor
+        from utils import SQLiteLaneStore, TrafficDataManager
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            text_file = os.path.join(tmp_dir, "Previous_data.txt")
+            with open(text_file, 'w') as f:
+                f.write("10068\n10178\n7\nbad\n")
+            config = temp_config(tmp_dir, {"files.traffic_store": "sqlite", "files.traffic_cache.enabled": False,
+                                           "traffic_density.history.enabled": False})
+            
+            tdm = TrafficDataManager(config)
+            assert isinstance(tdm.store, SQLiteLaneStore)
+            assert tdm.get_lane_data() == [10068, 10178, 7, 0]
+            
+            # Concurrent single-lane updates from separate connections never overwrite each other
+            managers = [TrafficDataManager(config) for _ in range(4)]
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                assert all(pool.map(lambda i: managers[i].update_lane_data(i + 1, 100 + i), range(4)))
+            assert tdm.get_lane_data() == [100, 101, 102, 103]
+            
+            # The import only happens once
+            with open(text_file, 'w') as f:
+                f.write("1\n1\n1\n1\n")
+            assert TrafficDataManager(config).get_lane_data() == [100, 101, 102, 103]
+            
+            assert tdm.reset_lane_data()
+            assert tdm.get_lane_data() == [0, 0, 0, 0]
+        
+        print("✓ SQLite lane store test successful")
+        return True
+    except Exception as e:
+        print(f"✗ SQLite lane store error: {e}")
+        return False
+
+
+def test_lane_cache():
+    """Test the in-memory lane cache with write-behind flushing"""
+    print("\nTesting lane cache...")
+    try:
+        import gc
+        import tempfile
+        import weakref
+        from utils import CachedLaneStore, TrafficDataManager
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_file = os.path.join(tmp_dir, "Previous_data.txt")
+            cached = {"files.traffic_cache.enabled": True, "files.traffic_cache.flush_interval_seconds": 3600,
+                      "traffic_density.history.enabled": False}
+            tdm = TrafficDataManager(temp_config(tmp_dir, {"files.traffic_store": "text", **cached}))
+            assert isinstance(tdm.store, CachedLaneStore)
+            
+            # Updates are visible at once but only reach the disk on flush
+            assert tdm.update_lane_data(2, 500)
+            assert tdm.get_lane_data() == [0, 500, 0, 0]
+            with open(data_file) as f:
+                assert f.read().split() == ["0", "0", "0", "0"]
+            assert tdm.flush()
+            with open(data_file) as f:
+                assert f.read().split() == ["0", "500", "0", "0"]
+            
+            # An outside change to the file is picked up, pending updates stay on top
+            tdm.update_lane_data(4, 9)
+            with open(data_file, 'w') as f:
+                f.write("7\n8\n9\n10\n")
+            os.utime(data_file, ns=(0, 1))
+            assert tdm.get_lane_data() == [7, 8, 9, 9]
+            
+            tdm.close()
+            with open(data_file) as f:
+                assert f.read().split() == ["7", "8", "9", "9"]
+            
+            # A dropped manager is collected and its pending updates are still written
+            tdm = TrafficDataManager(tdm.config)
+            tdm.update_lane_data(1, 42)
+            dropped = weakref.ref(tdm)
+            del tdm
+            gc.collect()
+            assert dropped() is None
+            with open(data_file) as f:
+                assert f.read().split() == ["42", "8", "9", "9"]
+            
+            # Another process writing between our update and its flush is not mistaken for our write
+            config = temp_config(tmp_dir, {"files.traffic_store": "sqlite", **cached})
+            tdm, other = TrafficDataManager(config), TrafficDataManager(config)
+            tdm.update_lane_data(1, 5)
+            other.update_lane_data(3, 77)
+            assert other.flush() and tdm.flush()
+            assert tdm.get_lane_data() == [5, 8, 77, 9]
+            tdm.close()
+            other.close()
+        
+        print("✓ Lane cache test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Lane cache error: {e}")
+        return False
+
+
+def _append_history(args):
+    """Worker for test_lane_history: append 500 samples to lane 1 of a shared history"""
+    import numpy as np
+    from LaneHistory import LaneHistory
+    directory, seed = args
+    history = LaneHistory(directory, capacity=4000, bin_width=4)
+    for pixels in np.random.default_rng(seed).integers(0, 4000, 500):
+        history.append(1, pixels)
+    history.flush()
+
+
+def test_lane_history():
+    """Test rolling lane history and history-derived thresholds"""
+    print("\nTesting lane history...")
+    try:
+        import tempfile
+        from concurrent.futures import ProcessPoolExecutor
+        import numpy as np
+        from LaneHistory import LaneHistory
+        from utils import TrafficDataManager
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            history_dir = os.path.join(tmp_dir, "history")
+            history = LaneHistory(history_dir, capacity=100, bin_width=4)
+            samples = np.random.default_rng(1).integers(0, 4000, 250)
+            for t, pixels in enumerate(samples):
+                history.append(2, pixels, timestamp=t)
+            
+            # Only the newest 100 samples are kept, oldest first
+            timestamps, counts = history.window(2)
+            assert np.array_equal(counts, samples[-100:])
+            assert timestamps[0] == 150 and timestamps[-1] == 249
+            assert history.size(1) == 0 and history.percentile(1, 50) is None
+            
+            expected = np.percentile(samples[-100:], [10, 50, 90])
+            spacing = np.diff(np.sort(samples[-100:])).max()
+            assert np.all(np.abs(np.array(history.percentiles(2, [10, 50, 90])) - expected) <= spacing + 4)
+            
+            ewma = float(samples[0])
+            for pixels in samples[1:]:
+                ewma += 0.1 * (pixels - ewma)
+            assert abs(history.ewma(2) - ewma) < 1e-6
+            
+            # History survives a restart
+            history.flush()
+            reopened = LaneHistory(history_dir, capacity=100, bin_width=4)
+            assert reopened.percentiles(2, [10, 50, 90]) == history.percentiles(2, [10, 50, 90])
+            
+            # Processes appending at the same time lose no samples, and a process that was already
+            # open sees their samples in its percentiles
+            shared_dir = os.path.join(tmp_dir, "shared")
+            shared = LaneHistory(shared_dir, capacity=4000, bin_width=4)
+            with ProcessPoolExecutor(max_workers=4) as pool:
+                list(pool.map(_append_history, [(shared_dir, seed) for seed in range(4)]))
+            _, counts = shared.window(1)
+            assert shared.size(1) == len(counts) == 2000
+            expected = np.concatenate([np.random.default_rng(seed).integers(0, 4000, 500) for seed in range(4)])
+            assert np.array_equal(np.sort(counts), np.sort(expected))
+            assert shared.percentile(1, 100) >= counts.max() - 4 and shared.histograms[0].sum() == 2000
+            
+            # With enough samples a lane is classified against its own distribution
+            del history, reopened, shared
+            tdm = TrafficDataManager(temp_config(tmp_dir, {"traffic_density.history.capacity": 100,
+                                                           "traffic_density.history.bin_width": 4,
+                                                           "traffic_density.history.min_samples": 30}))
+            for pixels in range(1000, 2000, 10):
+                tdm.update_lane_data(3, pixels)
+            assert tdm.get_traffic_level(3, 1990, 0)[1] == 60
+            assert tdm.get_traffic_level(3, 1500, 0)[1] == 40
+            assert tdm.get_traffic_level(3, 1000, 0)[1] == 30
+            tdm.close()
+        
+        print("✓ Lane history test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Lane history error: {e}")
+        return False
+
+
+def test_vectorized_levels():
+    """Test vectorized N-level traffic classification"""
+    print("\nTesting vectorized traffic levels...")
+    try:
+        import tempfile
+        import numpy as np
+        from TrafficLevels import LevelTable
+        from utils import config_mgr, TrafficDataManager
+        
+        table = LevelTable.from_config(config_mgr)
+        assert table.names == ["low", "medium", "high", "very_high"]
+        
+        # Same answers as the scalar path, for every sample in one call
+        data = [10068, 10178, 12000, 9000]
+        samples = np.random.default_rng(2).integers(8000, 13000, 1000)
+        indices, green_times = table.classify(samples, data)
+        for sample, index, green_time in zip(samples[:50], indices[:50], green_times[:50]):
+            assert table.classify_one(sample, data) == (table.labels[index], green_time)
+        assert table.classify_one(9000, data)[1] == 30
+        assert table.classify_one(10068, data)[1] == 40
+        assert table.classify_one(13000, data)[1] == 60
+        
+        # Per-lane references of different lengths
+        lanes = np.array([1, 2, 2, 3])
+        indices, green_times = table.classify([50, 50, 5, 1000], [[10, 20, 30, 40], [60], [1, 2, 3]], lanes)
+        assert list(indices) == [3, 0, 0, 2]
+        
+        # Any number of levels
+        six = LevelTable({f"l{i}": {"threshold": i, "green_time_seconds": 10 * i, "label": f"L{i}"}
+                          for i in range(1, 7)})
+        _, green_times = six.classify(np.arange(8), [1, 2, 3, 4, 5, 6])
+        assert list(green_times) == [10, 10, 20, 30, 40, 50, 60, 60]
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            tdm = TrafficDataManager(temp_config(tmp_dir))
+            indices, green_times = tdm.classify_many(samples)
+            assert len(green_times) == len(samples)
+            assert set(tdm.levels.labels_for(indices)) <= set(table.labels)
+            tdm.close()
+        
+        print("✓ Vectorized traffic level test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Vectorized traffic level error: {e}")
+        return False
+
+
+def test_async_logging():
+    """Test queue-based logging with per-module levels"""
+    print("\nTesting asynchronous logging...")
+    try:
+        import logging
+        import tempfile
+        from utils import ConfigManager, DeferredQueueHandler, LoggerSetup
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            config_file = os.path.join(tmp_dir, "config.json")
+            with open(config_file, 'w') as f:
+                json.dump({"directories": {"logs": os.path.join(tmp_dir, "logs")},
+                           "logging": {"format": "%(name)s %(message)s", "modules": {"frames": "WARNING"}}}, f)
+            name = "AsyncLoggingTest"
+            test_logger = LoggerSetup.setup_logger(name, ConfigManager(config_file))
+            assert [type(h) for h in test_logger.handlers] == [DeferredQueueHandler]
+            
+            # Formatting of scalar arguments waits for the listener: the queued record still holds the template
+            class Message(str):
+                formatted = 0
+                def __str__(self):
+                    Message.formatted += 1
+                    return "decision"
+            
+            frames = LoggerSetup.get_logger("frames", name)
+            frames.info("frame %s", Message())
+            assert Message.formatted == 0
+            control = LoggerSetup.get_logger("control", name)
+            control.info("lane 1 %s", Message())
+            frames.warning("dropped frame")
+            
+            # Mutable arguments are captured when logged, not when the listener gets to them
+            lanes = {1: 100}
+            control.warning("lanes %s", lanes)
+            lanes[1] = 200
+            
+            LoggerSetup.stop_listener(name)
+            assert Message.formatted == 2  # console and file each format the emitted record once
+            for handler in logging.getLogger(name).handlers[:]:
+                logging.getLogger(name).removeHandler(handler)
+            
+            log_dir = os.path.join(tmp_dir, "logs")
+            with open(os.path.join(log_dir, os.listdir(log_dir)[0])) as f:
+                lines = f.read().splitlines()
+            assert lines == [f"{name}.control lane 1 decision", f"{name}.frames dropped frame",
+                             f"{name}.control lanes {{1: 100}}"], lines
+        
+        print("✓ Asynchronous logging test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Asynchronous logging error: {e}")
+        return False
+
+
+def test_config_reload():
+    """Test the compiled config snapshot and hot reload"""
+    print("\nTesting configuration reload...")
+    try:
+        import copy
+        import tempfile
+        from utils import ConfigManager, TrafficDataManager, config_mgr
+        
+        assert config_mgr.get("image_processing.canny_edge_detection.sigma") == \
+            config_mgr.config["image_processing"]["canny_edge_detection"]["sigma"]
+        assert config_mgr.get("traffic_density.time_allocation.low.label") == "Low Traffic Density"
+        assert config_mgr.get("missing.key", "default") == "default"
+        assert config_mgr.get("traffic_density.lanes.extra", 7) == 7
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            settings = {"traffic_density": {"lanes": 4,
+                                            "time_allocation": copy.deepcopy(config_mgr.get("traffic_density.time_allocation"))},
+                        "files": {"traffic_store": "sqlite", "traffic_data": os.path.join(tmp_dir, "none.txt"),
+                                  "traffic_db": os.path.join(tmp_dir, "traffic.db")}}
+            config_file = os.path.join(tmp_dir, "config.json")
+            
+            def write(data, mtime_ns):
+                with open(config_file, 'w') as f:
+                    json.dump(data, f)
+                os.utime(config_file, ns=(mtime_ns, mtime_ns))
+            
+            write(settings, 1)
+            config = ConfigManager(config_file)
+            tdm = TrafficDataManager(config)
+            assert not config.reload_if_changed()
+            assert tdm.get_traffic_level(1, 10 ** 6, 0)[1] == 60
+            
+            # A retuned green time reaches the running manager
+            settings["traffic_density"]["time_allocation"]["very_high"]["green_time_seconds"] = 75
+            write(settings, 2)
+            assert config.reload_if_changed()
+            assert config.get("traffic_density.time_allocation.very_high.green_time_seconds") == 75
+            assert tdm.get_traffic_level(1, 10 ** 6, 0)[1] == 75
+            
+            # Invalid values are rejected and the previous snapshot stays in use
+            settings["traffic_density"]["lanes"] = "four"
+            write(settings, 3)
+            assert not config.reload_if_changed()
+            assert config.get("traffic_density.lanes") == 4
+        
+        print("✓ Configuration reload test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Configuration reload error: {e}")
+        return False
+
+
+def test_benchmark():
+    """Test the benchmark suite and the regression comparison"""
+    print("\nTesting benchmark suite...")
+    try:
+        from utils import config_mgr
+        import numpy as np
+        from Benchmark import BenchmarkSuite, STAGES, END_TO_END, compare, synthetic_frame
+        
+        frame = synthetic_frame(240, 426)
+        assert frame.shape == (240, 426, 3) and frame.dtype == np.uint8
+        
+        images_dir = config_mgr.get_directory("images")
+        report = BenchmarkSuite(config_mgr, repeats=1).run([os.path.join(images_dir, "A.png")], ["240p"])
+        for case in ("A.png", "240p"):
+            for stage in STAGES:
+                assert report["results"][f"stages/{case}/{stage}"]["median_ms"] > 0
+            for stage in END_TO_END:
+                assert f"end_to_end/{case}/{stage}" in report["results"]
+        
+        # Only timings above the noise floor that slowed down beyond the threshold are reported
+        baseline = {"results": {"stages/x/sobel_filters": {"median_ms": 10.0, "min_ms": 10.0},
+                                "stages/x/threshold": {"median_ms": 0.1, "min_ms": 0.1},
+                                "stages/x/hysteresis": {"median_ms": 10.0, "min_ms": 10.0}}}
+        current = {"results": {"stages/x/sobel_filters": {"median_ms": 13.0, "min_ms": 13.0},
+                               "stages/x/threshold": {"median_ms": 0.3, "min_ms": 0.3},
+                               "stages/x/hysteresis": {"median_ms": 11.0, "min_ms": 11.0},
+                               "stages/x/detect": {"median_ms": 50.0, "min_ms": 50.0}}}
+        regressions = compare(current, baseline, threshold_percent=20, noise_floor_ms=0.5)
+        assert [row["benchmark"] for row in regressions] == ["stages/x/sobel_filters"]
+        assert abs(regressions[0]["change_percent"] - 30) < 1e-6
+        assert compare(report, report) == []
+        
+        print("✓ Benchmark suite test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Benchmark suite error: {e}")
+        return False
+
+
+def test_metrics():
+    """Test hot-path instrumentation and metrics export"""
+    print("\nTesting metrics instrumentation...")
+    try:
+        import numpy as np
+        import tempfile
+        import Metrics
+        from CannyEdgeDetection import CannyEdgeDetector
+        from utils import config_mgr
+        
+        # Disabled metrics leave the hot paths untouched
+        original_smooth = CannyEdgeDetector.__dict__["smooth"]
+        original_detect = CannyEdgeDetector.__dict__["detect_batch"]
+        
+        registry = Metrics.registry
+        registry.reset()
+        Metrics.instrument()
+        try:
+            assert CannyEdgeDetector.smooth is not original_smooth
+            detector = CannyEdgeDetector([], **CannyEdgeDetector.settings_from_config(config_mgr))
+            img = np.zeros((2, 64, 64))
+            img[:, 20:40, 20:40] = 1.0
+            detector.detect_batch(img)
+            
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                image_file = os.path.join(tmp_dir, "frame.png")
+                import cv2
+                cv2.imwrite(image_file, (img[0] * 255).astype(np.uint8))
+                from EdgeBackends import load_grayscale
+                load_grayscale(image_file, config_mgr)
+                
+                snapshot = registry.snapshot()
+                assert snapshot["counters"]["frames_processed_total"] == 2
+                assert snapshot["counters"]["frames_decoded_total"] == 1
+                assert snapshot["counters"]["bytes_decoded_total"] == os.path.getsize(image_file)
+                assert snapshot["gauges"]["canny_input_peak_bytes"] == img.nbytes
+                assert snapshot["histograms"]['canny_detect_seconds{method="detect_batch"}']["count"] == 1
+                for stage in ("gaussian", "sobel_filters", "non_max_suppression", "threshold", "hysteresis"):
+                    assert snapshot["histograms"][f'canny_stage_seconds{{stage="{stage}"}}']["count"] == 1
+                
+                prometheus_file = os.path.join(tmp_dir, "metrics.prom")
+                json_file = os.path.join(tmp_dir, "metrics.json")
+                registry.export(prometheus_file, json_file)
+                with open(prometheus_file) as f:
+                    text = f.read()
+                assert "# TYPE canny_stage_seconds histogram" in text
+                assert 'canny_stage_seconds_bucket{stage="hysteresis",le="+Inf"} 1' in text
+                assert "frames_processed_total 2" in text
+                with open(json_file) as f:
+                    assert json.load(f)["counters"]["frames_decoded_total"] == 1
+        finally:
+            Metrics.uninstrument()
+            registry.reset()
+        
+        assert CannyEdgeDetector.__dict__["smooth"] is original_smooth
+        assert CannyEdgeDetector.__dict__["detect_batch"] is original_detect
+        
+        # Worker processes record their own decode/detect metrics and the parent merges them
+        import shutil
+        from BatchProcess import BatchProcessor, ResultWriter
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            root = os.path.join(tmp_dir, "captures", "lane1")
+            os.makedirs(root)
+            for name in "AB":
+                shutil.copy(f"images/{name}.png", os.path.join(root, f"{name}.png"))
+            processor = BatchProcessor(temp_config(tmp_dir, {"metrics.enabled": True}).config_path, workers=2)
+            try:
+                processor.run(os.path.dirname(root), ResultWriter(os.path.join(tmp_dir, "results.csv")))
+                snapshot = registry.snapshot()
+                assert snapshot["counters"]["frames_decoded_total"] == 2
+                assert snapshot["counters"]["frames_processed_total"] == 2
+                assert snapshot["histograms"]['canny_stage_seconds{stage="hysteresis"}']["count"] == 2
+            finally:
+                registry.reset()
+        assert CannyEdgeDetector.__dict__["smooth"] is original_smooth
+        
+        # drain() hands over and clears; merge() adds counts and keeps the highest gauge
+        worker = Metrics.MetricsRegistry()
+        worker.inc("frames_decoded_total", 3)
+        worker.set_max("decoded_frame_peak_bytes", 10)
+        worker.observe("decode_seconds", 0.002)
+        parent = Metrics.MetricsRegistry()
+        parent.set_max("decoded_frame_peak_bytes", 20)
+        parent.observe("decode_seconds", 0.003)
+        parent.merge(worker.drain())
+        assert not worker.counters and not worker.histograms
+        snapshot = parent.snapshot()
+        assert snapshot["counters"]["frames_decoded_total"] == 3
+        assert snapshot["gauges"]["decoded_frame_peak_bytes"] == 20
+        assert snapshot["histograms"]["decode_seconds"]["count"] == 2
+        
+        # Bucket interpolation: 100 samples spread evenly over the 1-2 ms bucket
+        histogram = Metrics.Histogram([0.001, 0.002, 0.005])
+        for i in range(100):
+            histogram.observe(0.001 + (i + 0.5) / 100 * 0.001)
+        assert abs(histogram.quantile(0.5) - 0.0015) < 1e-9
+        assert histogram.cumulative() == [0, 100, 100, 100]
+        
+        print("✓ Metrics instrumentation test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Metrics instrumentation error: {e}")
+        return False
+
+
+def test_image_decoder():
+    """Test single-pass grayscale decoding, previews and reduced-resolution decoding"""
+    print("\nTesting image decoder...")
+    try:
+        import numpy as np
+        import tempfile
+        import cv2
+        import matplotlib.image as mpimg
+        from ImageDecoder import ImageDecoder, image_size
+        from utils import config_mgr
+        
+        decoder = ImageDecoder.from_config(config_mgr)
+        weights = np.array([0.2989, 0.5870, 0.1140], dtype=np.float32)
+        
+        # Same grayscale as the matplotlib decode + rgb2gray path for the bundled images
+        image_file = os.path.join(config_mgr.get_directory("images"), "A.png")
+        rgb = mpimg.imread(image_file)
+        gray = decoder.decode_gray(image_file)
+        assert gray.dtype == np.float32 and gray.shape == rgb.shape[:2]
+        assert np.abs(gray - rgb[:, :, :3] @ weights).max() < 1e-5
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            rng = np.random.default_rng(3)
+            bgr = (rng.random((120, 500, 3)) * 255).astype(np.uint8)
+            expected = bgr[:, :, ::-1].astype(np.float32) / 255 @ weights
+            
+            # Alpha is ignored, 16-bit is scaled by its own range, single channel is used as is
+            bgra = np.dstack([bgr, np.full(bgr.shape[:2], 7, dtype=np.uint8)])
+            cases = {"rgba.png": (bgra, expected),
+                     "rgb16.png": (bgr.astype(np.uint16) * 257, expected),
+                     "gray.png": (bgr[:, :, 0], bgr[:, :, 0] / 255)}
+            for name, (pixels, reference) in cases.items():
+                path = os.path.join(tmp_dir, name)
+                cv2.imwrite(path, pixels)
+                assert np.abs(decoder.decode_gray(path) - reference).max() < 1e-5, name
+            
+            decoded = decoder.decode(os.path.join(tmp_dir, "rgba.png"), preview=True)
+            assert decoded.preview.shape == (48, 200, 3) and decoded.preview.dtype == np.uint8
+            assert decoder.decode(os.path.join(tmp_dir, "rgba.png")).preview is None
+            
+            jpeg_file = os.path.join(tmp_dir, "frame.jpg")
+            cv2.imwrite(jpeg_file, bgr)
+            assert image_size(jpeg_file) == (120, 500)
+            assert image_size(os.path.join(tmp_dir, "gray.png")) == (120, 500)
+            
+            # Reduced decoding: fixed factor, or the smallest factor fitting max_dimension
+            reduced = ImageDecoder(reduce_factor=2).decode(jpeg_file)
+            assert reduced.gray.shape == (60, 250) and reduced.reduction == 2
+            assert ImageDecoder(max_dimension=128).reduction_for(jpeg_file) == 4
+            assert ImageDecoder(max_dimension=1000).reduction_for(jpeg_file) == 1
+            
+            try:
+                decoder.decode(os.path.join(tmp_dir, "missing.png"))
+                assert False, "Undecodable file accepted"
+            except ValueError:
+                pass
+        
+        print("✓ Image decoder test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Image decoder error: {e}")
+        return False
+
+
+def test_controller():
+    """Test the asyncio controller: per-intersection data, backpressure and a slow lane not blocking others"""
+    print("\nTesting multi-intersection controller...")
+    try:
+        import asyncio
+        import shutil
+        import tempfile
+        import time
+        import numpy as np
+        from Controller import IntersectionConfig, IntersectionController
+        from EdgeBackends import backend_from_config
+        from ImageDecoder import ImageDecoder
+        from utils import config_mgr
+        
+        config = IntersectionConfig(config_mgr, {
+            "controller.executor": "thread",
+            "controller.workers": 2,
+            "controller.queue_size": 2,
+            "controller.sample_interval_seconds": 0,
+            "controller.follow_directories": False,
+            "controller.yellow_seconds": 1,
+            "controller.time_scale": 0.001,
+        })
+        images_dir = config_mgr.get_directory("images")
+        
+        def slow_camera():
+            rng = np.random.default_rng(5)
+            while True:
+                time.sleep(0.2)
+                yield (rng.random((120, 160, 3)) * 255).astype(np.uint8)
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            lanes = {}
+            for lane, name in enumerate("ABCD", start=1):
+                lanes[lane] = os.path.join(tmp_dir, "captures", str(lane))
+                os.makedirs(lanes[lane])
+                for i in range(5):
+                    shutil.copy(os.path.join(images_dir, f"{name}.png"), os.path.join(lanes[lane], f"{i:03d}.png"))
+            intersections = {
+                "north": {"lanes": lanes, "data_directory": os.path.join(tmp_dir, "north")},
+                "slow": {"lanes": {1: slow_camera(), 2: slow_camera()}, "data_directory": os.path.join(tmp_dir, "slow")},
+            }
+            signals = []
+            controller = IntersectionController(config, intersections,
+                                                on_signal=lambda *change: signals.append(change))
+            
+            async def run_until_north_done():
+                run = asyncio.create_task(controller.run(duration=60))
+                while controller.intersections["north"].frames < 20 and not run.done():
+                    await asyncio.sleep(0.05)
+                controller.stop()
+                await run
+            
+            asyncio.run(run_until_north_done())
+            status = {row["name"]: row for row in controller.status()}
+            
+            # The fast intersection got through all its captures while the slow cameras trickled in
+            assert status["north"]["frames"] == 20 and status["north"]["errors"] == 0
+            assert 0 < status["slow"]["frames"] < 20
+            for row in status.values():
+                assert row["max_queue_depth"] <= 2
+            
+            backend = backend_from_config(config_mgr)
+            decoder = ImageDecoder.from_config(config_mgr)
+            for lane, name in enumerate("ABCD", start=1):
+                expected = backend.detect_result(decoder.decode_gray(os.path.join(images_dir, f"{name}.png")))
+                assert status["north"]["latest"][lane] == expected.white_pixels
+            
+            # Each intersection cycles its own lanes in order, green then yellow
+            north = [(lane, phase) for name, lane, phase, _, _ in signals if name == "north"]
+            assert north[:8] == [(1, "green"), (1, "yellow"), (2, "green"), (2, "yellow"),
+                                 (3, "green"), (3, "yellow"), (4, "green"), (4, "yellow")]
+            assert {lane for name, lane, _, _, _ in signals if name == "slow"} == {1, 2}
+            
+            # Lane data is kept per intersection
+            for name in intersections:
+                assert os.path.exists(os.path.join(tmp_dir, name, "traffic.db"))
+            
+            # Each detection enters the lane history once, however many signal cycles reuse it
+            for intersection in controller.intersections.values():
+                for lane in intersection.lanes:
+                    assert intersection.traffic_manager.history.size(lane) <= intersection.samples.get(lane, 0)
+            
+            # Without controller.workers the pool uses the shared image_processing.parallel.workers
+            shared = IntersectionConfig(config_mgr, {"controller.workers": 0, "image_processing.parallel.workers": 3})
+            sized = IntersectionController(shared, {"east": {"lanes": {1: lanes[1]},
+                                                             "data_directory": os.path.join(tmp_dir, "east")}})
+            assert sized.workers == 3
+        
+        print("✓ Multi-intersection controller test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Multi-intersection controller error: {e}")
+        return False
+
+
+def test_import_budget():
+    """Test that imports stay cheap and free of side effects (python -X importtime)"""
+    print("\nTesting import-time budget...")
+    try:
+        import subprocess
+        import tempfile
+        
+        # Cumulative import time budget in milliseconds and modules that must stay lazy
+        budgets = {"utils": 250, "BatchProcess": 300, "Main": 600}
+        heavy = {"cv2", "matplotlib", "scipy", "skimage", "PIL", "tkinter"}
+        allowed = {"Main": {"tkinter"}}
+        
+        repo_dir = os.path.dirname(os.path.abspath(__file__))
+        env = dict(os.environ, PYTHONPATH=repo_dir)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for module, budget_ms in budgets.items():
+                # Run from an empty directory: importing must not need config.json or create files
+                proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                      cwd=tmp_dir, env=env, capture_output=True, text=True)
+                assert proc.returncode == 0, proc.stderr[-500:]
+                assert os.listdir(tmp_dir) == [], f"import {module} created {os.listdir(tmp_dir)}"
+                
+                cumulative = {}
+                for line in proc.stderr.splitlines():
+                    if line.startswith("import time:") and "|" in line:
+                        fields = line[len("import time:"):].split("|")
+                        if fields[1].strip().isdigit():
+                            cumulative[fields[2].strip()] = int(fields[1])
+                
+                loaded = {name.split(".")[0] for name in cumulative} & (heavy - allowed.get(module, set()))
+                assert not loaded, f"import {module} loads {sorted(loaded)}"
+                total_ms = cumulative[module] / 1000
+                assert total_ms < budget_ms, f"import {module} took {total_ms:.0f} ms (budget {budget_ms} ms)"
+                print(f"  import {module}: {total_ms:.1f} ms")
+        
+        print("✓ Import-time budget test successful")
+        return True
+    except Exception as e:
+        print(f"✗ Import-time budget error: {e}")
+        return False
+
+
 def test_directories():
     """Test directory structure"""
     print("\nTesting directory structure...")
@@ -181,6 +1485,9 @@ def test_directories():
 
 def run_all_tests():
     """Run all tests"""
+    from utils import setup
+    setup()
+    
     print("=" * 60)
     print("Smart Traffic Control System - Test Suite")
     print("=" * 60)
@@ -193,6 +1500,31 @@ def run_all_tests():
         test_file_manager,
         test_traffic_data_manager,
         test_canny_edge_detector,
+        test_vectorized_nms,
+        test_connected_hysteresis,
+        test_separable_filters,
+        test_batch_detect,
+        test_parallel_executor,
+        test_tiled_detect,
+        test_workspace_detect,
+        test_edge_backends,
+        test_streaming_pipeline,
+        test_incremental_detect,
+        test_in_memory_result,
+        test_reference_stats_cache,
+        test_multi_lane,
+        test_batch_cli,
+        test_sqlite_lane_store,
+        test_lane_cache,
+        test_lane_history,
+        test_vectorized_levels,
+        test_async_logging,
+        test_config_reload,
+        test_benchmark,
+        test_metrics,
+        test_image_decoder,
+        test_controller,
+        test_import_budget,
     ]
     
     results = []
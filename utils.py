@@ -3,10 +3,19 @@ Utility module for the Smart Traffic Control System.
 Provides logging, configuration management, data validation, and file operations.
 """
 
+import atexit
+import hashlib
 import json
 import os
 import logging
+import logging.handlers
+import numbers
+import queue
 import shutil
+import sqlite3
+import threading
+import time
+import weakref
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Tuple, Optional
@@ -15,10 +24,67 @@ from typing import Dict, List, Tuple, Optional
 class ConfigManager:
     """Manages application configuration from config.json"""
     
+    # Keys that must hold numbers when present; checked before a configuration is used
+    NUMERIC_KEYS = (
+        "image_processing.canny_edge_detection.sigma",
+        "image_processing.canny_edge_detection.kernel_size",
+        "image_processing.canny_edge_detection.low_threshold",
+        "image_processing.canny_edge_detection.high_threshold",
+        "image_processing.canny_edge_detection.weak_pixel",
+        "image_processing.canny_edge_detection.strong_pixel",
+        "image_processing.grayscale_conversion.r_weight",
+        "image_processing.grayscale_conversion.g_weight",
+        "image_processing.grayscale_conversion.b_weight",
+        "traffic_density.lanes",
+    )
+    
     def __init__(self, config_path: str = "config.json"):
         """Initialize ConfigManager and load configuration"""
         self.config_path = config_path
+        self._listeners = []
+        self._watcher = None
+        self._stop_watching = threading.Event()
+        self._version = self._file_version()
         self.config = self._load_config()
+        self._flat = self._compile(self.config)
+    
+    @staticmethod
+    def _compile(config: Dict) -> Dict:
+        """
+        Flatten the configuration into a dotted-key map (sections included) and validate it
+        
+        get() then costs one dict lookup instead of a split and a walk per call.
+        """
+        flat = {}
+        
+        def walk(prefix: str, section: Dict):
+            for key, value in section.items():
+                path = f"{prefix}{key}"
+                if value is None:
+                    continue
+                flat[path] = value
+                if isinstance(value, dict):
+                    walk(f"{path}.", value)
+        
+        walk("", config)
+        
+        for key in ConfigManager.NUMERIC_KEYS:
+            value = flat.get(key)
+            if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+                raise ValueError(f"Configuration value {key} must be a number, got {value!r}")
+        for level, settings in (flat.get("traffic_density.time_allocation") or {}).items():
+            if not isinstance(settings, dict) or "label" not in settings or \
+                    not isinstance(settings.get("green_time_seconds"), int):
+                raise ValueError(f"traffic_density.time_allocation.{level} needs a label and an integer green_time_seconds")
+        
+        return flat
+    
+    def _file_version(self):
+        try:
+            stat = os.stat(self.config_path)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
     
     def _load_config(self) -> Dict:
         """Load configuration from JSON file"""
@@ -32,7 +98,7 @@ class ConfigManager:
             # Only log if logger is available (check if logger has been defined globally)
             try:
                 if 'logger' in globals():
-                    logger.info(f"Configuration loaded successfully from {self.config_path}")
+                    logger.info("Configuration loaded successfully from %s", self.config_path)
             except:
                 pass
             
@@ -40,32 +106,86 @@ class ConfigManager:
         except json.JSONDecodeError as e:
             try:
                 if 'logger' in globals():
-                    logger.error(f"Invalid JSON in configuration file: {e}")
+                    logger.error("Invalid JSON in configuration file: %s", e)
             except:
                 pass
             raise
         except Exception as e:
             try:
                 if 'logger' in globals():
-                    logger.error(f"Error loading configuration: {e}")
+                    logger.error("Error loading configuration: %s", e)
             except:
                 pass
             raise
     
     def get(self, key: str, default=None):
         """Get configuration value using dot notation (e.g., 'image_processing.canny_edge_detection.sigma')"""
-        keys = key.split('.')
-        value = self.config
+        return self._flat.get(key, default)
+    
+    def reload(self) -> bool:
+        """
+        Load config.json again and swap it in as a whole
         
-        for k in keys:
-            if isinstance(value, dict):
-                value = value.get(k)
-                if value is None:
-                    return default
-            else:
-                return default
+        An unreadable or invalid file is logged and the current configuration stays in use.
+        Reload listeners are called after a successful swap.
+        """
+        version = self._file_version()
+        try:
+            config = self._load_config()
+            flat = self._compile(config)
+        except Exception as e:
+            logger.error("Configuration reload failed, keeping current settings: %s", e)
+            self._version = version
+            return False
+        
+        # Readers see either the old or the new snapshot, never a mix
+        self._flat = flat
+        self.config = config
+        self._version = version
+        
+        for listener in list(self._listeners):
+            callback = listener()
+            if callback is None:
+                self._listeners.remove(listener)
+                continue
+            try:
+                callback(self)
+            except Exception as e:
+                logger.error("Error applying reloaded configuration: %s", e)
+        return True
+    
+    def reload_if_changed(self) -> bool:
+        """Reload only if config.json changed on disk since the last load"""
+        if self._file_version() == self._version:
+            return False
+        return self.reload()
+    
+    def add_reload_listener(self, callback):
+        """Call callback(config) after every successful reload (bound methods are held weakly)"""
+        if hasattr(callback, "__self__"):
+            self._listeners.append(weakref.WeakMethod(callback))
+        else:
+            self._listeners.append(lambda: callback)
+    
+    def start_watching(self, interval: float = None):
+        """Poll config.json on a background thread and reload it when its mtime changes"""
+        if self._watcher is not None and self._watcher.is_alive():
+            return
+        interval = interval or self.get("config_reload.interval_seconds", 2.0)
+        self._stop_watching.clear()
+        
+        def watch():
+            while not self._stop_watching.wait(interval):
+                self.reload_if_changed()
         
-        return value
+        self._watcher = threading.Thread(target=watch, daemon=True)
+        self._watcher.start()
+    
+    def stop_watching(self):
+        self._stop_watching.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
     
     def get_directory(self, dir_key: str) -> str:
         """Get directory path and create if not exists"""
@@ -75,18 +195,49 @@ class ConfigManager:
             # Only log if logger is already initialized
             try:
                 if 'logger' in globals():
-                    logger.info(f"Created directory: {dir_path}")
+                    logger.info("Created directory: %s", dir_path)
             except:
                 pass
         return dir_path
 
 
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue records as they are; message formatting happens on the listener thread.
+    
+    Records whose arguments are not immutable scalars (a lane dict, a list) are formatted here, so a
+    caller changing the object afterwards cannot change the logged message.
+    """
+    
+    SCALARS = (str, bytes, numbers.Number, type(None))
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        args = record.args
+        if args:
+            values = args.values() if isinstance(args, dict) else args
+            if not all(isinstance(value, self.SCALARS) for value in values):
+                record.msg = record.getMessage()
+                record.args = None
+            elif isinstance(args, dict):
+                # A single dict argument is stored as record.args itself; keep a copy of it
+                record.args = dict(args)
+        return record
+
+
 class LoggerSetup:
     """Setup application logging"""
     
+    # QueueListener per configured logger name
+    listeners = {}
+    
     @staticmethod
     def setup_logger(name: str = "TrafficControlSystem", config: ConfigManager = None) -> logging.Logger:
-        """Setup and return a logger instance"""
+        """
+        Setup and return a logger instance
+        
+        Callers only put records on a queue; a QueueListener thread formats them and writes to the
+        console and the log file, so logging never blocks image processing on disk I/O.
+        """
         logger_instance = logging.getLogger(name)
         
         # Only add handlers if not already configured
@@ -97,50 +248,146 @@ class LoggerSetup:
                 log_format = config.get("logging.format", "%(asctime)s - %(levelname)s - %(message)s")
                 date_format = config.get("logging.date_format", "%Y-%m-%d %H:%M:%S")
                 log_dir = config.get_directory("logs")
+                module_levels = config.get("logging.modules", {}) or {}
             else:
                 log_level = "INFO"
                 log_format = "%(asctime)s - %(levelname)s - %(message)s"
                 date_format = "%Y-%m-%d %H:%M:%S"
                 log_dir = "logs"
+                module_levels = {}
             
             # Set logger level
             logger_instance.setLevel(getattr(logging, log_level))
             
+            # Per-module levels, e.g. {"classify": "WARNING"} for TrafficControlSystem.classify
+            for module, level in module_levels.items():
+                logging.getLogger(f"{name}.{module}").setLevel(getattr(logging, level))
+            
             # Create formatter
             formatter = logging.Formatter(log_format, datefmt=date_format)
             
             # Console handler
             console_handler = logging.StreamHandler()
             console_handler.setFormatter(formatter)
-            logger_instance.addHandler(console_handler)
             
             # File handler
             os.makedirs(log_dir, exist_ok=True)
             log_file = os.path.join(log_dir, f"traffic_control_{datetime.now().strftime('%Y%m%d')}.log")
             file_handler = logging.FileHandler(log_file)
             file_handler.setFormatter(formatter)
-            logger_instance.addHandler(file_handler)
+            
+            # Both handlers run on the listener thread
+            log_queue = queue.SimpleQueue()
+            listener = logging.handlers.QueueListener(
+                log_queue, console_handler, file_handler, respect_handler_level=True)
+            listener.start()
+            LoggerSetup.listeners[name] = listener
+            atexit.register(LoggerSetup.stop_listener, name)
+            if hasattr(os, "register_at_fork"):
+                os.register_at_fork(before=lambda: LoggerSetup._hold_handlers(name, True),
+                                    after_in_parent=lambda: LoggerSetup._hold_handlers(name, False),
+                                    after_in_child=lambda: LoggerSetup._log_directly_in_child(name))
+            logger_instance.addHandler(DeferredQueueHandler(log_queue))
         
         return logger_instance
+    
+    @staticmethod
+    def stop_listener(name: str = "TrafficControlSystem"):
+        """Write out every queued record of a logger and stop its listener thread"""
+        listener = LoggerSetup.listeners.pop(name, None)
+        if listener is not None:
+            listener.stop()
+    
+    @staticmethod
+    def _hold_handlers(name: str, hold: bool):
+        """
+        Take (or release) the listener's handler locks around fork(), so the child is never forked
+        while the listener thread is half-way through writing a record and holds the stream's lock
+        """
+        listener = LoggerSetup.listeners.get(name)
+        if listener is not None:
+            for handler in listener.handlers:
+                if hold:
+                    handler.acquire()
+                else:
+                    handler.release()
+    
+    @staticmethod
+    def _log_directly_in_child(name: str):
+        """
+        Forked worker processes inherit the queue but not the listener thread, and multiprocessing
+        children exit without running atexit, so workers write through the handlers directly
+        """
+        listener = LoggerSetup.listeners.pop(name, None)
+        if listener is not None:
+            logger_instance = logging.getLogger(name)
+            for handler in logger_instance.handlers[:]:
+                if isinstance(handler, DeferredQueueHandler):
+                    logger_instance.removeHandler(handler)
+            for handler in listener.handlers:
+                logger_instance.addHandler(handler)
+    
+    @staticmethod
+    def get_logger(module: str, name: str = "TrafficControlSystem") -> logging.Logger:
+        """Child logger of the application logger whose level can be set in logging.modules"""
+        return logging.getLogger(f"{name}.{module}")
+
+
+# Application logger; handlers are attached by setup(), so importing this module has no side effects
+logger = logging.getLogger("TrafficControlSystem")
 
+# Shared configuration, loaded on first use by get_config() (or setup())
+_config_mgr = None
 
-# Initialize global logger
-try:
-    config_mgr = ConfigManager()
-    logger = LoggerSetup.setup_logger("TrafficControlSystem", config_mgr)
-except Exception as e:
-    # Fallback if config doesn't exist
-    import logging
-    import traceback
-    config_mgr = None
-    logger = logging.getLogger("TrafficControlSystem")
-    logger.setLevel(logging.INFO)
-    handler = logging.StreamHandler()
-    handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
-    logger.addHandler(handler)
-    # Print error for debugging
-    logger.error(f"Failed to initialize from config: {e}")
-    traceback.print_exc()
+
+def get_config(config_path: str = "config.json") -> ConfigManager:
+    """Shared ConfigManager, loading config.json the first time it is needed"""
+    global _config_mgr
+    if _config_mgr is None:
+        _config_mgr = ConfigManager(config_path)
+    return _config_mgr
+
+
+def setup(config_path: str = "config.json") -> Optional[ConfigManager]:
+    """
+    Load the shared configuration and start logging; entry points call this once at startup
+    
+    Returns:
+        The shared ConfigManager, or None if the configuration could not be loaded
+        (logging then falls back to the console)
+    """
+    try:
+        config = get_config(config_path)
+        LoggerSetup.setup_logger("TrafficControlSystem", config)
+        if config.get("metrics.enabled", False):
+            # Only imported when enabled: disabled metrics leave every hot path untouched
+            from Metrics import setup_metrics
+            setup_metrics(config)
+        return config
+    except Exception as e:
+        # Fallback if config doesn't exist
+        import traceback
+        if not logger.handlers:
+            logger.setLevel(logging.INFO)
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+            logger.addHandler(handler)
+        # Print error for debugging
+        logger.error("Failed to initialize from config: %s", e)
+        traceback.print_exc()
+        return None
+
+
+def __getattr__(name: str):
+    # `from utils import config_mgr` keeps working and loads the configuration lazily
+    if name == "config_mgr":
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Hot-path components log through child loggers so their levels can be tuned separately
+file_logger = LoggerSetup.get_logger("files")
+classify_logger = LoggerSetup.get_logger("classify")
+lane_logger = LoggerSetup.get_logger("lanes")
 
 
 class DataValidator:
@@ -154,7 +401,7 @@ class DataValidator:
         """Validate Previous_data.txt file structure and content"""
         try:
             if not os.path.exists(filepath):
-                logger.warning(f"Traffic data file not found: {filepath}. Creating new file.")
+                logger.warning("Traffic data file not found: %s. Creating new file.", filepath)
                 self._create_traffic_data_file(filepath)
                 return True
             
@@ -163,7 +410,8 @@ class DataValidator:
             
             # Check if file has correct number of lanes
             if len(lines) != self.num_lanes:
-                logger.warning(f"Traffic data file has {len(lines)} lines, expected {self.num_lanes}. Recreating file.")
+                logger.warning("Traffic data file has %s lines, expected %s. Recreating file.",
+                               len(lines), self.num_lanes)
                 self._create_traffic_data_file(filepath)
                 return True
             
@@ -172,18 +420,18 @@ class DataValidator:
                 try:
                     int(line.strip())
                 except ValueError:
-                    logger.warning(f"Invalid data in lane {i+1}: {line.strip()}. Resetting to 0.")
+                    logger.warning("Invalid data in lane %s: %s. Resetting to 0.", i+1, line.strip())
                     lines[i] = "0\n"
             
             # Write corrected data if any issues found
             with open(filepath, 'w') as f:
                 f.writelines(lines)
             
-            logger.info(f"Traffic data file validated: {filepath}")
+            logger.info("Traffic data file validated: %s", filepath)
             return True
         
         except Exception as e:
-            logger.error(f"Error validating traffic data file: {e}")
+            logger.error("Error validating traffic data file: %s", e)
             return False
     
     def _create_traffic_data_file(self, filepath: str):
@@ -193,9 +441,9 @@ class DataValidator:
             with open(filepath, 'w') as f:
                 for _ in range(self.num_lanes):
                     f.write("0\n")
-            logger.info(f"Created new traffic data file: {filepath}")
+            logger.info("Created new traffic data file: %s", filepath)
         except Exception as e:
-            logger.error(f"Error creating traffic data file: {e}")
+            logger.error("Error creating traffic data file: %s", e)
             raise
     
     def backup_traffic_data(self, source: str, dest: str = None):
@@ -208,10 +456,10 @@ class DataValidator:
                 dest = source.replace(".txt", f"_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt")
             
             shutil.copy2(source, dest)
-            logger.info(f"Backup created: {dest}")
+            file_logger.info("Backup created: %s", dest)
             return True
         except Exception as e:
-            logger.error(f"Error creating backup: {e}")
+            logger.error("Error creating backup: %s", e)
             return False
 
 
@@ -243,7 +491,7 @@ class FileManager:
             if file_size > max_size:
                 return False, f"Image file too large: {file_size} bytes (max: {max_size} bytes)"
             
-            logger.info(f"Image file validated: {filepath}")
+            file_logger.info("Image file validated: %s", filepath)
             return True, "Image file is valid"
         
         except Exception as e:
@@ -258,8 +506,422 @@ class FileManager:
             os.makedirs(directory, exist_ok=True)
             return True
         except Exception as e:
-            logger.error(f"Error creating directory {directory}: {e}")
+            logger.error("Error creating directory %s: %s", directory, e)
+            return False
+
+
+class ReferenceStatsCache:
+    """Memoize white-pixel counts of reference images, keyed by path, mtime and content hash"""
+    
+    def __init__(self, config: ConfigManager, cache_file: str = None):
+        self.config = config
+        self.cache_file = cache_file or config.get("files.reference_stats_cache", "data/reference_stats.json")
+        self._lock = threading.Lock()
+        self._entries = self._load()
+    
+    def _load(self) -> Dict:
+        """Load persisted statistics; a missing or corrupt cache simply starts empty"""
+        try:
+            if os.path.exists(self.cache_file):
+                with open(self.cache_file, 'r') as f:
+                    return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable reference stats cache %s: %s", self.cache_file, e)
+        return {}
+    
+    def _save(self):
+        """Persist statistics atomically so concurrent readers never see a partial file"""
+        try:
+            directory = os.path.dirname(self.cache_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(self._entries, f, indent=2)
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            logger.error("Error saving reference stats cache: %s", e)
+    
+    def reference_path(self, lane=None) -> str:
+        """Reference image for a lane or camera id, falling back to files.reference_image"""
+        per_lane = self.config.get("files.reference_images", {}) or {}
+        if lane is not None and str(lane) in per_lane:
+            return per_lane[str(lane)]
+        return self.config.get("files.reference_image", "gray/refrence.png")
+    
+    @staticmethod
+    def _file_hash(filepath: str) -> str:
+        digest = hashlib.sha256()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def get_white_pixels(self, lane=None, white_value: int = 255) -> Optional[int]:
+        """
+        White-pixel count of the reference image for a lane or camera.
+        
+        Unchanged files (same mtime and size) are answered from the cache without reading them;
+        a touched file is rehashed and only decoded again if its content changed.
+        
+        Returns:
+            Count of pixels equal to white_value, or None if the reference cannot be read
+        """
+        filepath = self.reference_path(lane)
+        key = os.path.abspath(filepath)
+        
+        with self._lock:
+            try:
+                stat = os.stat(filepath)
+            except OSError:
+                logger.warning("Reference image not found: %s", filepath)
+                return None
+            
+            entry = self._entries.get(key)
+            if entry and entry.get("white_value") == white_value:
+                if entry["mtime_ns"] == stat.st_mtime_ns and entry["size"] == stat.st_size:
+                    return entry["white_pixels"]
+            
+            content_hash = self._file_hash(filepath)
+            if entry and entry.get("white_value") == white_value and entry["sha256"] == content_hash:
+                white_pixels = entry["white_pixels"]
+            else:
+                import cv2
+                import numpy as np
+                img_ref = cv2.imread(filepath, cv2.IMREAD_GRAYSCALE)
+                if img_ref is None:
+                    logger.error("Failed to read reference image: %s", filepath)
+                    return None
+                white_pixels = int(np.count_nonzero(img_ref == white_value))
+                file_logger.info("Reference statistics computed for %s: %d white pixels", filepath, white_pixels)
+            
+            self._entries[key] = {
+                "mtime_ns": stat.st_mtime_ns,
+                "size": stat.st_size,
+                "sha256": content_hash,
+                "white_value": white_value,
+                "white_pixels": white_pixels,
+            }
+            self._save()
+            return white_pixels
+
+
+class AsyncImageWriter:
+    """Write images to disk on a background thread so saving never blocks processing"""
+    
+    def __init__(self, max_pending: int = 16):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+    
+    def submit(self, filepath: str, image) -> bool:
+        """Queue an image for writing; drops it (and returns False) if the writer is backed up"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        try:
+            self._queue.put_nowait((filepath, image.copy()))
+            return True
+        except queue.Full:
+            logger.warning("Image writer queue full, skipped: %s", filepath)
             return False
+    
+    def _run(self):
+        import cv2
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                filepath, image = item
+                directory = os.path.dirname(filepath)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                if not cv2.imwrite(filepath, image):
+                    logger.error("Failed to write image: %s", filepath)
+            except Exception as e:
+                logger.error("Error writing image: %s", e)
+            finally:
+                self._queue.task_done()
+    
+    def flush(self):
+        """Block until every queued image has been written"""
+        self._queue.join()
+    
+    def close(self):
+        """Write remaining images and stop the background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._thread = None
+
+
+class TextLaneStore:
+    """Lane pixel counts in Previous_data.txt, one line per lane (backed up before every write)"""
+    
+    def __init__(self, config: ConfigManager, validator: DataValidator):
+        self.data_file = config.get("files.traffic_data", "Previous_data.txt")
+        self.backup_file = config.get("files.traffic_data_backup", "Previous_data_backup.txt")
+        self.num_lanes = config.get("traffic_density.lanes", 4)
+        self.validator = validator
+        self.validator.validate_traffic_data_file(self.data_file)
+    
+    def get_lanes(self) -> List[int]:
+        with open(self.data_file, 'r') as f:
+            lines = f.readlines()
+        
+        data = []
+        for line in lines:
+            try:
+                data.append(int(line.strip()))
+            except ValueError:
+                data.append(0)
+        return data
+    
+    def set_lanes(self, lane_pixels: Dict[int, int]) -> Tuple:
+        """Update lanes; returns the file version before the write and that of the written file"""
+        self.validator.backup_traffic_data(self.data_file, self.backup_file)
+        
+        before = self.version()
+        data = self.get_lanes()
+        for lane, pixel_count in lane_pixels.items():
+            data[lane - 1] = pixel_count
+        
+        with open(self.data_file, 'w') as f:
+            for value in data:
+                f.write(f"{value}\n")
+            f.flush()
+            # Version of our own file, even if another writer replaces it right after
+            stat = os.fstat(f.fileno())
+        return before, (stat.st_mtime_ns, stat.st_size)
+    
+    def reset(self):
+        self.set_lanes({lane: 0 for lane in range(1, self.num_lanes + 1)})
+    
+    def version(self) -> Tuple:
+        """Changes whenever the data file is rewritten"""
+        stat = os.stat(self.data_file)
+        return stat.st_mtime_ns, stat.st_size
+    
+    def close(self):
+        """Nothing to release; the file is opened per call"""
+
+
+class SQLiteLaneStore:
+    """
+    Lane pixel counts in an SQLite database in WAL mode.
+    
+    Each update is a single transaction touching only the given lanes, so the GUI, the CLI tools and
+    worker processes can share one database without losing each other's writes. On first use the
+    table is seeded from Previous_data.txt.
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS lanes (
+            lane INTEGER PRIMARY KEY,
+            pixels INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        );
+        INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0);
+    """
+    
+    def __init__(self, config: ConfigManager, db_file: str = None):
+        self.db_file = db_file or config.get("files.traffic_db", "data/traffic.db")
+        self.num_lanes = config.get("traffic_density.lanes", 4)
+        self.timeout = config.get("files.traffic_db_timeout_seconds", 5.0)
+        self.import_file = config.get("files.traffic_data", "Previous_data.txt")
+        self._local = threading.local()
+        
+        directory = os.path.dirname(self.db_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._initialize()
+    
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread and process (sqlite3 connections must not cross either)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_file, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+    
+    def _initialize(self):
+        conn = self._connection()
+        conn.executescript(self.SCHEMA)
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if conn.execute("SELECT COUNT(*) FROM lanes").fetchone()[0] == 0:
+                values = self._import_values()
+                now = time.time()
+                conn.executemany("INSERT OR IGNORE INTO lanes (lane, pixels, updated_at) VALUES (?, ?, ?)",
+                                 [(lane, values[lane - 1], now) for lane in range(1, self.num_lanes + 1)])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    
+    def _import_values(self) -> List[int]:
+        """Lane values from the legacy text file, or zeros if it is missing or malformed"""
+        values = [0] * self.num_lanes
+        if os.path.exists(self.import_file):
+            with open(self.import_file, 'r') as f:
+                for i, line in enumerate(f.readlines()[:self.num_lanes]):
+                    try:
+                        values[i] = int(line.strip())
+                    except ValueError:
+                        pass
+            logger.info("Imported lane data from %s into %s", self.import_file, self.db_file)
+        return values
+    
+    def get_lanes(self) -> List[int]:
+        rows = self._connection().execute(
+            "SELECT lane, pixels FROM lanes WHERE lane BETWEEN 1 AND ?", (self.num_lanes,)).fetchall()
+        data = [0] * self.num_lanes
+        for lane, pixels in rows:
+            data[lane - 1] = pixels
+        return data
+    
+    def set_lanes(self, lane_pixels: Dict[int, int]) -> Tuple[int, int]:
+        """Update lanes in one transaction; returns the store version before and after it"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+            conn.executemany("INSERT OR REPLACE INTO lanes (lane, pixels, updated_at) VALUES (?, ?, ?)",
+                             [(lane, int(pixels), now) for lane, pixels in lane_pixels.items()])
+            conn.execute("UPDATE meta SET value = ? WHERE key = 'version'", (before + 1,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return before, before + 1
+    
+    def reset(self):
+        self.set_lanes({lane: 0 for lane in range(1, self.num_lanes + 1)})
+    
+    def version(self) -> int:
+        """Counter bumped by every set_lanes() transaction, from any connection or process"""
+        return self._connection().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+    
+    def close(self):
+        """Close this thread's connection"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+class CachedLaneStore:
+    """
+    Keep lane counts of another store in memory and write changes back on a background thread.
+    
+    Reads are answered from memory and only reload when the underlying file has changed on disk.
+    Updates mark lanes dirty; they are flushed every flush_interval seconds, on flush(), close(),
+    when the cache is garbage collected and at exit.
+    """
+    
+    def __init__(self, store, flush_interval: float = 2.0):
+        self.store = store
+        self.flush_interval = flush_interval
+        self._lock = threading.RLock()
+        self._data = None
+        self._version = None
+        self._dirty = {}
+        self._stop = threading.Event()
+        self._thread = None
+        # Runs at exit or once the cache is unreachable, without keeping it (or its manager) alive
+        self._finalizer = weakref.finalize(self, CachedLaneStore._finalize, store, self._dirty, self._lock, self._stop)
+    
+    @staticmethod
+    def _write(store, dirty: Dict[int, int]) -> Optional[Tuple]:
+        """Write dirty lanes to the store; on failure they stay dirty for the next attempt"""
+        try:
+            versions = store.set_lanes(dirty)
+            dirty.clear()
+            return versions
+        except Exception as e:
+            logger.error("Error flushing lane data: %s", e)
+            return None
+    
+    @staticmethod
+    def _finalize(store, dirty: Dict[int, int], lock, stop: threading.Event):
+        stop.set()
+        with lock:
+            if dirty:
+                CachedLaneStore._write(store, dirty)
+        store.close()
+    
+    def _refresh(self):
+        """Reload if another writer changed the store, keeping our unflushed updates on top"""
+        version = self.store.version()
+        if self._data is None or version != self._version:
+            data = self.store.get_lanes()
+            for lane, pixels in self._dirty.items():
+                data[lane - 1] = pixels
+            self._data = data
+            self._version = version
+    
+    def get_lanes(self) -> List[int]:
+        with self._lock:
+            self._refresh()
+            return list(self._data)
+    
+    def set_lanes(self, lane_pixels: Dict[int, int]):
+        with self._lock:
+            self._refresh()
+            for lane, pixels in lane_pixels.items():
+                self._data[lane - 1] = pixels
+                self._dirty[lane] = pixels
+            if self._thread is None:
+                self._thread = threading.Thread(target=CachedLaneStore._run, daemon=True,
+                                                args=(weakref.ref(self), self._stop, self.flush_interval))
+                self._thread.start()
+    
+    def reset(self):
+        with self._lock:
+            self._dirty.clear()
+            self.store.reset()
+            self._data = None
+    
+    def flush(self) -> bool:
+        """Write dirty lanes now; on failure they stay dirty for the next attempt"""
+        with self._lock:
+            if not self._dirty:
+                return True
+            versions = self._write(self.store, self._dirty)
+            if versions is None:
+                return False
+            # The store's versions around our own write: if another writer got in since the last
+            # load, the cached lanes are stale and the next read reloads them
+            before, after = versions
+            self._version = after if before == self._version else None
+            return True
+    
+    @staticmethod
+    def _run(ref, stop: threading.Event, flush_interval: float):
+        # Holds the cache only weakly between flushes so an unused cache can be collected
+        while not stop.wait(flush_interval):
+            cache = ref()
+            if cache is None:
+                return
+            cache.flush()
+            del cache
+    
+    def close(self):
+        """Stop the flusher and write anything still pending"""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        self._finalizer()
 
 
 class TrafficDataManager:
@@ -272,51 +934,107 @@ class TrafficDataManager:
         self.num_lanes = config.get("traffic_density.lanes", 4)
         self.validator = DataValidator(config)
         
-        # Initialize/validate data file
-        self.validator.validate_traffic_data_file(self.data_file)
+        # Lane counts live in Previous_data.txt ("text") or an SQLite database ("sqlite")
+        store = config.get("files.traffic_store", "text")
+        if store == "sqlite":
+            self.store = SQLiteLaneStore(config)
+        elif store == "text":
+            self.store = TextLaneStore(config, self.validator)
+        else:
+            raise ValueError(f"Unknown traffic store: {store}. Supported: text, sqlite")
+        
+        if config.get("files.traffic_cache.enabled", False):
+            self.store = CachedLaneStore(self.store, config.get("files.traffic_cache.flush_interval_seconds", 2.0))
+        
+        # Time allocation is read once (and again on reload) instead of on every classification
+        self._apply_config(config)
+        config.add_reload_listener(self._apply_config)
+        
+        # Optional rolling history; once a lane has min_samples its thresholds come from its own distribution
+        self.history = None
+        self.history_min_samples = config.get("traffic_density.history.min_samples", 30)
+        if config.get("traffic_density.history.enabled", False):
+            from LaneHistory import LaneHistory
+            self.history = LaneHistory.from_config(config)
+    
+    def _apply_config(self, config: ConfigManager):
+        from TrafficLevels import LevelTable
+        self.time_config = config.get("traffic_density.time_allocation")
+        # Without a time allocation only storage works; classification then reports "Error"
+        self.levels = LevelTable(self.time_config) if self.time_config else None
     
     def get_lane_data(self) -> List[int]:
         """Get traffic data for all lanes"""
         try:
-            with open(self.data_file, 'r') as f:
-                lines = f.readlines()
-            
-            data = []
-            for line in lines:
-                try:
-                    data.append(int(line.strip()))
-                except ValueError:
-                    data.append(0)
-            
-            return data
+            return self.store.get_lanes()
         except Exception as e:
-            logger.error(f"Error reading lane data: {e}")
+            logger.error("Error reading lane data: %s", e)
             return [0] * self.num_lanes
     
     def update_lane_data(self, lane: int, pixel_count: int) -> bool:
         """Update traffic data for a specific lane"""
         try:
             if lane < 1 or lane > self.num_lanes:
-                logger.error(f"Invalid lane number: {lane}")
+                logger.error("Invalid lane number: %s", lane)
                 return False
             
-            # Backup before updating
-            self.validator.backup_traffic_data(self.data_file, self.backup_file)
+            self.store.set_lanes({lane: pixel_count})
+            if self.history is not None:
+                self.history.append(lane, pixel_count)
             
-            data = self.get_lane_data()
-            data[lane - 1] = pixel_count
+            lane_logger.info("Lane %s updated with pixel count: %s", lane, pixel_count)
+            return True
+        
+        except Exception as e:
+            logger.error("Error updating lane data: %s", e)
+            return False
+    
+    def update_lanes_data(self, lane_pixels: Dict[int, int]) -> bool:
+        """Update several lanes with a single write"""
+        try:
+            invalid = [lane for lane in lane_pixels if lane < 1 or lane > self.num_lanes]
+            if invalid:
+                logger.error("Invalid lane numbers: %s", invalid)
+                return False
             
-            with open(self.data_file, 'w') as f:
-                for value in data:
-                    f.write(f"{value}\n")
+            self.store.set_lanes(lane_pixels)
+            if self.history is not None:
+                self.history.append_many(lane_pixels)
             
-            logger.info(f"Lane {lane} updated with pixel count: {pixel_count}")
+            lane_logger.info("Lanes updated with pixel counts: %s", lane_pixels)
             return True
         
         except Exception as e:
-            logger.error(f"Error updating lane data: {e}")
+            logger.error("Error updating lane data: %s", e)
             return False
     
+    def flush(self) -> bool:
+        """Write lane updates still held in memory (a no-op unless files.traffic_cache is enabled)"""
+        if isinstance(self.store, CachedLaneStore):
+            return self.store.flush()
+        return True
+    
+    def close(self):
+        """Flush pending updates and release the store"""
+        self.store.close()
+        if self.history is not None:
+            self.history.flush()
+    
+    def reset_lane_data(self) -> bool:
+        """Reset every lane to 0"""
+        try:
+            self.store.reset()
+            logger.info("Traffic data reset")
+            return True
+        except Exception as e:
+            logger.error("Error resetting lane data: %s", e)
+            return False
+    
+    def classify_result(self, result, reference_pixels: int = 0, lane: Optional[int] = None) -> Tuple[str, int]:
+        """Classify an in-memory detection result (anything with white_pixels and lane attributes)"""
+        return self.get_traffic_level(lane if lane is not None else result.lane,
+                                      result.white_pixels, reference_pixels)
+    
     def get_traffic_level(self, lane: int, sample_pixels: int, reference_pixels: int) -> Tuple[str, int]:
         """
         Determine traffic density level and green light time
@@ -330,45 +1048,67 @@ class TrafficDataManager:
             Tuple of (traffic_level_label, green_time_seconds)
         """
         try:
-            data = self.get_lane_data()
-            threshold_4 = data[0] if len(data) > 0 else 0
-            threshold_3 = data[1] if len(data) > 1 else 0
-            threshold_2 = data[2] if len(data) > 2 else 0
-            threshold_1 = data[3] if len(data) > 3 else 0
-            
-            count = 0
-            if sample_pixels >= threshold_4:
-                count += 1
-            if sample_pixels >= threshold_3:
-                count += 1
-            if sample_pixels >= threshold_2:
-                count += 1
-            if sample_pixels >= threshold_1:
-                count += 1
+            data = self._thresholds(lane, self.get_lane_data())
+            level, time = self.levels.classify_one(sample_pixels, data)
             
-            time_config = self.config.get("traffic_density.time_allocation")
-            
-            if count == 4:
-                level = time_config["very_high"]["label"]
-                time = time_config["very_high"]["green_time_seconds"]
-            elif count == 3:
-                level = time_config["high"]["label"]
-                time = time_config["high"]["green_time_seconds"]
-            elif count == 2:
-                level = time_config["medium"]["label"]
-                time = time_config["medium"]["green_time_seconds"]
-            else:
-                level = time_config["low"]["label"]
-                time = time_config["low"]["green_time_seconds"]
-            
-            logger.info(f"Traffic level determined: {level} ({time}s) for lane {lane}")
+            classify_logger.info("Traffic level determined: %s (%ss) for lane %s", level, time, lane)
             return level, time
         
         except Exception as e:
-            logger.error(f"Error determining traffic level: {e}")
+            logger.error("Error determining traffic level: %s", e)
             return "Error", 30
+    
+    def get_traffic_levels(self, lane_pixels: Dict[int, int]) -> Dict[int, Tuple[str, int]]:
+        """
+        Determine traffic level and green light time for several lanes at once
+        
+        Args:
+            lane_pixels: Mapping of lane number to current white pixel count
+        
+        Returns:
+            Mapping of lane number to (traffic_level_label, green_time_seconds)
+        """
+        try:
+            # Lane data and time allocation are read once for all lanes
+            data = self.get_lane_data()
+            levels = {lane: self.levels.classify_one(pixels, self._thresholds(lane, data))
+                      for lane, pixels in lane_pixels.items()}
+            
+            if classify_logger.isEnabledFor(logging.INFO):
+                classify_logger.info("Traffic levels determined: %s",
+                                     ", ".join(f"lane {lane} {level} ({time}s)" for lane, (level, time) in levels.items()))
+            return levels
+        
+        except Exception as e:
+            logger.error("Error determining traffic levels: %s", e)
+            return {lane: ("Error", 30) for lane in lane_pixels}
+    
+    def _thresholds(self, lane: int, data: List[int]) -> List[float]:
+        """Percentiles of the lane's own history when there is enough of it, otherwise the stored lane counts"""
+        if self.history is not None and self.history.size(lane) >= self.history_min_samples:
+            return self.history.thresholds(lane)
+        return data
+    
+    def classify_many(self, samples, lanes=None):
+        """
+        Classify arrays of samples in one vectorized call (offline replays, many frames or lanes)
+        
+        Args:
+            samples: Array of white pixel counts
+            lanes: 1-based lane of each sample; each is compared against its own lane's thresholds.
+                Without lanes every sample uses the stored lane counts, like get_traffic_level.
+        
+        Returns:
+            (level indices, green times) arrays; self.levels.labels_for(indices) gives the labels
+        """
+        data = self.get_lane_data()
+        if lanes is None:
+            return self.levels.classify(samples, data)
+        reference = [self._thresholds(lane, data) for lane in range(1, self.num_lanes + 1)]
+        return self.levels.classify(samples, reference, lanes)
 
 
 # Export main utilities
-__all__ = ['ConfigManager', 'LoggerSetup', 'DataValidator', 'FileManager', 
-           'TrafficDataManager', 'logger', 'config_mgr']
+__all__ = ['ConfigManager', 'DeferredQueueHandler', 'LoggerSetup', 'DataValidator', 'FileManager', 'ReferenceStatsCache', 'AsyncImageWriter',
+           'TextLaneStore', 'SQLiteLaneStore', 'CachedLaneStore',
+           'TrafficDataManager', 'logger', 'config_mgr', 'get_config', 'setup']